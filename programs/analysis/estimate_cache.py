@@ -0,0 +1,161 @@
+"""
+On-disk cache of regression results keyed by the data and the specification.
+
+A key hashes the panel (the file's path, size and modification time, or the content of an
+in-memory frame), the outcome, the sample definition, the regressors, the absorbed and dummied
+fixed effects, the clustering variable and the estimator's source. Anything that changes the
+estimate changes the key, so entries are never updated in place: a stale entry is simply not
+looked up again and ages out.
+
+Each result (coefficients, cluster VCE, t/p, joint F, N, clusters, rank) is one compressed .npz
+file of about 2 KB under CACHE_DIR. A hit touches the file, so its modification time is
+the last use; once the directory exceeds the size bound the least recently used entries are
+deleted. Entries are written under a temporary name and renamed into place, so concurrent runs
+never read a partial file.
+
+Usage:
+  python programs/analysis/estimate_cache.py               # entries, size and bound
+  python programs/analysis/estimate_cache.py --max-mb 16   # evict down to 16 MB
+  python programs/analysis/estimate_cache.py --clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = "data/cache/estimates"
+MAX_BYTES = 64 * 1024 * 1024
+KEY_LENGTH = 24
+SUFFIX = ".npz"
+# Result entries that are arrays; everything else is stored as a 0-d array and read back as a scalar
+ARRAY_FIELDS = ("variables", "coef", "se", "t", "p", "vcov")
+
+
+def _digest(payload: Any) -> str:
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:KEY_LENGTH]
+
+
+def file_key(path: str, **options) -> str:
+    """Key of a data file by path, size and modification time, plus the options it is loaded with."""
+    st = os.stat(path)
+    return _digest({"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime_ns, **options})
+
+
+def frame_key(df: pd.DataFrame) -> str:
+    """Key of a frame's content: columns, dtypes and a hash of every row."""
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return _digest({"columns": [str(c) for c in df.columns], "dtypes": [str(t) for t in df.dtypes],
+                    "rows": hashlib.sha256(rows.tobytes()).hexdigest()})
+
+
+def source_key(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:KEY_LENGTH]
+
+
+def spec_key(data: str, **spec) -> str:
+    """Key of one estimation: the data key and the specification (outcome, sample, regressors, ...)."""
+    return _digest({"data": data, **spec})
+
+
+class ResultCache:
+    """Size-bounded, least-recently-used store of estimation results."""
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + SUFFIX)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored result for key, or None. A stored failure comes back as {'error': message}."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                res = {name: f[name] if name in ARRAY_FIELDS else f[name].item() for name in f.files}
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted by another run since; the result read is still valid
+        if "variables" in res:
+            res["variables"] = [str(v) for v in res["variables"]]
+        self.hits += 1
+        return res
+
+    def put(self, key: str, res: Dict[str, Any]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        arrays = {name: np.asarray(value) for name, value in res.items()}
+        if "variables" in arrays:
+            arrays["variables"] = np.asarray(res["variables"], dtype=str)
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}{SUFFIX}")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def entries(self) -> List[os.DirEntry]:
+        if not os.path.isdir(self.root):
+            return []
+        return [e for e in os.scandir(self.root) if e.is_file() and e.name.endswith(SUFFIX)
+                and not e.name.startswith(".tmp-")]
+
+    def size(self) -> int:
+        return sum(e.stat().st_size for e in self.entries())
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """Delete least recently used entries until the store fits max_bytes; returns the count."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in self.entries()]
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> int:
+        return self.evict(0)
+
+    def summary(self) -> str:
+        return f"{self.hits} cached, {self.misses} estimated"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Inspect or trim the estimation result cache.")
+    ap.add_argument("--dir", default=CACHE_DIR)
+    ap.add_argument("--max-mb", type=float, default=None, help="Evict least recently used entries down to this size.")
+    ap.add_argument("--clear", action="store_true", help="Delete every entry.")
+    args = ap.parse_args()
+
+    cache = ResultCache(args.dir)
+    if args.clear:
+        print(f"Removed {cache.clear()} entries.")
+    elif args.max_mb is not None:
+        print(f"Removed {cache.evict(int(args.max_mb * 1024 * 1024))} entries.")
+    entries = cache.entries()
+    last = max((e.stat().st_mtime for e in entries), default=None)
+    print(f"{args.dir}: {len(entries)} entries, {cache.size() / 2**20:.2f} MB of {cache.max_bytes / 2**20:.0f} MB"
+          + (f", last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(last))}" if last else ""))
+
+
+if __name__ == "__main__":
+    main()
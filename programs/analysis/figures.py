@@ -0,0 +1,306 @@
+"""
+Report figures declared as specs over the cached aggregate tables, rendered in parallel.
+
+Every figure reads one of two precomputed tables from ts_aggregate.py, each built once per change
+of its inputs:
+- rates:  deposit-weighted and winsorized average deposit rates by (cut, group, date)
+- growth: winsorized mean and median quarterly growth of deposits and loans by (cut, group, date)
+
+A FigureSpec names the table, the cut, and the panels with the columns they plot; by_group draws one
+line per group of the cut (large/small banks, divisions, HHI or sophistication terciles) instead of
+one per column. FIGURES holds the report's set.
+
+Each figure's key hashes its spec, the rendering code (this file, matplotlib's version, DPI) and
+the rows and columns of the table it plots. data/processed/figures.json records the key of every
+rendered figure, so a figure whose key is unchanged and whose file exists is skipped. The rest are
+rendered by --jobs worker processes on the Agg backend, each written under a temporary name and
+renamed into place.
+
+Inputs:  data/processed/deposit_interest_rate.csv, bank_credit.csv, instruments.csv (for the cuts)
+Outputs: data/processed/<figure>.png, data/processed/figures.json
+         (and the aggregate caches deposit_rate_aggregates.csv, growth_aggregates.csv)
+
+Usage:
+  python programs/analysis/figures.py                       # render what changed
+  python programs/analysis/figures.py --jobs 4 --force      # render everything
+  python programs/analysis/figures.py --only 'loan_growth*' --list
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from ts_aggregate import (CUTS, DATE_COL, DEPOSIT_FLOW_COLUMNS, LOAN_GROWTH_COLUMNS, RATE_COLUMNS,
+                          load_or_build, load_or_build_growth)
+
+OUT_DIR = "data/processed"
+MANIFEST = os.path.join(OUT_DIR, "figures.json")
+DPI = 150
+FIGSIZE = (14, 5)
+TABLES = {"rates": load_or_build, "growth": load_or_build_growth}
+CUT_TITLES = {
+    "size": "Large vs small banks",
+    "division": "Dominant census division",
+    "hhi_tercile": "County deposit HHI tercile",
+    "sophistication_tercile": "Depositor sophistication tercile",
+}
+LOAN_LABELS = {
+    "d_total_loans": "Total loans",
+    "d_total_loans_not_for_sale": "Loans not held for sale",
+    "d_C&I": "C&I",
+    "d_single_family_loans": "Single-family",
+    "d_multifamily_loans": "Multifamily",
+}
+
+
+@dataclass(frozen=True)
+class Panel:
+    title: str
+    columns: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    # (low, high) columns shaded around the lines; only for figures that are not by_group
+    band: Optional[Tuple[str, str]] = None
+
+
+@dataclass(frozen=True)
+class FigureSpec:
+    name: str  # file name without .png
+    title: str
+    table: str  # key of TABLES
+    panels: Tuple[Panel, ...]
+    cut: str = "all"
+    by_group: bool = False
+    ylabel: str = "Annualized rate"
+    sharey: bool = True
+
+    def columns(self) -> List[str]:
+        cols = []
+        for panel in self.panels:
+            cols += list(panel.columns) + list(panel.band or ())
+        return list(dict.fromkeys(cols))
+
+
+def _rate_panels(columns: Sequence[str], labels: Sequence[str]) -> Tuple[Panel, ...]:
+    return (
+        Panel("Weighted (sum interest / sum deposits)", tuple(f"weighted_{c}" for c in columns), tuple(labels)),
+        Panel("Winsorized simple average across banks", tuple(columns), tuple(labels)),
+    )
+
+
+def _growth_panels(column: str, label: str) -> Tuple[Panel, ...]:
+    return (
+        Panel(f"{label}: winsorized mean across banks", (column,), ("Mean",)),
+        Panel(f"{label}: median across banks", (f"{column}_median",), ("Median",)),
+    )
+
+
+def _slug(column: str) -> str:
+    return column[2:].replace("&", "").lower()
+
+
+def report_figures() -> List[FigureSpec]:
+    """The report's figure set."""
+    figs = [
+        FigureSpec("deposit_interest_rates_timeseries_combined", "Deposit interest rates over time", "rates",
+                   (Panel("Aggregate (sum interest / sum deposits)",
+                          tuple(f"weighted_{c}" for c in RATE_COLUMNS),
+                          ("Weighted: all deposits", "Weighted: interest-bearing")),
+                    Panel("Winsorized simple average across banks", tuple(RATE_COLUMNS),
+                          ("Winsorized simple avg: all deposits", "Winsorized simple avg: interest-bearing")))),
+        FigureSpec("deposit_interest_rate_dispersion", "Cross-bank dispersion of deposit rates", "rates",
+                   tuple(Panel(title, (c,), ("Winsorized mean",), (f"{c}_low", f"{c}_high"))
+                         for title, c in zip(("All deposits", "Interest-bearing deposits"), RATE_COLUMNS)),
+                   ylabel="Annualized rate (band: 0.5%-99.5% quantiles)"),
+        FigureSpec("deposit_flows", "Quarterly growth of average deposits", "growth",
+                   tuple(Panel(title, (c, f"{c}_median"), ("Winsorized mean", "Median"), (f"{c}_low", f"{c}_high"))
+                         for title, c in zip(("All deposits", "Interest-bearing deposits"), DEPOSIT_FLOW_COLUMNS)),
+                   ylabel="QoQ growth (band: 0.5%-99.5% quantiles)"),
+        FigureSpec("loan_growth", "Quarterly loan growth by loan type", "growth",
+                   (Panel("Winsorized mean across banks", tuple(LOAN_GROWTH_COLUMNS),
+                          tuple(LOAN_LABELS[c] for c in LOAN_GROWTH_COLUMNS)),
+                    Panel("Median across banks", tuple(f"{c}_median" for c in LOAN_GROWTH_COLUMNS),
+                          tuple(LOAN_LABELS[c] for c in LOAN_GROWTH_COLUMNS))),
+                   ylabel="QoQ growth"),
+    ]
+    for cut in CUTS:
+        if cut == "all":
+            continue
+        where = CUT_TITLES.get(cut, cut)
+        figs += [
+            FigureSpec(f"deposit_interest_rates_by_{cut}", f"Deposit interest rates: {where}", "rates",
+                       _rate_panels(RATE_COLUMNS[:1], ("",)), cut=cut, by_group=True),
+            FigureSpec(f"interest_bearing_rates_by_{cut}", f"Rates on interest-bearing deposits: {where}", "rates",
+                       _rate_panels(RATE_COLUMNS[1:], ("",)), cut=cut, by_group=True),
+            FigureSpec(f"deposit_flows_by_{cut}", f"Quarterly growth of average deposits: {where}", "growth",
+                       _growth_panels(DEPOSIT_FLOW_COLUMNS[0], "All deposits"), cut=cut, by_group=True,
+                       ylabel="QoQ growth"),
+        ]
+        figs += [
+            FigureSpec(f"{_slug(c)}_growth_by_{cut}", f"Quarterly growth of {LOAN_LABELS[c].lower()}: {where}",
+                       "growth", _growth_panels(c, LOAN_LABELS[c]), cut=cut, by_group=True, ylabel="QoQ growth")
+            for c in ("d_total_loans", "d_C&I")
+        ]
+    return figs
+
+
+FIGURES = report_figures()
+
+
+# -- rendering (runs in the workers) --------------------------------------------------------
+def render(spec: FigureSpec, data: pd.DataFrame, path: str) -> str:
+    """Draw spec from its rows of the table and write the PNG to path; returns path."""
+    fig, axes = plt.subplots(1, len(spec.panels), figsize=FIGSIZE, sharex=True, sharey=spec.sharey, squeeze=False)
+    for ax, panel in zip(axes[0], spec.panels):
+        groups = data.groupby("group", sort=True) if spec.by_group else [(None, data)]
+        for group, ts in groups:
+            ts = ts.sort_values(DATE_COL)
+            for col, label in zip(panel.columns, panel.labels):
+                name = label if group is None else (f"{group}: {label}" if label else group)
+                ax.plot(ts[DATE_COL], ts[col], label=name)
+            if panel.band is not None and group is None:
+                ax.fill_between(ts[DATE_COL], ts[panel.band[0]], ts[panel.band[1]], alpha=0.15, linewidth=0)
+        ax.set_title(panel.title)
+        ax.set_xlabel("Date")
+        ax.set_ylabel(spec.ylabel)
+        ax.tick_params(axis="y", labelleft=True)
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+    fig.suptitle(spec.title)
+    fig.tight_layout()
+    tmp = f"{path}.tmp-{os.getpid()}.png"
+    fig.savefig(tmp, dpi=DPI)
+    plt.close(fig)
+    os.replace(tmp, path)
+    return path
+
+
+def _render_task(task: Tuple[FigureSpec, pd.DataFrame, str]) -> str:
+    return render(*task)
+
+
+# -- change detection -----------------------------------------------------------------------
+def _code_key() -> str:
+    with open(os.path.abspath(__file__), "rb") as f:
+        source = f.read()
+    return hashlib.sha256(source + f"{matplotlib.__version__}|{DPI}".encode()).hexdigest()
+
+
+def figure_data(spec: FigureSpec, table: pd.DataFrame) -> pd.DataFrame:
+    """The rows and columns of the table the figure plots."""
+    rows = table[table["cut"] == spec.cut]
+    return rows[["group", DATE_COL] + spec.columns()].reset_index(drop=True)
+
+
+def figure_key(spec: FigureSpec, data: pd.DataFrame, code: str) -> str:
+    h = hashlib.sha256(code.encode())
+    h.update(json.dumps(asdict(spec), sort_keys=True).encode())
+    # The CSV text, not the bits: a fresh table and the cached one differ in NaN signs
+    h.update(data.to_csv(index=False, float_format="%.17g").encode())
+    return h.hexdigest()[:24]
+
+
+def load_manifest(path: str = MANIFEST) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: Dict[str, str], path: str = MANIFEST) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def select_figures(patterns: Optional[Sequence[str]] = None, figures: Sequence[FigureSpec] = None) -> List[FigureSpec]:
+    figures = FIGURES if figures is None else figures
+    if not patterns:
+        return list(figures)
+    chosen = [f for f in figures if any(fnmatch.fnmatch(f.name, p) for p in patterns)]
+    if not chosen:
+        raise ValueError(f"No figure matches {list(patterns)}; see --list.")
+    return chosen
+
+
+def build(
+    figures: Sequence[FigureSpec] = None,
+    out_dir: str = OUT_DIR,
+    jobs: int = None,
+    force: bool = False,
+    rebuild_tables: bool = False,
+) -> Dict[str, str]:
+    """Render the figures whose key changed (all with force); returns name -> status."""
+    figures = FIGURES if figures is None else list(figures)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, os.path.basename(MANIFEST))
+    manifest = load_manifest(manifest_path)
+    code = _code_key()
+
+    tables = {name: TABLES[name](rebuild=rebuild_tables) for name in sorted({f.table for f in figures})}
+    status, tasks, keys = {}, [], {}
+    for spec in figures:
+        table = tables[spec.table]
+        if any(c not in table for c in spec.columns()) or not (table["cut"] == spec.cut).any():
+            status[spec.name] = "no data"
+            continue
+        data = figure_data(spec, table)
+        path = os.path.join(out_dir, f"{spec.name}.png")
+        keys[spec.name] = figure_key(spec, data, code)
+        if not force and manifest.get(spec.name) == keys[spec.name] and os.path.exists(path):
+            status[spec.name] = "unchanged"
+            continue
+        tasks.append((spec, data, path))
+
+    jobs = min(jobs or os.cpu_count() or 1, len(tasks))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            done = list(pool.map(_render_task, tasks))
+    else:
+        done = [_render_task(t) for t in tasks]
+    for (spec, _, _), _ in zip(tasks, done):
+        manifest[spec.name] = keys[spec.name]
+        status[spec.name] = "rendered"
+    if tasks:
+        _save_manifest(manifest, manifest_path)
+    return status
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Render the report figures from the cached aggregate tables.")
+    ap.add_argument("--only", nargs="+", default=None, metavar="PATTERN",
+                    help="Figure names or shell patterns (e.g. 'loan_growth*').")
+    ap.add_argument("--jobs", type=int, default=None, help="Worker processes (default: one per CPU).")
+    ap.add_argument("--force", action="store_true", help="Render even figures whose key is unchanged.")
+    ap.add_argument("--rebuild-aggregates", action="store_true", help="Recompute the aggregate tables.")
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--list", action="store_true", help="List the selected figures and exit.")
+    args = ap.parse_args()
+
+    figures = select_figures(args.only)
+    if args.list:
+        for f in figures:
+            print(f"{f.name:45s} {f.table:7s} {f.cut}")
+        return
+    start = time.perf_counter()
+    status = build(figures, args.out_dir, args.jobs, args.force, args.rebuild_aggregates)
+    counts = pd.Series(status).value_counts()
+    print(f"{len(figures)} figures: " + ", ".join(f"{n} {s}" for s, n in counts.items())
+          + f" in {time.perf_counter() - start:.1f}s")
+    for name, s in status.items():
+        if s == "no data":
+            print(f"  {name}: no data in the aggregate table (missing input or cut)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Split-sample heterogeneity of the stage-1 regressions: every subgroup estimated in one pass.
+
+For a grouping (small vs large banks, the bank's main census division, terciles of the HHI or
+sophistication exposure, or any panel column), the stage1.do specification is estimated
+separately in every group, and a fully interacted pooled model tests whether the instrument
+coefficients are equal across groups.
+
+One pass instead of one regression per group:
+- Rows are sorted by (group, bank) and demeaned within those cells, so each group's rows form one
+  contiguous block and a bank that switches group (large_bank can change over time) has separate
+  effects in each, exactly as when the sample is filtered to that group.
+- The regressors are built once for all rows. Each group's normal equations are one product over
+  its block; columns collinear within a group (quarters or divisions a group never sees) are
+  replaced by identity rows, so all groups are solved as one (groups, K, K) batch.
+- The fully interacted model with bank x group effects has the same coefficients; its bank-
+  clustered VCE needs only each group's influence of the instrument coefficients summed by bank.
+  Groups' own VCEs come from the same sums (a bank's scores outside a group are zero).
+
+Estimates in each group equal stage1.Stage1Design on that subsample (large_bank reproduces the
+'large' and 'small' samples). Equality tests: per instrument (b_g equal across groups) and jointly
+for all instruments, as Wald F statistics with the pooled G/(G-1) * (N-1)/(N-K) factor and
+(restrictions, banks - 1) degrees of freedom.
+
+Outputs (data/processed/):
+- heterogeneity_stage1.csv: per grouping, group, outcome and instrument: coefficient, SE, t, p, joint
+  F, N and banks.
+- heterogeneity_tests.csv: per grouping and outcome: the equality tests.
+
+Usage:
+  python programs/analysis/heterogeneity.py
+  python programs/analysis/heterogeneity.py --by large_bank division --outcome d_interest_rate_on_deposit
+  python programs/analysis/heterogeneity.py --by BKCLASS                # any column of the panel
+"""
+import argparse
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import stage1
+from stage1 import BANK_COL, BANK_COLUMNS, INSTRUMENTS, QDATE, REGION_CONTROLS, REGIONS
+
+OUTPUTS = {
+    "stage1": "data/processed/heterogeneity_stage1.csv",
+    "tests": "data/processed/heterogeneity_tests.csv",
+}
+TERCILES = ["low", "mid", "high"]
+JOINT = "all"
+
+
+def _bank_tercile(column: str) -> Callable[[pd.DataFrame], pd.Series]:
+    def label(panel: pd.DataFrame) -> pd.Series:
+        values = stage1.bank_values(panel)[column]
+        terciles = pd.qcut(values, 3, labels=TERCILES)
+        return panel[BANK_COL].map(terciles)
+    return label
+
+
+def _main_division(panel: pd.DataFrame) -> pd.Series:
+    """Census division holding the largest share of the bank's deposits."""
+    shares = stage1.bank_values(panel)[REGIONS]
+    ok = shares.notna().all(axis=1)
+    main = pd.Series(np.array(REGIONS, dtype=object)[np.argmax(shares[ok].to_numpy(), axis=1)], index=shares.index[ok])
+    return panel[BANK_COL].map(main)
+
+
+# Grouping name -> per-row labels; any other name is taken as a panel column
+GROUPINGS: Dict[str, Callable[[pd.DataFrame], pd.Series]] = {
+    "large_bank": lambda panel: panel["large_bank"],
+    "division": _main_division,
+    "hhi_tercile": _bank_tercile("hhi_z"),
+    "sophistication_tercile": _bank_tercile("sophistication_index_z"),
+}
+
+
+def group_labels(panel: pd.DataFrame, by: str) -> pd.Series:
+    if by in GROUPINGS:
+        return GROUPINGS[by](panel)
+    if by in panel.columns:
+        return panel[by]
+    raise ValueError(f"Unknown grouping '{by}': not in GROUPINGS or the panel's columns.")
+
+
+class GroupedDesign:
+    """Stage-1 design demeaned within (group, bank) cells; fit() estimates every group at once."""
+
+    def __init__(self, panel: pd.DataFrame, outcome: str, groups: pd.Series) -> None:
+        self.outcome = outcome
+        keep = (panel[outcome].notna() & panel["d_ffr"].notna()
+                & panel["d_interest_rate_on_deposit"].notna() & groups.notna()).to_numpy()
+        rows = panel[keep]
+        self.labels, g_codes = np.unique(groups[keep].astype(str).to_numpy(), return_inverse=True)
+        banks, b_codes = np.unique(rows[BANK_COL].to_numpy(), return_inverse=True)
+
+        # (group, bank) cells in sorted order: groups are contiguous blocks
+        cell = g_codes.astype(np.int64) * len(banks) + b_codes
+        order = np.argsort(cell, kind="stable")
+        cell = cell[order]
+        # reghdfe drops singleton groups of the absorbed effect
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        sizes = np.diff(np.r_[starts, len(cell)])
+        order = order[np.repeat(sizes > 1, sizes)]
+        if not len(order):
+            raise ValueError(f"No non-singleton observations for {outcome}.")
+        rows = rows.iloc[order]
+        self.group_codes = g_codes[order]
+        self.banks, self.bank_codes = np.unique(rows[BANK_COL].to_numpy(), return_inverse=True)
+        _, cell_codes = np.unique(cell[np.repeat(sizes > 1, sizes)], return_inverse=True)
+        n_cells = cell_codes.max() + 1
+
+        self.quarters, q_codes = np.unique(rows[QDATE].to_numpy(), return_inverse=True)
+        dummies = np.zeros((len(rows), len(self.quarters)))
+        dummies[np.arange(len(rows)), q_codes] = 1.0
+        self.y = stage1._within(rows[outcome].to_numpy(dtype=float), cell_codes, n_cells)
+        self.dffr = stage1._within(rows["d_ffr"].to_numpy(dtype=float), cell_codes, n_cells)
+        self.dummies = stage1._within(dummies, cell_codes, n_cells)
+        self.names = (list(INSTRUMENTS) + [f"q{q}" for q in self.quarters[1:]]
+                      + [f"{r}#q{q}" for r in REGION_CONTROLS for q in self.quarters])
+
+    def fit(self, bank_values: pd.DataFrame, report: Sequence[str] = tuple(INSTRUMENTS)) -> Dict:
+        """Per-group results (as stage1.ols_cluster) and the pooled equality tests."""
+        vals = bank_values.reindex(self.banks)[BANK_COLUMNS].to_numpy(dtype=float)
+        rows = np.isfinite(vals).all(axis=1)[self.bank_codes]
+        b, g = self.bank_codes[rows], self.group_codes[rows]
+        v = vals[b]
+        dummies = self.dummies[rows]
+        X = np.concatenate(
+            [v[:, :len(INSTRUMENTS)] * self.dffr[rows, None], dummies[:, 1:]]
+            + [v[:, len(INSTRUMENTS) + i, None] * dummies for i in range(len(REGION_CONTROLS))],
+            axis=1,
+        )
+        y = self.y[rows]
+        n_groups, k = len(self.labels), X.shape[1]
+        bounds = np.searchsorted(g, np.arange(n_groups + 1))
+        blocks = [slice(bounds[i], bounds[i + 1]) for i in range(n_groups)]
+
+        # Normal equations per group, collinear columns padded to identity, solved as one batch
+        gram = np.stack([X[s].T @ X[s] for s in blocks])
+        xty = np.stack([X[s].T @ y[s] for s in blocks])
+        kept = np.zeros((n_groups, k), dtype=bool)
+        for i, s in enumerate(blocks):
+            if s.stop > s.start:
+                kept[i, stage1.independent_columns(gram[i])] = True
+        mask = kept[:, :, None] & kept[:, None, :]
+        eye = np.broadcast_to(np.eye(k), gram.shape)
+        G_inv = np.linalg.inv(np.where(mask, gram, eye * ~kept[:, :, None]))
+        G_inv = np.where(mask, G_inv, 0.0)
+        beta = np.einsum("gij,gj->gi", G_inv, xty * kept)
+        resid = y - np.einsum("nk,nk->n", X, beta[g])
+
+        # Bank sums of each group's influence on the reported coefficients
+        pos = [self.names.index(r) for r in report]
+        n_banks = len(self.banks)
+        U = np.zeros((n_banks, n_groups * len(pos)))
+        for i, s in enumerate(blocks):
+            influence = (X[s] * resid[s, None]) @ G_inv[i][pos].T
+            for j in range(len(pos)):
+                U[:, i * len(pos) + j] = np.bincount(b[s], weights=influence[:, j], minlength=n_banks)
+        meat = U.T @ U
+
+        groups = {}
+        df_terms = []
+        for i, s in enumerate(blocks):
+            n, clusters = s.stop - s.start, len(np.unique(b[s]))
+            k_g = int(kept[i].sum())
+            have = [j for j, p in enumerate(pos) if kept[i, p]]
+            if n == 0 or clusters < 2 or n <= k_g or not have:
+                continue
+            cols = [i * len(pos) + j for j in have]
+            q = clusters / (clusters - 1) * (n - 1) / (n - k_g)
+            coef, V = beta[i, [pos[j] for j in have]], q * meat[np.ix_(cols, cols)]
+            se = np.sqrt(np.diag(V))
+            F = float(coef @ np.linalg.solve(V, coef) / len(have))
+            groups[str(self.labels[i])] = {
+                "variables": [report[j] for j in have], "coef": coef, "se": se, "t": coef / se,
+                "p": 2 * stats.t.sf(np.abs(coef / se), clusters - 1), "F": F,
+                "F_p": float(stats.f.sf(F, len(have), clusters - 1)), "N": n, "banks": clusters, "K": k_g,
+                "vcov": V,
+            }
+            df_terms.append((i, have, k_g))
+
+        n_all, clusters_all = len(y), len(np.unique(b))
+        k_all = sum(k_g for _, _, k_g in df_terms)
+        q_all = clusters_all / (clusters_all - 1) * (n_all - 1) / (n_all - k_all)
+        coef_all = np.array([beta[i, pos[j]] for i, have, _ in df_terms for j in have])
+        cols_all = [i * len(pos) + j for i, have, _ in df_terms for j in have]
+        V_all = q_all * meat[np.ix_(cols_all, cols_all)]
+        index = {(i, j): c for c, (i, j) in enumerate((i, j) for i, have, _ in df_terms for j in have)}
+        tests = []
+        for name, terms in [(report[j], [j]) for j in range(len(pos))] + [(JOINT, list(range(len(pos))))]:
+            R = []
+            for j in terms:
+                members = [index[(i, j)] for i, have, _ in df_terms if j in have]
+                for m in members[1:]:
+                    r = np.zeros(len(coef_all))
+                    r[m], r[members[0]] = 1.0, -1.0
+                    R.append(r)
+            if not R:
+                continue
+            R = np.array(R)
+            d = R @ coef_all
+            F = float(d @ np.linalg.solve(R @ V_all @ R.T, d) / len(R))
+            tests.append({"test": f"equal {name}", "F": F, "df1": len(R), "df2": clusters_all - 1,
+                          "p": float(stats.f.sf(F, len(R), clusters_all - 1)), "groups": len(df_terms),
+                          "N": n_all, "banks": clusters_all})
+        return {"groups": groups, "tests": pd.DataFrame(tests)}
+
+
+def heterogeneity(panel: pd.DataFrame, by: Sequence[str], outcomes: Sequence[str] = stage1.OUTCOMES,
+                  values: Optional[pd.DataFrame] = None) -> Dict[str, pd.DataFrame]:
+    """Per-group stage-1 tables and equality tests for every grouping x outcome."""
+    values = stage1.bank_values(panel) if values is None else values
+    tables, tests = [], []
+    for grouping in by:
+        labels = group_labels(panel, grouping)
+        for outcome in outcomes:
+            try:
+                res = GroupedDesign(panel, outcome, labels).fit(values)
+            except ValueError as err:
+                print(f"Skipping: {err}")
+                continue
+            for group, r in res["groups"].items():
+                tables.append(stage1.results_frame(r, grouping=grouping, group=group, outcome=outcome))
+            t = res["tests"]
+            t.insert(0, "outcome", outcome)
+            t.insert(0, "grouping", grouping)
+            tests.append(t)
+    return {"stage1": pd.concat(tables, ignore_index=True), "tests": pd.concat(tests, ignore_index=True)}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Stage-1 regressions by subgroup with pooled equality tests.")
+    ap.add_argument("--panel", default=stage1.WORKING_PANEL_CSV)
+    ap.add_argument("--by", nargs="+", default=list(GROUPINGS),
+                    help=f"Groupings ({', '.join(GROUPINGS)}) or panel columns.")
+    ap.add_argument("--outcome", nargs="+", default=stage1.OUTCOMES, choices=stage1.OUTCOMES)
+    args = ap.parse_args()
+
+    panel = stage1.load_panel(args.panel)
+    start = time.perf_counter()
+    out = heterogeneity(panel, args.by, args.outcome)
+    print(f"Estimated {out['stage1'].groupby(['grouping', 'group', 'outcome']).ngroups} group models "
+          f"in {time.perf_counter() - start:.2f}s")
+    for name, frame in out.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+        print(f"Saved {OUTPUTS[name]} ({len(frame):,} rows)")
+    print(out["tests"].to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Stage-1 regressions of stage1.do in numpy, for drivers that re-estimate them many times.
+
+Specification (as in stage1.do):
+  y = b_S zS_dffr + b_R zR_dffr + b_H zH_dffr + i.qdate + c.<region>#i.qdate + bank FE
+with zS_dffr = sophistication_index_z * d_ffr (likewise branch_density_z, hhi_z), region shares
+NE..MT (PC omitted), bank fixed effects absorbed and standard errors clustered by bank.
+Following reghdfe: singleton banks are dropped, collinear regressors are omitted in column order,
+and the cluster VCE uses the G/(G-1) * (N-1)/(N-K) small-sample factor with K excluding the
+absorbed bank effects (nested in the clusters).
+
+Instruments and region shares are constant within a bank and d_ffr and the quarter dummies vary
+only by quarter. After the within-bank transform every regressor is therefore a bank-level scalar
+times a precomputed demeaned column: zS * d_ffr becomes zS_b * (d_ffr - mean_b d_ffr). Stage1Design
+keeps those demeaned columns per outcome and sample, so swapping in other instrument values (a
+jackknife fold, a resampled index) never re-demeans the panel.
+
+The panel is loaded under the compact dtype plan of programs/clean/dtypes.py (float32 division
+shares, int32 ids, uint8 flags); the estimation itself runs in float64. --compare-panel re-estimates
+on a second panel, e.g. a --dtypes native build, and reports how far the results move.
+
+Results are cached on disk (estimate_cache.py) by the panel file, the outcome, the sample and the
+specification below, including this file's source. A re-run reads the panel only if some result
+is missing and re-estimates only those; --no-cache always estimates.
+
+Usage:
+  python programs/analysis/stage1.py                    # all outcomes x samples on the working panel
+  python programs/analysis/stage1.py --outcome d_interest_rate_on_deposit --sample all
+  python programs/analysis/stage1.py --no-cache
+  python programs/analysis/stage1.py --panel data/runs/compact/current/working/working_panel.csv \
+      --compare-panel data/runs/native/current/working/working_panel.csv
+"""
+import argparse
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+CLEAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clean")
+if CLEAN_DIR not in sys.path:
+    sys.path.insert(0, CLEAN_DIR)
+
+from dtypes import apply_plan  # noqa: E402
+from estimate_cache import CACHE_DIR, ResultCache, file_key, frame_key, source_key, spec_key  # noqa: E402
+from quarters import QDATE, ensure_qdate, to_qdate  # noqa: E402
+
+WORKING_PANEL_CSV = "data/working/working_panel.csv"
+BANK_COL = "Bank ID"
+DATE_COL = "Date"
+OUTCOMES = [
+    "d_interest_rate_on_deposit",
+    "d_average_interest_bearing_deposit",
+    "d_average_deposit",
+]
+# Interaction name -> bank-level exposure multiplied by d_ffr
+INSTRUMENTS = {
+    "zS_dffr": "sophistication_index_z",
+    "zR_dffr": "branch_density_z",
+    "zH_dffr": "hhi_z",
+}
+REGIONS = ["NE", "MA", "EC", "WC", "SA", "ES", "WS", "MT", "PC"]
+REGION_CONTROLS = REGIONS[:-1]  # PC omitted
+BANK_COLUMNS = list(INSTRUMENTS.values()) + REGIONS
+SAMPLES = {"all": None, "large": 1, "small": 0}  # large_bank value
+WINDOW = ("2022-01-01", "2023-12-31")  # 2022q1-2023q4
+COLLINEAR_TOL = 1e-9
+COMPARE_RTOL = 1e-5  # relative change in coef / se / F tolerated by --compare-panel
+
+
+def independent_columns(gram: np.ndarray, tol: float = COLLINEAR_TOL) -> np.ndarray:
+    """Indices of columns kept in order, skipping any that are (nearly) spanned by earlier ones."""
+    k = gram.shape[0]
+    L = np.zeros((k, k))
+    keep: List[int] = []
+    for j in range(k):
+        if gram[j, j] <= 0:
+            continue
+        lj = np.linalg.solve(L[np.ix_(keep, keep)], gram[keep, j]) if keep else np.zeros(0)
+        resid = gram[j, j] - lj @ lj
+        if resid <= tol * gram[j, j]:
+            continue
+        L[j, keep] = lj
+        L[j, j] = np.sqrt(resid)
+        keep.append(j)
+    return np.array(keep, dtype=int)
+
+
+def _within(values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Subtract group means from each column of values (n,) or (n, k)."""
+    counts = np.bincount(codes, minlength=n_groups).astype(float)
+    v = values.reshape(len(values), -1)
+    means = np.stack([np.bincount(codes, weights=v[:, j], minlength=n_groups) for j in range(v.shape[1])], axis=1)
+    out = v - (means / counts[:, None])[codes]
+    return out.reshape(values.shape)
+
+
+class Stage1Design:
+    """Demeaned panel for one outcome and sample; fit() takes bank-level instrument values."""
+
+    def __init__(self, panel: pd.DataFrame, outcome: str, sample: str = "all") -> None:
+        self.outcome = outcome
+        self.sample = sample
+        rows = panel[panel[outcome].notna() & panel["d_ffr"].notna()
+                     & panel["d_interest_rate_on_deposit"].notna()]
+        if SAMPLES[sample] is not None:
+            rows = rows[rows["large_bank"] == SAMPLES[sample]]
+        # reghdfe drops singleton groups
+        rows = rows[rows.groupby(BANK_COL)[BANK_COL].transform("size") > 1]
+        if rows.empty:
+            raise ValueError(f"No non-singleton observations for {outcome} in sample '{sample}'.")
+
+        self.banks, self.bank_codes = np.unique(rows[BANK_COL].to_numpy(), return_inverse=True)
+        self.quarters, q_codes = np.unique(rows[QDATE].to_numpy(), return_inverse=True)
+        nb, nq = len(self.banks), len(self.quarters)
+        dummies = np.zeros((len(rows), nq))
+        dummies[np.arange(len(rows)), q_codes] = 1.0
+
+        self.y = _within(rows[outcome].to_numpy(dtype=float), self.bank_codes, nb)
+        self.dffr = _within(rows["d_ffr"].to_numpy(dtype=float), self.bank_codes, nb)
+        self.dummies = _within(dummies, self.bank_codes, nb)
+        self.names = (list(INSTRUMENTS) + [f"q{q}" for q in self.quarters[1:]]
+                      + [f"{r}#q{q}" for r in REGION_CONTROLS for q in self.quarters])
+
+    def fit(self, bank_values: pd.DataFrame, z_limit: Optional[float] = None) -> Dict:
+        """Estimate with bank-level instruments and region shares (indexed by bank id).
+
+        Banks missing any value (or with a z-score outside +/- z_limit) drop out whole, which
+        leaves the other banks' demeaned rows unchanged.
+        """
+        vals = bank_values.reindex(self.banks)[BANK_COLUMNS].to_numpy(dtype=float)
+        ok_bank = np.isfinite(vals).all(axis=1)
+        if z_limit is not None:
+            ok_bank &= (np.abs(vals[:, :len(INSTRUMENTS)]) <= z_limit).all(axis=1)
+        rows = ok_bank[self.bank_codes]
+        b = self.bank_codes[rows]
+        v = vals[b]
+
+        dummies = self.dummies[rows]
+        X = np.concatenate(
+            [v[:, :len(INSTRUMENTS)] * self.dffr[rows, None], dummies[:, 1:]]
+            + [v[:, len(INSTRUMENTS) + i, None] * dummies for i in range(len(REGION_CONTROLS))],
+            axis=1,
+        )
+        y = self.y[rows]
+        return ols_cluster(X, y, b, self.names)
+
+
+def ols_cluster(X: np.ndarray, y: np.ndarray, clusters: np.ndarray, names: Sequence[str],
+                report: Sequence[str] = tuple(INSTRUMENTS)) -> Dict:
+    """OLS on already-demeaned data with bank-clustered VCE; returns the `report` coefficients."""
+    n = len(y)
+    gram = X.T @ X
+    keep = independent_columns(gram)
+    Xk = X[:, keep]
+    G_inv = np.linalg.inv(gram[np.ix_(keep, keep)])
+    beta = G_inv @ (Xk.T @ y)
+    resid = y - Xk @ beta
+
+    _, c = np.unique(clusters, return_inverse=True)
+    n_clusters = c.max() + 1 if n else 0
+    scores = np.stack([np.bincount(c, weights=Xk[:, j] * resid, minlength=n_clusters)
+                       for j in range(Xk.shape[1])], axis=1)
+    k = len(keep)
+    q = n_clusters / (n_clusters - 1) * (n - 1) / (n - k)
+    V = q * G_inv @ (scores.T @ scores) @ G_inv
+
+    kept_names = [names[j] for j in keep]
+    pos = [kept_names.index(r) for r in report if r in kept_names]
+    b, Vr = beta[pos], V[np.ix_(pos, pos)]
+    se = np.sqrt(np.diag(Vr))
+    df = n_clusters - 1
+    F = float(b @ np.linalg.solve(Vr, b) / len(pos)) if pos else np.nan
+    return {
+        "variables": [kept_names[p] for p in pos],
+        "coef": b,
+        "se": se,
+        "t": b / se,
+        "p": 2 * stats.t.sf(np.abs(b / se), df),
+        "F": F,
+        "F_p": float(stats.f.sf(F, len(pos), df)) if pos else np.nan,
+        "N": n,
+        "banks": int(n_clusters),
+        "K": k,
+        "vcov": Vr,
+    }
+
+
+def load_panel(path: str = WORKING_PANEL_CSV, compact: bool = True) -> pd.DataFrame:
+    """Working panel restricted to the stage-1 window, one row per bank-quarter, with qdate codes."""
+    panel = pd.read_csv(path)
+    if compact:
+        panel = apply_plan(panel)
+    panel = ensure_qdate(panel, DATE_COL)
+    first, last = (int(q) for q in to_qdate(list(WINDOW)))
+    panel = panel[panel[QDATE].between(first, last).fillna(False).astype(bool)].copy()
+    panel[QDATE] = panel[QDATE].astype(int)
+    dup = panel.duplicated([BANK_COL, QDATE])
+    if dup.any():
+        # instruments are merged on bank id only; several SOD years repeat bank-quarters
+        print(f"Dropping {dup.sum():,} repeated bank-quarters (keeping the first).")
+        panel = panel[~dup]
+    return panel
+
+
+def bank_values(panel: pd.DataFrame) -> pd.DataFrame:
+    """Bank-level instruments and region shares as carried on the panel (first row per bank)."""
+    return panel.groupby(BANK_COL)[BANK_COLUMNS].first()
+
+
+def results_frame(res: Dict, **labels) -> pd.DataFrame:
+    out = pd.DataFrame({
+        "variable": res["variables"], "coef": res["coef"], "se": res["se"], "t": res["t"], "p": res["p"],
+    })
+    for key in ("F", "F_p", "N", "banks"):
+        out[key] = res[key]
+    for i, (key, value) in enumerate(labels.items()):
+        out.insert(i, key, value)
+    return out
+
+
+def specification(outcome: str, sample: str) -> Dict:
+    """Everything besides the panel that a stage-1 result depends on (its cache key)."""
+    return {
+        "outcome": outcome,
+        "sample": {"large_bank": SAMPLES[sample], "not_null": [outcome, "d_ffr", "d_interest_rate_on_deposit"],
+                   "drop_singletons": BANK_COL},
+        "regressors": INSTRUMENTS,
+        "controls": [f"{r}#{QDATE}" for r in REGION_CONTROLS],
+        "absorb": [BANK_COL, QDATE],
+        "cluster": BANK_COL,
+        "collinear_tol": COLLINEAR_TOL,
+        "estimator": source_key(os.path.abspath(__file__)),
+        # load_panel's float32 share plan and qdate derivation
+        "panel_loader": {name: source_key(os.path.join(CLEAN_DIR, f"{name}.py")) for name in ("dtypes", "quarters")},
+    }
+
+
+def estimate(panel: Union[pd.DataFrame, Callable[[], pd.DataFrame]], outcomes: Sequence[str] = OUTCOMES,
+             samples: Sequence[str] = tuple(SAMPLES), cache: Optional[ResultCache] = None,
+             panel_key: Optional[str] = None) -> pd.DataFrame:
+    """Coefficient table for every outcome x sample (samples without observations are skipped).
+
+    With a cache, results are looked up by panel_key (default: a hash of the panel's content) and
+    the specification. panel can then be a function returning the panel, called only on a miss.
+    """
+    if cache is not None and panel_key is None:
+        panel = panel() if callable(panel) else panel
+        panel_key = frame_key(panel)
+    loaded = None if callable(panel) else panel
+    values = None
+    frames = []
+    for outcome in outcomes:
+        for sample in samples:
+            key = spec_key(panel_key, **specification(outcome, sample)) if cache is not None else None
+            res = cache.get(key) if cache is not None else None
+            if res is None:
+                if loaded is None:
+                    loaded = panel()
+                if values is None:
+                    values = bank_values(loaded)
+                try:
+                    res = Stage1Design(loaded, outcome, sample).fit(values)
+                except ValueError as err:
+                    res = {"error": str(err)}
+                if cache is not None:
+                    cache.put(key, res)
+            if "error" in res:
+                print(f"Skipping: {res['error']}")
+                continue
+            frames.append(results_frame(res, outcome=outcome, sample=sample))
+    return pd.concat(frames, ignore_index=True)
+
+
+def estimate_file(path: str, outcomes: Sequence[str] = OUTCOMES, samples: Sequence[str] = tuple(SAMPLES),
+                  compact: bool = True, cache: Optional[ResultCache] = None) -> pd.DataFrame:
+    """estimate() on a panel file, which is read only if the cache lacks a result."""
+    key = file_key(path, compact=compact, window=WINDOW) if cache is not None else None
+    return estimate(lambda: load_panel(path, compact=compact), outcomes, samples, cache, key)
+
+
+def compare_tables(table: pd.DataFrame, other: pd.DataFrame) -> pd.DataFrame:
+    """Largest relative difference of coef, se and F per outcome and sample, and whether N matches."""
+    keys = ["outcome", "sample", "variable"]
+    both = table.merge(other, on=keys, how="outer", suffixes=("", "_other"), indicator=True)
+    rows = []
+    for (outcome, sample), g in both.groupby(["outcome", "sample"], sort=False):
+        row = {"outcome": outcome, "sample": sample, "same_terms": bool((g["_merge"] == "both").all()),
+               "same_N": bool((g["N"] == g["N_other"]).all())}
+        for col in ("coef", "se", "F"):
+            rel = (g[col] - g[f"{col}_other"]).abs() / g[f"{col}_other"].abs().clip(lower=1e-12)
+            row[f"max_rel_{col}"] = rel.max()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Stage-1 regressions (stage1.do) in Python.")
+    ap.add_argument("--panel", default=WORKING_PANEL_CSV)
+    ap.add_argument("--outcome", nargs="+", default=OUTCOMES, choices=OUTCOMES)
+    ap.add_argument("--sample", nargs="+", default=list(SAMPLES), choices=list(SAMPLES))
+    ap.add_argument("--out", default=None, help="Optional CSV for the coefficient table.")
+    ap.add_argument("--native-dtypes", action="store_true", help="Load the panel without the dtype plan.")
+    ap.add_argument("--compare-panel", default=None,
+                    help="Second panel to re-estimate on; reports the largest relative differences.")
+    ap.add_argument("--no-cache", action="store_true", help="Estimate everything; do not read or write the cache.")
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    args = ap.parse_args()
+
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    table = estimate_file(args.panel, args.outcome, args.sample, not args.native_dtypes, cache)
+    with pd.option_context("display.width", 140, "display.max_columns", 20):
+        print(table.to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    if args.out:
+        table.to_csv(args.out, index=False)
+    if cache is not None:
+        print(f"Results: {cache.summary()} ({cache.root}).")
+
+    if args.compare_panel:
+        other = estimate_file(args.compare_panel, args.outcome, args.sample, compact=False, cache=cache)
+        diff = compare_tables(table, other)
+        print(f"\nAgainst {args.compare_panel}:")
+        print(diff.to_string(index=False, float_format=lambda x: f"{x:.2e}"))
+        rel = diff[["max_rel_coef", "max_rel_se", "max_rel_F"]].to_numpy()
+        unchanged = diff["same_terms"].all() and diff["same_N"].all() and bool((rel <= COMPARE_RTOL).all())
+        print(f"Results {'unchanged' if unchanged else 'CHANGED'} (relative tolerance {COMPARE_RTOL:g}).")
+        if not unchanged:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
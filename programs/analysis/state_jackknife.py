@@ -0,0 +1,285 @@
+"""
+Leave-one-state-out jackknife of the instruments and the stage-1 regressions.
+
+For every state, that state's counties and branches are dropped and the instruments are rebuilt
+the way sophistication_index_merge.py and instruments.py build them: county feature z-scores and
+PCA on the remaining counties, then bank-year deposit-weighted sophistication and HHI exposures,
+branch density, census-division deposit shares and the z-scores across bank-years. The stage-1
+regressions of stage1.do are then re-estimated with each fold's instruments.
+
+Nothing is rebuilt from scratch per fold:
+- County PCA: all folds at once from masked feature moments, one batched eigendecomposition of
+  the (folds, 7, 7) correlation matrices (sophistication_stability.correlation_eigh), with
+  components sign-aligned to the full-sample SVD.
+- Instruments: the SOD branches are collapsed once into sparse bank-year x (YEAR, county) matrices
+  of branch weights, branch counts and branch deposits. Dropping a state zeroes its columns, so
+  every fold's exposures are one sparse product against a (counties, folds) mask. County HHI
+  of the remaining counties is unchanged by dropping another state's counties.
+- Stage 1: the demeaned panel of stage1.Stage1Design is built once per outcome and sample and
+  shipped to each worker process once; a fold only swaps in bank-level values.
+
+The "none" fold is the full sample and reproduces instruments.csv. Bank-level values for the
+panel come from one SOD year (--sod-year, default the first, which is the row the working
+panel keeps where its instruments merge on bank id repeats bank-quarters). The panel rows are
+the working panel's; only the |z| <= Z_LIMIT screen is re-applied per fold, while the
+working panel's other sample filters stay as in the full sample.
+
+Inputs: data/raw/ACS.csv, IRS.csv, HMDA.csv, SOD.csv and data/working/working_panel.csv.
+Outputs (data/processed/):
+- state_jackknife_stage1.csv: stage-1 coefficients, SEs and joint F per fold, outcome and sample.
+- state_jackknife_summary.csv: full-sample estimate, jackknife mean and standard error, and the
+  states whose removal moves each coefficient most.
+- state_jackknife_instruments.csv: per fold, what was dropped and how far the index and the
+  bank instruments move (correlation with the full-sample versions).
+
+Usage:
+  python programs/analysis/state_jackknife.py --workers 8
+  python programs/analysis/state_jackknife.py --outcome d_interest_rate_on_deposit --sample all
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import stage1
+from stage1 import CLEAN_DIR  # noqa: F401  (puts programs/clean on sys.path)
+
+import sophistication_index_merge as sim  # noqa: E402
+import sophistication_stability as ss  # noqa: E402
+from instruments import DIVISION_CODE_MAP, STATE_FIPS_TO_USPS, STATE_TO_CENSUS_DIVISION  # noqa: E402
+from working_panel_merge import Z_LIMIT  # noqa: E402
+
+SOD_CSV = "data/raw/SOD.csv"
+OUTPUTS = {
+    "stage1": "data/processed/state_jackknife_stage1.csv",
+    "summary": "data/processed/state_jackknife_summary.csv",
+    "instruments": "data/processed/state_jackknife_instruments.csv",
+}
+FULL_SAMPLE = "none"
+DIVISIONS = list(DIVISION_CODE_MAP.values())
+
+
+def county_pca(X: np.ndarray, keep: np.ndarray) -> Dict[str, np.ndarray]:
+    """County index for every fold; keep is (folds, n_counties) 0/1 with fold 0 the full sample.
+
+    Returns the (n_counties, folds) index, NaN for dropped counties, and PC1's explained share.
+    """
+    n, k = X.shape
+    S1 = keep @ X
+    S2 = (keep @ (X[:, :, None] * X[:, None, :]).reshape(n, k * k)).reshape(len(keep), k, k)
+    mean, sd, vals, vecs = ss.correlation_eigh(S1, S2, keep.sum(axis=1))
+    # Orientation of sophistication_index_merge.py's SVD on the full sample
+    _, _, Vt = np.linalg.svd((X - mean[0]) / sd[0], full_matrices=False)
+    vecs = ss.align(vecs, Vt.T)
+    index = ss.county_index(X, mean, sd, vecs[:, :, 0])
+    index[keep.T == 0] = np.nan
+    return {"index": index, "pc1_share": vals[:, 0] / vals.sum(axis=1)}
+
+
+def sod_matrices(sod: pd.DataFrame) -> Dict:
+    """Bank-year x (YEAR, county) branch matrices and per-column attributes from SOD."""
+    sod = sod[["YEAR", "RSSDID", "DEPDOM", "DEPSUMBR", "STCNTYBR"]].copy()
+    sod["fips"] = sod["STCNTYBR"].astype(str).str.zfill(5)
+    sod["state_fips"] = sod["fips"].str[:2]
+
+    banks = sod[["YEAR", "RSSDID"]].drop_duplicates().sort_values(["YEAR", "RSSDID"]).reset_index(drop=True)
+    cols = sod[["YEAR", "fips", "state_fips"]].drop_duplicates(["YEAR", "fips"])
+    cols = cols.sort_values(["YEAR", "fips"]).reset_index(drop=True)
+    row = pd.MultiIndex.from_frame(banks).get_indexer(pd.MultiIndex.from_frame(sod[["YEAR", "RSSDID"]]))
+    col = pd.MultiIndex.from_frame(cols[["YEAR", "fips"]]).get_indexer(pd.MultiIndex.from_frame(sod[["YEAR", "fips"]]))
+
+    depdom = sod.groupby(["YEAR", "RSSDID"])["DEPDOM"].first()
+    depdom = depdom.reindex(pd.MultiIndex.from_frame(banks)).to_numpy(dtype=float)
+    valid = depdom > 0
+    weight = (sod["DEPSUMBR"] / sod["DEPDOM"]).to_numpy(dtype=float)
+    deposits = sod["DEPSUMBR"].to_numpy(dtype=float)
+    shape = (len(banks), len(cols))
+
+    def matrix(values: np.ndarray) -> sparse.csr_matrix:
+        # NaN branch values drop out of sums, as in the pandas groupby sums of instruments.py
+        return sparse.csr_matrix((np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0), (row, col)), shape=shape)
+
+    # County HHI exactly as instruments.py computes it
+    county_bank = sod.groupby(["YEAR", "fips", "RSSDID"], as_index=False)["DEPSUMBR"].sum()
+    total = county_bank.groupby(["YEAR", "fips"])["DEPSUMBR"].transform("sum")
+    county_bank["sq_share"] = (county_bank["DEPSUMBR"] / total) ** 2
+    hhi = county_bank.groupby(["YEAR", "fips"])["sq_share"].sum()
+
+    division = cols["state_fips"].map(STATE_FIPS_TO_USPS).map(STATE_TO_CENSUS_DIVISION).map(DIVISION_CODE_MAP)
+    return {
+        "banks": banks,
+        "cols": cols,
+        "depdom": depdom,
+        "valid": valid,
+        "weights": matrix(np.where(valid[row], weight, 0.0)),
+        "counts": matrix(np.ones(len(sod))),
+        "deposits": matrix(deposits),
+        "hhi": hhi.reindex(pd.MultiIndex.from_frame(cols[["YEAR", "fips"]])).to_numpy(dtype=float),
+        "division": np.array([DIVISIONS.index(d) if isinstance(d, str) else -1 for d in division]),
+    }
+
+
+def _zscore(x: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Column-wise z-scores over the bank-years present in each fold (ddof=1, NaN-aware)."""
+    x = np.where(present, x, np.nan)
+    return (x - np.nanmean(x, axis=0)) / np.nanstd(x, axis=0, ddof=1)
+
+
+def fold_instruments(m: Dict, county_index: np.ndarray, col_county: np.ndarray, keep: np.ndarray) -> Dict[str, np.ndarray]:
+    """Bank-year instruments for every fold; keep is the (n_cols, folds) 0/1 column mask."""
+    present = (m["counts"] @ keep) > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Sophistication: weights renormalized over counties with an index
+        idx = np.where(col_county[:, None] >= 0, county_index[np.maximum(col_county, 0)], np.nan) * keep
+        has = ~np.isnan(idx)
+        num, den = m["weights"] @ np.where(has, idx, 0.0), m["weights"] @ has.astype(float)
+        soph = np.where(den > 0, num / den, np.nan)
+        # HHI exposure over all remaining counties
+        num, den = m["weights"] @ (m["hhi"][:, None] * keep), m["weights"] @ keep
+        hhi = np.where(den > 0, num / den, np.nan)
+        # Branches per $1B of domestic deposits
+        density = np.where(m["valid"][:, None], (m["counts"] @ keep) / (m["depdom"][:, None] / 1e9), np.nan)
+
+        onehot = (m["division"][:, None] == np.arange(len(DIVISIONS))[None, :]).astype(float)
+        div_dep = np.stack([m["deposits"] @ (keep * onehot[:, [d]]) for d in range(len(DIVISIONS))], axis=2)
+        div_any = np.stack([m["counts"] @ (keep * onehot[:, [d]]) for d in range(len(DIVISIONS))], axis=2).sum(axis=2) > 0
+        shares = np.where(m["valid"][:, None, None], div_dep / m["depdom"][:, None, None], 0.0)
+        shares = np.where(div_any[:, :, None], shares, np.nan)
+
+    out = {
+        "sophistication_index_z": _zscore(soph, present),
+        "branch_density_z": _zscore(density, present),
+        "hhi_z": _zscore(hhi, present),
+    }
+    for d, code in enumerate(DIVISIONS):
+        out[code] = np.where(present, shares[:, :, d], np.nan)
+    return out
+
+
+_DESIGNS: List[stage1.Stage1Design] = []
+
+
+def _init_worker(designs: List[stage1.Stage1Design]) -> None:
+    global _DESIGNS
+    _DESIGNS = designs
+
+
+def _fit_fold(fold: str, values: pd.DataFrame) -> pd.DataFrame:
+    frames = []
+    for design in _DESIGNS:
+        res = design.fit(values, z_limit=Z_LIMIT)
+        frames.append(stage1.results_frame(res, fold=fold, outcome=design.outcome, sample=design.sample))
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Full-sample estimate against the leave-one-state-out distribution of each coefficient."""
+    keys = ["outcome", "sample", "variable"]
+    full = results[results["fold"] == FULL_SAMPLE].set_index(keys)["coef"].rename("estimate")
+    folds = results[(results["fold"] != FULL_SAMPLE) & np.isfinite(results["coef"])]
+    rows = []
+    for key, g in folds.groupby(keys):
+        n = len(g)
+        dev = g["coef"] - g["coef"].mean()
+        lo, hi = g.loc[g["coef"].idxmin()], g.loc[g["coef"].idxmax()]
+        rows.append({
+            **dict(zip(keys, key)),
+            "estimate": full.get(key, np.nan),
+            "jackknife_mean": g["coef"].mean(),
+            "jackknife_se": np.sqrt((n - 1) / n * (dev ** 2).sum()),
+            "min": lo["coef"], "min_fold": lo["fold"],
+            "max": hi["coef"], "max_fold": hi["fold"],
+            "n_folds": n,
+        })
+    return pd.DataFrame(rows)
+
+
+def run(outcomes: List[str] = stage1.OUTCOMES, samples: List[str] = list(stage1.SAMPLES),
+        sod_year: Optional[int] = None, workers: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+    t0 = time.perf_counter()
+    fips, X = ss.county_features(**sim.load_inputs())
+    m = sod_matrices(pd.read_csv(SOD_CSV))
+    cols, banks = m["cols"], m["banks"]
+
+    county_state = fips.str[:2].to_numpy()
+    states = sorted(set(cols["state_fips"]) | set(county_state))
+    labels = [FULL_SAMPLE] + [STATE_FIPS_TO_USPS.get(s, s) for s in states]
+    drop = np.array([None] + states, dtype=object)
+
+    keep_counties = (county_state[None, :] != drop[:, None]).astype(float)  # (folds, n_counties)
+    keep_cols = (cols["state_fips"].to_numpy()[:, None] != drop[None, :]).astype(float)  # (n_cols, folds)
+    pca = county_pca(X, keep_counties)
+    col_county = pd.Index(fips).get_indexer(cols["fips"])
+    inst = fold_instruments(m, pca["index"], col_county, keep_cols)
+    print(f"Rebuilt instruments for {len(labels)} folds over {len(banks):,} bank-years "
+          f"in {time.perf_counter() - t0:.1f}s")
+
+    year = int(banks["YEAR"].min()) if sod_year is None else sod_year
+    rows = np.flatnonzero(banks["YEAR"].to_numpy() == year)
+    if not len(rows):
+        raise ValueError(f"SOD year {year} is not in {SOD_CSV}.")
+    ids = banks["RSSDID"].to_numpy()[rows]
+    fold_values = {
+        label: pd.DataFrame({c: inst[c][rows, f] for c in stage1.BANK_COLUMNS}, index=ids)
+        for f, label in enumerate(labels)
+    }
+
+    panel = stage1.load_panel()
+    designs = []
+    for outcome in outcomes:
+        for sample in samples:
+            try:
+                designs.append(stage1.Stage1Design(panel, outcome, sample))
+            except ValueError as err:
+                print(f"Skipping: {err}")
+
+    t1 = time.perf_counter()
+    if workers == 1:
+        _init_worker(designs)
+        parts = [_fit_fold(label, fold_values[label]) for label in labels]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(designs,)) as pool:
+            parts = list(pool.map(_fit_fold, labels, [fold_values[label] for label in labels]))
+    results = pd.concat(parts, ignore_index=True)
+    print(f"Estimated {len(designs)} stage-1 specifications x {len(labels)} folds "
+          f"in {time.perf_counter() - t1:.1f}s")
+
+    base = {c: inst[c][:, 0] for c in stage1.INSTRUMENTS.values()}
+    diag = pd.DataFrame({
+        "fold": labels,
+        "counties_dropped": (1 - keep_counties).sum(axis=1).astype(int),
+        "branch_columns_dropped": (1 - keep_cols).sum(axis=0).astype(int),
+        "pc1_explained_variance_ratio": pca["pc1_share"],
+        "corr_county_index": [
+            pd.Series(pca["index"][:, f]).corr(pd.Series(pca["index"][:, 0])) for f in range(len(labels))
+        ],
+    })
+    for c, b in base.items():
+        diag[f"corr_{c}"] = [pd.Series(inst[c][:, f]).corr(pd.Series(b)) for f in range(len(labels))]
+    return {"stage1": results, "summary": summarize(results), "instruments": diag}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Leave-one-state-out jackknife of the instruments and stage 1.")
+    ap.add_argument("--outcome", nargs="+", default=stage1.OUTCOMES, choices=stage1.OUTCOMES)
+    ap.add_argument("--sample", nargs="+", default=list(stage1.SAMPLES), choices=list(stage1.SAMPLES))
+    ap.add_argument("--sod-year", type=int, default=None,
+                    help="SOD year supplying bank-level instruments (default: the first in SOD.csv).")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    args = ap.parse_args()
+
+    out = run(args.outcome, args.sample, args.sod_year, args.workers)
+    for name, frame in out.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+        print(f"Saved {OUTPUTS[name]} ({len(frame):,} rows)")
+
+    cols = ["outcome", "sample", "variable", "estimate", "jackknife_se", "min_fold", "max_fold"]
+    print(out["summary"][cols].to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Vectorized time-series aggregation of bank deposit rates, by date and by bank cuts.
+
+One call produces a long table with, for every (cut, group, date):
+- deposit-weighted rates (sum implied interest / sum average deposits, annualized);
+- the 0.5% / 99.5% cross-bank quantile bounds of each rate;
+- the winsorized simple average across banks.
+
+All cuts are stacked and handled in the same vectorized pass: group codes come from one
+factorize, quantiles from one lexsort with linear interpolation (identical to Series.quantile),
+and sums/means from np.bincount. No Python function runs per group.
+
+Cuts (bank attributes come from data/processed/instruments.csv, latest YEAR per bank):
+- all:                    every bank
+- size:                   'large' / 'small' (ASSET above / below ASSET_LARGE_THRESHOLD)
+- division:               census division holding the largest share of the bank's deposits
+- hhi_tercile:            terciles of hhi_z across banks
+- sophistication_tercile: terciles of sophistication_index_z across banks
+
+A second table over the same (cut, group, date) cells holds flows: the winsorized mean and the
+median across banks of the quarterly growth of average deposits (deposit_interest_rate.csv) and of
+loans (bank_credit.csv), with the same quantile bounds.
+
+The tables are cached in data/processed/deposit_rate_aggregates.csv and growth_aggregates.csv,
+each with a JSON sidecar recording the inputs' size and mtime and the parameters; load_or_build
+and load_or_build_growth only recompute when these change. figures.py renders from them.
+"""
+import json
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEPOSIT_INTEREST_RATE_CSV = "data/processed/deposit_interest_rate.csv"
+INSTRUMENTS_CSV = "data/processed/instruments.csv"
+BANK_CREDIT_CSV = "data/processed/bank_credit.csv"
+AGGREGATES_CSV = "data/processed/deposit_rate_aggregates.csv"
+GROWTH_CSV = "data/processed/growth_aggregates.csv"
+
+BANK_COL = "rssd9001"
+DATE_COL = "rssd9999"
+RATE_COLUMNS = ["interest_rate_on_deposit", "interest_rate_on_interest_bearing_deposit"]
+# Quarterly growth rates aggregated into the flows table, by the file they come from
+DEPOSIT_FLOW_COLUMNS = ["d_average_deposit", "d_average_interest_bearing_deposit"]
+LOAN_GROWTH_COLUMNS = ["d_total_loans", "d_total_loans_not_for_sale", "d_C&I",
+                       "d_single_family_loans", "d_multifamily_loans"]
+WINSOR_Q_LOW = 0.005
+WINSOR_Q_HIGH = 0.995
+# Same size threshold as working_panel_merge.py (ASSET is in thousands of dollars)
+ASSET_LARGE_THRESHOLD = 1_000_000
+DIVISION_CODES = ["NE", "MA", "EC", "WC", "SA", "ES", "WS", "MT", "PC"]
+CUTS = ("all", "size", "division", "hhi_tercile", "sophistication_tercile")
+TERCILE_LABELS = ["low", "mid", "high"]
+
+
+def grouped_quantiles(values: np.ndarray, codes: np.ndarray, n_groups: int,
+                      qs: Sequence[float]) -> np.ndarray:
+    """(n_groups, len(qs)) quantiles of values within each group code, NaNs skipped.
+
+    Linear interpolation with the same arithmetic as np.percentile, so results match
+    groupby(...).transform(lambda s: s.quantile(q)) exactly. Empty groups give NaN.
+    """
+    ok = ~np.isnan(values)
+    v, c = values[ok], codes[ok]
+    order = np.lexsort((v, c))
+    v, c = v[order], c[order]
+    counts = np.bincount(c, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    out = np.full((n_groups, len(qs)), np.nan)
+    has = counts > 0
+    n = counts[has]
+    for j, q in enumerate(qs):
+        # pandas passes q * 100 to np.percentile, which divides by 100 again
+        virtual = (q * 100.0 / 100.0) * (n - 1)
+        prev = np.floor(virtual)
+        gamma = virtual - prev
+        lo = starts[has] + prev.astype(np.int64)
+        hi = starts[has] + np.minimum(prev.astype(np.int64) + 1, n - 1)
+        a, b = v[lo], v[hi]
+        diff = b - a
+        out[has, j] = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+    return out
+
+
+def _group_sum(codes: np.ndarray, x: np.ndarray, n_groups: int) -> np.ndarray:
+    return np.bincount(codes, weights=np.nan_to_num(x), minlength=n_groups)
+
+
+def _group_count(codes: np.ndarray, x: np.ndarray, n_groups: int) -> np.ndarray:
+    return np.bincount(codes, weights=~np.isnan(x), minlength=n_groups)
+
+
+def bank_cuts(instruments: pd.DataFrame) -> pd.DataFrame:
+    """One row per bank (rssd9001) with the non-trivial cut labels."""
+    inst = instruments.sort_values("YEAR").drop_duplicates("RSSDID", keep="last")
+    out = pd.DataFrame({BANK_COL: inst["RSSDID"].to_numpy()})
+    out["size"] = np.where(inst["ASSET"].to_numpy() > ASSET_LARGE_THRESHOLD, "large", "small")
+    out.loc[inst["ASSET"].isna().to_numpy(), "size"] = np.nan
+
+    shares = inst[DIVISION_CODES].to_numpy(dtype=float)
+    dominant = np.array(DIVISION_CODES, dtype=object)[np.nanargmax(np.nan_to_num(shares, nan=-1), axis=1)]
+    out["division"] = np.where(np.nansum(shares, axis=1) > 0, dominant, None)
+
+    for cut, col in (("hhi_tercile", "hhi_z"), ("sophistication_tercile", "sophistication_index_z")):
+        out[cut] = pd.qcut(inst[col].to_numpy(), 3, labels=TERCILE_LABELS).astype(object)
+    return out
+
+
+def _cells(df: pd.DataFrame, cuts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """Cell code and row index of every (cut, group, date) membership of df's rows, and the cells.
+
+    A row enters each requested cut once (under its group), so rows repeat across cuts; rows
+    without a group in a cut or without a date are left out of that cut.
+    """
+    n = len(df)
+    dates = pd.to_datetime(df[DATE_COL], errors="coerce").to_numpy()
+    dated = ~np.isnat(dates)
+    rows, cut_labels, group_labels = [], [], []
+    for cut in cuts:
+        if cut == "all":
+            labels = np.full(n, "all", dtype=object)
+        else:
+            labels = df[cut].to_numpy(dtype=object)
+        keep = np.flatnonzero(pd.notna(labels) & dated)
+        rows.append(keep)
+        cut_labels.append(np.full(keep.size, cut, dtype=object))
+        group_labels.append(labels[keep].astype(str))
+    rows = np.concatenate(rows)
+    key = pd.MultiIndex.from_arrays([
+        np.concatenate(cut_labels),
+        np.concatenate(group_labels),
+        dates[rows],
+    ])
+    # Every component is present, so every row gets a cell
+    codes, uniques = key.factorize()
+    out = pd.DataFrame({
+        "cut": uniques.get_level_values(0),
+        "group": uniques.get_level_values(1),
+        DATE_COL: uniques.get_level_values(2),
+    })
+    return codes, rows, out
+
+
+def aggregate(
+    df: pd.DataFrame,
+    cuts: Sequence[str] = ("all",),
+    lower: float = WINSOR_Q_LOW,
+    upper: float = WINSOR_Q_HIGH,
+) -> pd.DataFrame:
+    """Long aggregate table over (cut, group, date) for bank-quarter rows in df.
+
+    df needs rssd9999, the two rate columns, average_deposit and
+    average_interest_bearing_deposit, plus one column per requested cut other than 'all'.
+    Rows are bank-quarters and must be unique by (rssd9001, rssd9999).
+    """
+    codes, rows, out = _cells(df, cuts)
+    g = len(out)
+
+    # Deposit-weighted aggregate: total implied interest / total average deposits
+    rate = df["interest_rate_on_deposit"].to_numpy(dtype=float)[rows]
+    avg_dep = df["average_deposit"].to_numpy(dtype=float)[rows]
+    avg_ib = df["average_interest_bearing_deposit"].to_numpy(dtype=float)[rows]
+    total_interest = _group_sum(codes, rate * avg_dep / 4, g)
+    total_dep = _group_sum(codes, avg_dep, g)
+    total_ib = _group_sum(codes, avg_ib, g)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["weighted_interest_rate_on_deposit"] = total_interest / total_dep * 4
+        out["weighted_interest_rate_on_interest_bearing_deposit"] = total_interest / total_ib * 4
+    out["total_avg_deposit"] = total_dep
+
+    # Cross-bank quantile bounds and winsorized simple averages
+    for col in RATE_COLUMNS:
+        v = df[col].to_numpy(dtype=float)[rows]
+        bounds = grouped_quantiles(v, codes, g, [lower, upper])
+        lo, hi = bounds[codes, 0], bounds[codes, 1]
+        clipped = np.where(v < lo, lo, np.where(v > hi, hi, v))
+        count = _group_count(codes, v, g)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[col] = _group_sum(codes, clipped, g) / count
+        out[f"{col}_low"] = bounds[:, 0]
+        out[f"{col}_high"] = bounds[:, 1]
+        out[f"n_{col}"] = count.astype(np.int64)
+
+    return out.sort_values(["cut", "group", DATE_COL]).reset_index(drop=True)
+
+
+def aggregate_growth(
+    df: pd.DataFrame,
+    columns: Sequence[str],
+    cuts: Sequence[str] = ("all",),
+    lower: float = WINSOR_Q_LOW,
+    upper: float = WINSOR_Q_HIGH,
+) -> pd.DataFrame:
+    """Winsorized mean, median and quantile bounds of growth columns over (cut, group, date).
+
+    Infinite growth (from a zero level, where the clean stages already give NaN) counts as
+    missing. Same row requirements as aggregate().
+    """
+    codes, rows, out = _cells(df, cuts)
+    g = len(out)
+    for col in columns:
+        v = df[col].to_numpy(dtype=float)[rows]
+        v = np.where(np.isinf(v), np.nan, v)
+        bounds = grouped_quantiles(v, codes, g, [lower, 0.5, upper])
+        lo, hi = bounds[codes, 0], bounds[codes, 2]
+        clipped = np.where(v < lo, lo, np.where(v > hi, hi, v))
+        count = _group_count(codes, v, g)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[col] = _group_sum(codes, clipped, g) / count
+        out[f"{col}_median"] = bounds[:, 1]
+        out[f"{col}_low"] = bounds[:, 0]
+        out[f"{col}_high"] = bounds[:, 2]
+        out[f"n_{col}"] = count.astype(np.int64)
+    return out.sort_values(["cut", "group", DATE_COL]).reset_index(drop=True)
+
+
+def _signature(paths: List[str], **params) -> Dict:
+    files = {}
+    for p in paths:
+        if os.path.exists(p):
+            st = os.stat(p)
+            files[p] = [st.st_size, st.st_mtime_ns]
+    return {"inputs": files, "params": params}
+
+
+def _cached(cache_csv: str, sig: Dict, build: Callable[[], pd.DataFrame], rebuild: bool) -> pd.DataFrame:
+    """Table from cache_csv if its sidecar matches sig, else build() written there with sig."""
+    sidecar = cache_csv + ".json"
+    if not rebuild and os.path.exists(cache_csv) and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            if json.load(f) == sig:
+                # round_trip: a cached table is bit-identical to a fresh one, so data hashes agree
+                return pd.read_csv(cache_csv, parse_dates=[DATE_COL], dtype={"group": str},
+                                   float_precision="round_trip")
+    table = build()
+    table.to_csv(cache_csv, index=False)
+    with open(sidecar, "w") as f:
+        json.dump(sig, f, indent=2)
+    return table
+
+
+def _available_cuts(cuts: Sequence[str], instruments_csv: str) -> List[str]:
+    cuts = list(cuts)
+    if not os.path.exists(instruments_csv):
+        cuts = [c for c in cuts if c == "all"]
+    return cuts
+
+
+def _with_cuts(df: pd.DataFrame, cuts: Sequence[str], instruments_csv: str) -> pd.DataFrame:
+    extra = [c for c in cuts if c != "all"]
+    if extra:
+        df = df.merge(bank_cuts(pd.read_csv(instruments_csv))[[BANK_COL] + extra], on=BANK_COL, how="left")
+    return df
+
+
+def load_or_build(
+    deposit_csv: str = DEPOSIT_INTEREST_RATE_CSV,
+    instruments_csv: str = INSTRUMENTS_CSV,
+    cache_csv: str = AGGREGATES_CSV,
+    cuts: Sequence[str] = CUTS,
+    rebuild: bool = False,
+) -> pd.DataFrame:
+    """Aggregate table from the cache if inputs and parameters are unchanged, else rebuilt."""
+    cuts = _available_cuts(cuts, instruments_csv)
+    sig = _signature([deposit_csv, instruments_csv], cuts=cuts, lower=WINSOR_Q_LOW, upper=WINSOR_Q_HIGH)
+    return _cached(cache_csv, sig, lambda: aggregate(
+        _with_cuts(pd.read_csv(deposit_csv), cuts, instruments_csv), cuts), rebuild)
+
+
+def load_or_build_growth(
+    deposit_csv: str = DEPOSIT_INTEREST_RATE_CSV,
+    credit_csv: str = BANK_CREDIT_CSV,
+    instruments_csv: str = INSTRUMENTS_CSV,
+    cache_csv: str = GROWTH_CSV,
+    cuts: Sequence[str] = CUTS,
+    rebuild: bool = False,
+) -> pd.DataFrame:
+    """Deposit flow and loan growth table from the cache if unchanged, else rebuilt.
+
+    Either input may be missing; its columns are then absent from the table.
+    """
+    cuts = _available_cuts(cuts, instruments_csv)
+    sig = _signature([deposit_csv, credit_csv, instruments_csv], cuts=cuts,
+                     lower=WINSOR_Q_LOW, upper=WINSOR_Q_HIGH)
+
+    def build() -> pd.DataFrame:
+        keys = ["cut", "group", DATE_COL]
+        tables = []
+        for path, columns in ((deposit_csv, DEPOSIT_FLOW_COLUMNS), (credit_csv, LOAN_GROWTH_COLUMNS)):
+            if os.path.exists(path):
+                df = pd.read_csv(path, usecols=[BANK_COL, DATE_COL] + columns)
+                tables.append(aggregate_growth(_with_cuts(df, cuts, instruments_csv), columns, cuts))
+        if not tables:
+            raise ValueError(f"Neither {deposit_csv} nor {credit_csv} exists; run the clean stages first.")
+        table = tables[0]
+        for other in tables[1:]:
+            table = table.merge(other, on=keys, how="outer")
+        return table.sort_values(keys).reset_index(drop=True)
+
+    return _cached(cache_csv, sig, build, rebuild)
+
+
+def select(table: pd.DataFrame, cut: str = "all", group: Optional[str] = None) -> pd.DataFrame:
+    """Rows of one cut (and optionally one group), ordered by date."""
+    out = table[table["cut"] == cut]
+    if group is not None:
+        out = out[out["group"] == group]
+    return out.sort_values(DATE_COL)
@@ -1,40 +1,76 @@
+from typing import Optional
+
 import pandas as pd
 import numpy as np
 
-rcon1 = pd.read_csv("data/raw/rcon_credit_1.csv", parse_dates=["rssd9999"])
-# Ensure consistent date format for merge key
-rcon1['rssd9999'] = pd.to_datetime(rcon1['rssd9999'], errors='coerce').dt.normalize()
+from quarters import QDATE, bank_lag, parse_dates, to_qdate
+
+INPUTS = {
+    "rcon1": "data/raw/rcon_credit_1.csv",
+    "rcon2": "data/raw/rcon_credit_2.csv",
+}
+OUTPUTS = {"bank_credit": "data/processed/bank_credit.csv"}
+# Loan levels whose QoQ change is computed; the next quarter's lags read them from a bank's last row
+LEVEL_COLUMNS = ['single_family_loans', 'multifamily_loans', 'total_loans', 'total_loans_not_for_sale', 'C&I']
+
+
+def load_inputs(names=None, source="csv") -> dict:
+    """Raw inputs by name: the WRDS CSVs, or the FFIEC bulk dataset (call_bulk.py) if source='bulk'."""
+    names = list(INPUTS) if names is None else names
+    if source == "bulk":
+        from call_bulk import load_extracts
+        return load_extracts({name: INPUTS[name] for name in names})
+    return {name: pd.read_csv(INPUTS[name], parse_dates=["rssd9999"]) for name in names}
+
+
+def latest_submission(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (rssd9001, rssd9999, rssd9050), the latest submission, without the submission date."""
+    # Ensure consistent date format for merge key
+    df['rssd9999'] = parse_dates(df['rssd9999'])
+
+    # De-dupe by keys, keeping the latest submission by date
+    df['rssdsubmissiondate'] = pd.to_datetime(df['rssdsubmissiondate'], errors='coerce')
+    df.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
+    df = df.drop_duplicates(subset=['rssd9001', 'rssd9999', 'rssd9050'], keep='last')
+    return df.drop(columns=['rssdsubmissiondate'])
+
+
+def loan_growth(rcon1: pd.DataFrame, rcon2: pd.DataFrame, prior: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Loan levels, their QoQ changes and the quarter code per bank.
+
+    prior holds each bank's LEVEL_COLUMNS in its last row before the first quarter of rcon1.
+    """
+    # Merge on rssd9001 and rssd9999 after de-duplication (column exists in both)
+    df = rcon1.merge(rcon2, on=["rssd9001", "rssd9050", "rssd9999"], how="left")
+    df.drop(columns=['rcon5569', 'rcon5573', 'rcon5567', 'rcon5575', 'rcon5571', 'rcon5565'], inplace=True)
+
+    df.rename(columns={'rcon3465': 'single_family_loans', 'rcon1460': 'multifamily_loans', 'rcon2122': 'total_loans', 'rcon1766':'C&I', 'rconb528':'total_loans_not_for_sale', 'rcon6999':'small_buz_lending_flag'}, inplace=True)
+
+    df['multifamily_loans'] = df['multifamily_loans'].fillna(0)
 
-# De-dupe by keys, keeping the latest submission by date
-rcon1['rssdsubmissiondate'] = pd.to_datetime(rcon1['rssdsubmissiondate'], errors='coerce')
-rcon1.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
-rcon1 = rcon1.drop_duplicates(subset=['rssd9001', 'rssd9999', 'rssd9050'], keep='last')
-rcon1.drop(columns=['rssdsubmissiondate'], inplace=True)
+    # Ensure chronological order for QoQ computations
+    df.sort_values(['rssd9001', 'rssd9999', 'rssd9050'], inplace=True)
 
-rcon2 = pd.read_csv("data/raw/rcon_credit_2.csv", parse_dates=["rssd9999"])
-rcon2['rssd9999'] = pd.to_datetime(rcon2['rssd9999'], errors='coerce').dt.normalize()
-rcon2['rssdsubmissiondate'] = pd.to_datetime(rcon2['rssdsubmissiondate'], errors='coerce')
-rcon2.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
-rcon2 = rcon2.drop_duplicates(subset=['rssd9001', 'rssd9999', 'rssd9050'], keep='last')
-rcon2.drop(columns=['rssdsubmissiondate'], inplace=True)
+    # Compute QoQ pct change for requested variables
+    for col in LEVEL_COLUMNS:
+        prev = bank_lag(df, col, prior)
+        df[f'd_{col}'] = np.where(prev != 0, (df[col] - prev) / prev, np.nan)
 
-# Merge on rssd9001 and rssd9999 after de-duplication (column exists in both)
-df = rcon1.merge(rcon2, on=["rssd9001", "rssd9050", "rssd9999"], how="left")
-df.drop(columns=['rcon5569', 'rcon5573', 'rcon5567', 'rcon5575', 'rcon5571', 'rcon5565'], inplace=True)
+    # Integer quarter code: the join key downstream
+    df.insert(df.columns.get_loc('rssd9999') + 1, QDATE, to_qdate(df['rssd9999']))
+    return df
 
-df.rename(columns={'rcon3465': 'single_family_loans', 'rcon1460': 'multifamily_loans', 'rcon2122': 'total_loans', 'rcon1766':'C&I', 'rconb528':'total_loans_not_for_sale', 'rcon6999':'small_buz_lending_flag'}, inplace=True)
 
-df['multifamily_loans'] = df['multifamily_loans'].fillna(0)
+def build(rcon1: pd.DataFrame, rcon2: pd.DataFrame) -> pd.DataFrame:
+    """Quarter-over-quarter loan growth per bank. Raw inputs are modified in place."""
+    df = loan_growth(latest_submission(rcon1), latest_submission(rcon2))
+    return df.drop(columns=LEVEL_COLUMNS)
 
-# Ensure chronological order for QoQ computations
-df.sort_values(['rssd9001', 'rssd9999', 'rssd9050'], inplace=True)
 
-# Compute QoQ pct change for requested variables
-qoq_cols = ['single_family_loans', 'multifamily_loans', 'total_loans', 'total_loans_not_for_sale', 'C&I']
-for col in qoq_cols:
-    prev = df.groupby('rssd9001')[col].shift(1)
-    df[f'd_{col}'] = np.where(prev != 0, (df[col] - prev) / prev, np.nan)
+def main() -> None:
+    df = build(**load_inputs())
+    df.to_csv(OUTPUTS["bank_credit"], index=False)
 
-df.drop(columns=['single_family_loans', 'multifamily_loans', 'total_loans', 'total_loans_not_for_sale', 'C&I'], inplace=True)
 
-df.to_csv("data/processed/bank_credit.csv", index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Streams Call Report items straight out of the FFIEC bulk quarterly ZIPs into one typed,
+quarter-partitioned dataset that replaces the hand-made WRDS extracts in data/raw.
+
+Inputs:
+- data/raw/ffiec_bulk/*.zip: FFIEC CDR "Call Reports -- Single Period" bulk downloads, all
+  schedules, tab delimited (e.g. 'FFIEC CDR Call Bulk All Schedules 03312023.zip'). The report
+  date is read from the MMDDYYYY stamp in the file name.
+  - Schedule files ('FFIEC CDR Call Schedule RC 03312023.txt', wide schedules split into
+    '(1 of 2)', '(2 of 2)') have two header rows: MDRM codes (IDRSSD, RCON2200, ...), then item
+    descriptions. Values can be blank or 'CONF' (confidential); both become NaN.
+  - The POR file ('FFIEC CDR Call Bulk POR 03312023.txt', one header row) gives every filer's FDIC
+    certificate, filing type and last submission time.
+
+Only the first header line of each member is read up front; the rest of a member is parsed only if
+it holds a requested code, and then only those columns. Nothing is unpacked to disk. Quarters run
+in a process pool, one archive per task, and each worker writes its own partition.
+
+Output (DATASET_DIR):
+- quarter=YYYYQn/part.parquet (or part.csv with --format csv; parquet needs pyarrow)
+- _schema.json: column dtypes, the MDRM codes ingested and the partition format.
+Columns use the WRDS names the cleaning scripts read: rssd9001 (IDRSSD), rssd9999 (report date),
+rssd9050 (FDIC certificate), rssdfininstfilingtype, rssdsubmissiondate, then one float64 column per
+MDRM code in lower case (thousands of dollars).
+
+bank_credit.py, control.py and deposit_interest_rate.py read the dataset through
+load_inputs(source='bulk'); EXTRACTS maps each of their raw CSVs to the columns it holds.
+
+Usage:
+  python programs/clean/call_bulk.py
+  python programs/clean/call_bulk.py --zips data/raw/ffiec_bulk/*2023.zip --workers 4
+  python programs/clean/call_bulk.py --codes RCON2200 RCON6636 --out data/raw/call_bulk_dep
+  python programs/clean/call_bulk.py --extracts     # also write data/raw/rcon_*.csv, riad*.csv
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+ZIP_DIR = "data/raw/ffiec_bulk"
+DATASET_DIR = "data/raw/call_bulk"
+RAW_DIR = "data/raw"
+SCHEMA_FILE = "_schema.json"
+ENCODING = "latin-1"
+
+ID_CODE = "IDRSSD"
+POR_COLUMNS = {
+    "IDRSSD": "rssd9001",
+    "FDIC Certificate Number": "rssd9050",
+    "Financial Institution Filing Type": "rssdfininstfilingtype",
+    "Last Date/Time Submission Updated On": "rssdsubmissiondate",
+}
+KEY_DTYPES = {
+    "rssd9001": "int64",
+    "rssd9999": "datetime64[ns]",
+    "rssd9050": "Int64",
+    "rssdfininstfilingtype": "Int64",
+    "rssdsubmissiondate": "datetime64[ns]",
+}
+DATE_COLUMNS = ["rssd9999", "rssdsubmissiondate"]
+
+# Raw extract name (basename of the CSV the cleaning scripts read) -> (key columns, MDRM codes)
+WRDS_KEYS = ["rssd9001", "rssd9999", "rssd9050", "rssdsubmissiondate"]
+CONTROL_KEYS = ["rssd9001", "rssd9999", "rssdsubmissiondate"]
+EXTRACTS: Dict[str, Tuple[List[str], List[str]]] = {
+    "riad": (WRDS_KEYS, ["RIAD4508", "RIAD0093", "RIADHK04", "RIADHK03"]),
+    "rcon_deposit": (WRDS_KEYS, ["RCON2200", "RCON6636"]),
+    "rcon_credit_1": (WRDS_KEYS + ["rssdfininstfilingtype"],
+                      ["RCON3465", "RCON1460", "RCON2122", "RCON1766", "RCONB528"]),
+    "rcon_credit_2": (WRDS_KEYS, ["RCON5569", "RCON5573", "RCON5567", "RCON5575", "RCON5571",
+                                  "RCON5565", "RCON6999"]),
+    "rcon_control_1": (CONTROL_KEYS, ["RCON2170", "RCON2210", "RCON0352", "RCON6810", "RCONJ473",
+                                      "RCON6648", "RCON3210"]),
+    "rcon_control_2": (CONTROL_KEYS, ["RCON3353", "RCON3200", "RCONJ474", "RCON3190"]),
+    "riad_control": (CONTROL_KEYS, ["RIAD4340"]),
+}
+DEFAULT_CODES = sorted({code for _, codes in EXTRACTS.values() for code in codes})
+
+
+def report_date(path: str) -> pd.Timestamp:
+    """Report date from the MMDDYYYY stamp in a bulk file or archive name."""
+    m = re.search(r"(\d{2})(\d{2})(\d{4})(?!.*\d{8})", os.path.basename(path))
+    if m is None:
+        raise ValueError(f"No MMDDYYYY report date in '{path}'.")
+    month, day, year = (int(g) for g in m.groups())
+    return pd.Timestamp(year=year, month=month, day=day)
+
+
+def quarter_label(date: pd.Timestamp) -> str:
+    return f"{date.year}Q{date.quarter}"
+
+
+def _split_header(line: bytes) -> List[str]:
+    return [c.strip().strip('"').strip() for c in line.decode(ENCODING).rstrip("\r\n").split("\t")]
+
+
+def _is_por(member: str) -> bool:
+    return " POR " in os.path.basename(member) and member.lower().endswith(".txt")
+
+
+def _is_schedule(member: str) -> bool:
+    return " Schedule " in os.path.basename(member) and member.lower().endswith(".txt")
+
+
+def scan_headers(zf: zipfile.ZipFile) -> Dict[str, List[str]]:
+    """Schedule member -> MDRM codes in its first header row, reading one line per member."""
+    headers = {}
+    for member in zf.namelist():
+        if _is_schedule(member):
+            with zf.open(member) as fh:
+                headers[member] = _split_header(fh.readline())
+    return headers
+
+
+def _read_columns(zf: zipfile.ZipFile, member: str, header: List[str], wanted: Dict[str, int],
+                  skip: int) -> pd.DataFrame:
+    """Stream the wanted columns (name -> position) of one member; everything else is skipped."""
+    positions = sorted(wanted.values())
+    with zf.open(member) as fh:
+        df = pd.read_csv(
+            io.TextIOWrapper(fh, encoding=ENCODING), sep="\t", header=None, skiprows=skip,
+            usecols=positions, dtype=str, quotechar='"', keep_default_na=False, na_values=[""],
+        )
+    return df.rename(columns={pos: name for name, pos in wanted.items()})
+
+
+def read_por(zf: zipfile.ZipFile) -> pd.DataFrame:
+    """Filer keys (rssd9001, rssd9050, filing type, submission time) from the POR member."""
+    members = [m for m in zf.namelist() if _is_por(m)]
+    if not members:
+        raise ValueError(f"No POR (panel of reporters) file in {zf.filename}.")
+    with zf.open(members[0]) as fh:
+        header = _split_header(fh.readline())
+    missing = [c for c in POR_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"POR file in {zf.filename} lacks columns {missing}.")
+    por = _read_columns(zf, members[0], header, {POR_COLUMNS[c]: header.index(c) for c in POR_COLUMNS}, 1)
+    for col in ("rssd9001", "rssd9050", "rssdfininstfilingtype"):
+        por[col] = pd.to_numeric(por[col], errors="coerce")
+    por = por.dropna(subset=["rssd9001"])
+    por["rssdsubmissiondate"] = pd.to_datetime(por["rssdsubmissiondate"], errors="coerce", format="mixed")
+    return por.drop_duplicates("rssd9001", keep="last").set_index("rssd9001")
+
+
+def read_quarter(zip_path: str, codes: Sequence[str] = DEFAULT_CODES) -> Tuple[pd.DataFrame, List[str]]:
+    """One row per filer in the archive with the requested codes; also returns codes not found.
+
+    Codes absent from this quarter (e.g. items introduced later) are kept as all-NaN columns so
+    every partition has the same schema.
+    """
+    codes = [c.upper() for c in codes]
+    date = report_date(zip_path)
+    with zipfile.ZipFile(zip_path) as zf:
+        por = read_por(zf)
+        headers = scan_headers(zf)
+
+        # First member holding each code; a code never costs more than one member read
+        plan: Dict[str, Dict[str, int]] = {}
+        for member in sorted(headers):
+            header = headers[member]
+            if ID_CODE not in header:
+                continue
+            for code in codes:
+                if code in header and not any(code in w for w in plan.values()):
+                    plan.setdefault(member, {ID_CODE: header.index(ID_CODE)})[code] = header.index(code)
+
+        parts = []
+        for member, wanted in plan.items():
+            part = _read_columns(zf, member, headers[member], wanted, 2)
+            ids = pd.to_numeric(part.pop(ID_CODE), errors="coerce")
+            part = part.apply(pd.to_numeric, errors="coerce")  # blanks and 'CONF' -> NaN
+            part.index = ids
+            part = part[part.index.notna() & ~part.index.duplicated(keep="last")]
+            parts.append(part)
+
+    df = por.join(parts, how="left") if parts else por
+    found = [c for w in plan.values() for c in w if c != ID_CODE]
+    missing = [c for c in codes if c not in found]
+    for code in missing:
+        df[code] = np.nan
+    df = df.reset_index()
+    df.columns = [c.lower() if c in codes else c for c in df.columns]
+    df.insert(1, "rssd9999", date)
+    df = df[list(KEY_DTYPES) + [c.lower() for c in codes]]
+    return df.astype(KEY_DTYPES).astype({c.lower(): "float64" for c in codes}), missing
+
+
+def _partition_path(out_dir: str, label: str, fmt: str) -> str:
+    return os.path.join(out_dir, f"quarter={label}", f"part.{fmt}")
+
+
+def ingest_quarter(zip_path: str, out_dir: str = DATASET_DIR, codes: Sequence[str] = DEFAULT_CODES,
+                   fmt: str = "parquet") -> Dict:
+    """Read one archive and write its partition. Runs inside worker processes."""
+    t0 = time.perf_counter()
+    df, missing = read_quarter(zip_path, codes)
+    label = quarter_label(df["rssd9999"].iloc[0]) if len(df) else quarter_label(report_date(zip_path))
+    path = _partition_path(out_dir, label, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return {"quarter": label, "rows": len(df), "missing": missing, "path": path,
+            "seconds": time.perf_counter() - t0}
+
+
+def ingest(zip_paths: Sequence[str], out_dir: str = DATASET_DIR, codes: Sequence[str] = DEFAULT_CODES,
+           fmt: str = "parquet", workers: Optional[int] = None) -> List[Dict]:
+    """Ingest archives into the partitioned dataset, one quarter per task (workers=1 runs serially)."""
+    if fmt not in ("parquet", "csv"):
+        raise ValueError(f"Unknown format '{fmt}'; use 'parquet' or 'csv'.")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet partitions need pyarrow (pip install pyarrow), or pass fmt='csv'.")
+    codes = [c.upper() for c in codes]
+    labels = [quarter_label(report_date(p)) for p in zip_paths]
+    dup = sorted({q for q in labels if labels.count(q) > 1})
+    if dup:
+        raise ValueError(f"More than one archive for quarter(s) {dup}.")
+
+    os.makedirs(out_dir, exist_ok=True)
+    args = [(p, out_dir, codes, fmt) for p in zip_paths]
+    if workers == 1 or len(args) <= 1:
+        results = [ingest_quarter(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(ingest_quarter, *zip(*args)))
+
+    schema = {
+        "format": fmt,
+        "codes": codes,
+        "columns": {**KEY_DTYPES, **{c.lower(): "float64" for c in codes}},
+    }
+    with open(os.path.join(out_dir, SCHEMA_FILE), "w") as f:
+        json.dump(schema, f, indent=2)
+    return sorted(results, key=lambda r: r["quarter"])
+
+
+def read_schema(path: str = DATASET_DIR) -> Dict:
+    schema_path = os.path.join(path, SCHEMA_FILE)
+    if not os.path.exists(schema_path):
+        raise FileNotFoundError(f"No {SCHEMA_FILE} in {path}; run call_bulk.py first.")
+    with open(schema_path) as f:
+        return json.load(f)
+
+
+def partitions(path: str = DATASET_DIR, quarters: Optional[Sequence[str]] = None) -> List[str]:
+    """Partition files in quarter order, optionally restricted to labels like '2023Q1'."""
+    fmt = read_schema(path)["format"]
+    files = sorted(glob.glob(os.path.join(path, "quarter=*", f"part.{fmt}")))
+    if quarters is not None:
+        wanted = set(quarters)
+        files = [f for f in files if os.path.basename(os.path.dirname(f)).split("=", 1)[1] in wanted]
+    return files
+
+
+def read_dataset(path: str = DATASET_DIR, columns: Optional[Sequence[str]] = None,
+                 quarters: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Concatenate partitions, reading only the requested columns, with schema dtypes restored."""
+    schema = read_schema(path)
+    dtypes = schema["columns"]
+    columns = list(dtypes) if columns is None else list(columns)
+    unknown = [c for c in columns if c not in dtypes]
+    if unknown:
+        raise ValueError(f"Columns not in the dataset at {path}: {unknown}")
+
+    frames = []
+    for part in partitions(path, quarters):
+        if schema["format"] == "parquet":
+            frames.append(pd.read_parquet(part, columns=columns))
+        else:
+            dates = [c for c in columns if c in DATE_COLUMNS]
+            frames.append(pd.read_csv(
+                part, usecols=columns, parse_dates=dates,
+                dtype={c: dtypes[c] for c in columns if c not in dates},
+            )[columns])
+    if not frames:
+        return pd.DataFrame({c: pd.Series(dtype=dtypes[c]) for c in columns})
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_extract(name: str, path: str = DATASET_DIR, quarters: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """One raw extract (e.g. 'rcon_deposit') in the WRDS column layout, from the bulk dataset."""
+    if name not in EXTRACTS:
+        raise ValueError(f"Unknown extract '{name}'. Choose from {list(EXTRACTS)}.")
+    keys, codes = EXTRACTS[name]
+    return read_dataset(path, keys + [c.lower() for c in codes], quarters)
+
+
+def load_extracts(inputs: Dict[str, str], path: str = DATASET_DIR) -> Dict[str, pd.DataFrame]:
+    """Stand-in for reading a cleaning script's INPUTS: name -> raw CSV path becomes name -> frame."""
+    return {name: load_extract(os.path.splitext(os.path.basename(csv))[0], path)
+            for name, csv in inputs.items()}
+
+
+def write_extracts(path: str = DATASET_DIR, raw_dir: str = RAW_DIR,
+                   names: Optional[Sequence[str]] = None) -> None:
+    """Write the raw CSVs the cleaning scripts read by default, from the bulk dataset."""
+    for name in names or EXTRACTS:
+        out = os.path.join(raw_dir, f"{name}.csv")
+        load_extract(name, path).to_csv(out, index=False)
+        print(f"Saved {out}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Ingest FFIEC bulk Call Report ZIPs into a quarter-partitioned dataset.")
+    ap.add_argument("--zips", nargs="+", default=None, help=f"Bulk archives (default: {ZIP_DIR}/*.zip).")
+    ap.add_argument("--out", default=DATASET_DIR, help="Dataset directory.")
+    ap.add_argument("--codes", nargs="+", default=DEFAULT_CODES,
+                    help="MDRM codes to keep (default: every code used by the cleaning scripts).")
+    ap.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="Partition file format.")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    ap.add_argument("--extracts", action="store_true",
+                    help="Also write the WRDS-layout raw CSVs (data/raw/rcon_*.csv, riad*.csv).")
+    args = ap.parse_args()
+
+    zips = args.zips or sorted(glob.glob(os.path.join(ZIP_DIR, "*.zip")))
+    if not zips:
+        raise SystemExit(f"No bulk archives found in {ZIP_DIR}.")
+
+    t0 = time.perf_counter()
+    for r in ingest(zips, args.out, args.codes, args.format, args.workers):
+        note = f", not reported: {', '.join(r['missing'])}" if r["missing"] else ""
+        print(f"{r['quarter']}: {r['rows']:,} filers in {r['seconds']:.1f}s{note}")
+    print(f"Saved {len(zips)} quarter(s) to {args.out} in {time.perf_counter() - t0:.1f}s")
+
+    if args.extracts:
+        write_extracts(args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,119 @@
+from typing import Optional
+
 import pandas as pd
 import numpy as np
 
-riad = pd.read_csv("data/raw/riad.csv")
+from quarters import QDATE, bank_lag, parse_dates, to_qdate
+
+INPUTS = {
+    "riad": "data/raw/riad.csv",
+    "rcon": "data/raw/rcon_deposit.csv",
+}
+OUTPUTS = {"deposit_interest_rate": "data/processed/deposit_interest_rate.csv"}
+KEYS = ['rssd9001', 'rssd9999', 'rssd9050']
+YTD_COLUMNS = ['riad4508', 'riad0093', 'riadhk04', 'riadhk03']
+YTD_KEYS = ['rssd9001', 'rssd9050', 'year']
+# Columns the next quarter's lags read from a bank's last row (incremental.py keeps them)
+LAG_COLUMNS = ['rcon2200', 'rcon6636', 'interest_rate_on_deposit', 'interest_rate_on_interest_bearing_deposit']
+OUTPUT_COLUMNS = ['rssd9001', 'rssd9999', QDATE, 'rssd9050',
+                  'interest_rate_on_deposit', 'interest_rate_on_interest_bearing_deposit',
+                  'average_deposit', 'average_interest_bearing_deposit',
+                  'd_interest_rate_on_deposit', 'd_interest_rate_on_interest_bearing_deposit',
+                  'd_average_deposit', 'd_average_interest_bearing_deposit']
+
+
+def load_inputs(names=None, source="csv") -> dict:
+    """Raw inputs by name: the WRDS CSVs, or the FFIEC bulk dataset (call_bulk.py) if source='bulk'."""
+    names = list(INPUTS) if names is None else names
+    if source == "bulk":
+        from call_bulk import load_extracts
+        return load_extracts({name: INPUTS[name] for name in names})
+    return {name: pd.read_csv(INPUTS[name]) for name in names}
+
+
+def latest_submission(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per KEYS, the latest submission. Parses the date columns of df in place."""
+    # Ensure consistent date format for merge key
+    df['rssd9999'] = parse_dates(df['rssd9999'])
+
+    # De-dupe by keys, keeping the latest submission by date
+    df['rssdsubmissiondate'] = pd.to_datetime(df['rssdsubmissiondate'], errors='coerce')
+    df.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
+    return df.drop_duplicates(subset=KEYS, keep='last')
+
+
+def quarterly_interest(riad: pd.DataFrame, prior: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Quarterly interest expense on deposits from the YTD items.
 
-# Ensure consistent date format for merge key
-riad['rssd9999'] = pd.to_datetime(riad['rssd9999'], errors='coerce').dt.normalize()
+    prior holds the last YTD report per (rssd9001, rssd9050, year) before riad's first quarter.
+    """
+    # Convert YTD interest items to quarterly amounts (per bank, per year)
+    riad = riad.sort_values(['rssd9001', 'rssd9050', 'rssd9999'])
+    riad['year'] = riad['rssd9999'].dt.year
+    for col in YTD_COLUMNS:
+        ytd_diff = riad[col] - bank_lag(riad, col, prior, YTD_KEYS)
+        riad[col] = ytd_diff.where(~ytd_diff.isna(), riad[col])
 
-# De-dupe by keys, keeping the latest submission by date
-riad['rssdsubmissiondate'] = pd.to_datetime(riad['rssdsubmissiondate'], errors='coerce')
-riad.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
-riad = riad.drop_duplicates(subset=['rssd9001', 'rssd9999', 'rssd9050'], keep='last')
+    # Now sum quarterly amounts
+    riad['interest_on_deposit'] = riad['riad4508'] + riad['riad0093'] + riad['riadhk04'] + riad['riadhk03']
+    return riad.drop(columns=['year'])
 
-# Convert YTD interest items to quarterly amounts (per bank, per year)
-riad.sort_values(['rssd9001', 'rssd9050', 'rssd9999'], inplace=True)
-ytd_cols = ['riad4508', 'riad0093', 'riadhk04', 'riadhk03']
-for col in ytd_cols:
-    ytd_diff = riad.groupby(['rssd9001', 'rssd9050', riad['rssd9999'].dt.year])[col].diff()
-    riad[col] = ytd_diff.where(~ytd_diff.isna(), riad[col])
 
-# Now sum quarterly amounts
-riad['interest_on_deposit'] = riad['riad4508'] + riad['riad0093'] + riad['riadhk04'] + riad['riadhk03']
+def deposit_rates(riad: pd.DataFrame, rcon: pd.DataFrame, prior: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Rates, average deposits and their quarterly changes per bank (all columns, not only OUTPUT_COLUMNS).
 
-rcon = pd.read_csv("data/raw/rcon_deposit.csv")
+    prior holds each bank's LAG_COLUMNS in its last row before the first quarter of riad.
+    """
+    df = riad.merge(rcon, on=KEYS, how='left')
 
-# Ensure consistent date format for merge key
-rcon['rssd9999'] = pd.to_datetime(rcon['rssd9999'], errors='coerce').dt.normalize()
+    # Ensure chronological order within each bank for lag computation
+    df.sort_values(['rssd9001', 'rssd9999', 'rssd9050'], inplace=True)
+    prev_rcon2200 = bank_lag(df, 'rcon2200', prior)
+    prev_rcon6636 = bank_lag(df, 'rcon6636', prior)
 
-# De-dupe by keys, keeping the latest submission by date
-rcon['rssdsubmissiondate'] = pd.to_datetime(rcon['rssdsubmissiondate'], errors='coerce')
-rcon.sort_values(['rssd9001', 'rssd9999', 'rssd9050', 'rssdsubmissiondate'], inplace=True)
-rcon = rcon.drop_duplicates(subset=['rssd9001', 'rssd9999', 'rssd9050'], keep='last')
+    # rcon2200 + rcon2200(-1) per bank
+    df['average_deposit'] = (df['rcon2200'] + prev_rcon2200) / 2
 
-df = riad.merge(rcon, on=['rssd9001', 'rssd9999', 'rssd9050'], how='left')
+    # rcon6636 + rcon6636(-1) per bank
+    df['average_interest_bearing_deposit'] = (df['rcon6636'] + prev_rcon6636) / 2
 
-# Ensure chronological order within each bank for lag computation
-df.sort_values(['rssd9001', 'rssd9999', 'rssd9050'], inplace=True)
+    df['interest_rate_on_deposit'] = df['interest_on_deposit'] / df['average_deposit'] * 4
+    df['interest_rate_on_interest_bearing_deposit'] = df['interest_on_deposit'] / df['average_interest_bearing_deposit'] * 4
 
-# rcon2200 + rcon2200(-1) per bank
-df['average_deposit'] = (df['rcon2200'] + df.groupby('rssd9001')['rcon2200'].shift(1)) / 2
+    # Compute per-bank quarterly changes and drop NA
+    df['d_interest_rate_on_deposit'] = df['interest_rate_on_deposit'] - bank_lag(df, 'interest_rate_on_deposit', prior)
+    df['d_interest_rate_on_interest_bearing_deposit'] = (
+        df['interest_rate_on_interest_bearing_deposit'] - bank_lag(df, 'interest_rate_on_interest_bearing_deposit', prior)
+    )
+    df['d_rcon2200'] = df['rcon2200'] - prev_rcon2200
+    df['d_rcon6636'] = df['rcon6636'] - prev_rcon6636
 
-# rcon6636 + rcon6636(-1) per bank
-df['average_interest_bearing_deposit'] = (df['rcon6636'] + df.groupby('rssd9001')['rcon6636'].shift(1)) / 2
+    # Convert deposit diffs to relative changes by last quarter value (per bank)
+    df['d_rcon2200'] = np.where(prev_rcon2200 != 0, df['d_rcon2200'] / prev_rcon2200, np.nan)
+    df['d_rcon6636'] = np.where(prev_rcon6636 != 0, df['d_rcon6636'] / prev_rcon6636, np.nan)
 
-df['interest_rate_on_deposit'] = df['interest_on_deposit'] / df['average_deposit'] * 4
-df['interest_rate_on_interest_bearing_deposit'] = df['interest_on_deposit'] / df['average_interest_bearing_deposit'] * 4
+    # Rename to reflect average-deposit series
+    df.rename(columns={
+        'd_rcon2200': 'd_average_deposit',
+        'd_rcon6636': 'd_average_interest_bearing_deposit'
+    }, inplace=True)
 
-# Compute per-bank quarterly changes and drop NA
-df['d_interest_rate_on_deposit'] = df.groupby('rssd9001')['interest_rate_on_deposit'].diff()
-df['d_interest_rate_on_interest_bearing_deposit'] = df.groupby('rssd9001')['interest_rate_on_interest_bearing_deposit'].diff()
-df['d_rcon2200'] = df.groupby('rssd9001')['rcon2200'].diff()
-df['d_rcon6636'] = df.groupby('rssd9001')['rcon6636'].diff()
+    # Integer quarter code: the join key downstream
+    df[QDATE] = to_qdate(df['rssd9999'])
+    return df
 
-# Convert deposit diffs to relative changes by last quarter value (per bank)
-prev_rcon2200 = df.groupby('rssd9001')['rcon2200'].shift(1)
-prev_rcon6636 = df.groupby('rssd9001')['rcon6636'].shift(1)
-df['d_rcon2200'] = np.where(prev_rcon2200 != 0, df['d_rcon2200'] / prev_rcon2200, np.nan)
-df['d_rcon6636'] = np.where(prev_rcon6636 != 0, df['d_rcon6636'] / prev_rcon6636, np.nan)
 
-# Rename to reflect average-deposit series
-df.rename(columns={
-    'd_rcon2200': 'd_average_deposit',
-    'd_rcon6636': 'd_average_interest_bearing_deposit'
-}, inplace=True)
+def build(riad: pd.DataFrame, rcon: pd.DataFrame) -> pd.DataFrame:
+    """Quarterly deposit rates and changes per bank. Raw inputs are modified in place."""
+    riad = quarterly_interest(latest_submission(riad))
+    df = deposit_rates(riad, latest_submission(rcon))
+    return df[OUTPUT_COLUMNS]
+
+
+def main() -> None:
+    df = build(**load_inputs())
+    df.to_csv(OUTPUTS["deposit_interest_rate"], index=False)
 
-df = df[['rssd9001', 'rssd9999', 'rssd9050',
-         'interest_rate_on_deposit', 'interest_rate_on_interest_bearing_deposit',
-         'average_deposit', 'average_interest_bearing_deposit',
-         'd_interest_rate_on_deposit', 'd_interest_rate_on_interest_bearing_deposit',
-         'd_average_deposit', 'd_average_interest_bearing_deposit']]
 
-df.to_csv("data/processed/deposit_interest_rate.csv", index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Compact dtype plan for the bank-quarter frames.
+
+read_csv gives int64 ids, object dates and labels and float64 everywhere else. DTYPE_PLAN declares
+the narrow type of each column the pipeline carries:
+- ids (RSSD, FDIC certificate): int32; SOD year: int16; quarter code: Int16 (quarters.py);
+- report dates: datetime64 (8 bytes instead of a Python string per row);
+- 0/1 flags and the filing type: uint8;
+- census-division deposit shares, in [0, 1] up to rounding: float32, which keeps about 7
+  significant digits;
+- repeated labels (BKCLASS, census division, state): category.
+Rates, deposit amounts and their changes, z-scores, the FFR and the balance-sheet ratios of
+control.py stay float64: the d_* ratios are small differences whose relative precision float32
+would visibly cut, core_deposit_share and wholesale_share are items over total assets with no
+bound (working_panel_merge.py caps core_deposit_share afterwards), and ASSET (thousands of dollars)
+can exceed the int32 range.
+
+apply_plan casts a frame's planned columns and leaves a column as it is when the cast would lose
+information: NaN in an integer column, values outside the target's range or non-integer values.
+pipeline.py applies the plan to every frame it loads or a stage builds, so the types carry through
+merges (both sides of a join have the same key type) and are re-applied whenever a written CSV is
+read back. stage1.py's --compare-panel checks that estimates do not move.
+
+Usage:
+  python programs/clean/dtypes.py                      # memory before/after for files on disk
+  python programs/clean/dtypes.py data/working/working_panel.csv
+"""
+import argparse
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from quarters import QDATE, QDATE_DTYPE, parse_dates
+
+DIVISION_SHARES = ["NE", "MA", "EC", "WC", "SA", "ES", "WS", "MT", "PC"]
+DTYPE_PLAN: Dict[str, str] = {
+    # identifiers and period codes
+    "rssd9001": "int32",
+    "Bank ID": "int32",
+    "RSSDID": "int32",
+    "rssd9050": "int32",
+    "YEAR": "int16",
+    QDATE: QDATE_DTYPE,
+    # report dates
+    "rssd9999": "datetime64[ns]",
+    "Date": "datetime64[ns]",
+    # flags and codes
+    "large_bank": "uint8",
+    "small_buz_lending_flag_asof": "uint8",
+    "rssdfininstfilingtype": "uint8",
+    # census-division deposit shares in [0, 1]
+    **{col: "float32" for col in DIVISION_SHARES},
+    # labels
+    "BKCLASS": "category",
+    "census_division": "category",
+    "state_usps": "category",
+}
+# Files reported by the command line
+PLANNED_FILES = [
+    "data/raw/SOD.csv",
+    "data/raw/riad.csv",
+    "data/raw/rcon_deposit.csv",
+    "data/processed/deposit_interest_rate.csv",
+    "data/processed/bank_credit.csv",
+    "data/processed/controls.csv",
+    "data/processed/instruments.csv",
+    "data/working/working_panel.csv",
+]
+
+
+def _cast(s: pd.Series, dtype: str) -> Optional[pd.Series]:
+    """s cast to dtype, or None if the cast would lose information."""
+    if str(s.dtype) == dtype:
+        return None
+    if dtype == "category":
+        return s.astype("category") if s.dtype == object else None
+    if dtype.startswith("datetime64"):
+        return parse_dates(s) if s.dtype == object else None
+    if not pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return None
+    if dtype.startswith("float"):
+        return s.astype(dtype)
+    target = np.dtype(dtype.lower())
+    if s.hasnans and dtype[0].islower():
+        return None  # numpy integers have no missing value
+    v = s.dropna().to_numpy()
+    if len(v):
+        info = np.iinfo(target)
+        if v.min() < info.min or v.max() > info.max or (v.dtype.kind == "f" and not (v == np.floor(v)).all()):
+            return None
+    return s.astype(dtype)
+
+
+def apply_plan(df: pd.DataFrame, plan: Dict[str, str] = DTYPE_PLAN) -> pd.DataFrame:
+    """df with its planned columns cast (a shallow copy; the input frame is not modified)."""
+    casts = {}
+    for col, dtype in plan.items():
+        if col in df.columns:
+            cast = _cast(df[col], dtype)
+            if cast is not None:
+                casts[col] = cast
+    if not casts:
+        return df
+    out = df.copy(deep=False)
+    for col, cast in casts.items():
+        out[col] = cast
+    return out
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Memory held by a frame, including the Python strings of object columns."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def memory_report(frames: Dict[str, pd.DataFrame], plan: Dict[str, str] = DTYPE_PLAN) -> pd.DataFrame:
+    """Bytes per frame as loaded and after apply_plan."""
+    rows = []
+    for name, frame in frames.items():
+        before, after = frame_bytes(frame), frame_bytes(apply_plan(frame, plan))
+        rows.append({"frame": name, "rows": len(frame), "native_MB": before / 1e6, "planned_MB": after / 1e6,
+                     "saved_pct": 100 * (1 - after / before) if before else 0.0})
+    return pd.DataFrame(rows)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Memory of pipeline files as read and under the dtype plan.")
+    ap.add_argument("paths", nargs="*", help=f"CSV files (default: {len(PLANNED_FILES)} pipeline files present).")
+    args = ap.parse_args()
+
+    paths: List[str] = args.paths or [p for p in PLANNED_FILES if os.path.exists(p)]
+    report = memory_report({p: pd.read_csv(p) for p in paths})
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    total = report[["native_MB", "planned_MB"]].sum()
+    print(f"total: {total['native_MB']:.2f} MB -> {total['planned_MB']:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
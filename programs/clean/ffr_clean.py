@@ -1,30 +1,140 @@
+"""
+Quarterly policy and money-market rates from local daily series.
+
+The FFR upper limit (data/raw/ffr_upper_limit.csv, columns date, ffr_upper) is joined with any
+daily series saved in data/raw/rates/: FRED downloads such as DFEDTARL.csv (FFR lower limit),
+DFF.csv (EFFR), DTB3.csv / DTB6.csv (T-bill yields), each a date column plus one value column
+('.' for missing). The file name picks the series name via RATE_SERIES; other files keep their
+lower-cased name. The directory is optional.
+
+All series are aggregated together in one groupby on the integer quarter code (quarters.py):
+end-of-quarter value (last available daily value), quarter average, quarter-over-quarter change
+of the end-of-quarter value, and the cumulative change since the quarter before WINDOW_START.
+
+Outputs:
+- data/processed/ffr_quarterly.csv: Date, ffr_upper, d_ffr, cum_d_ffr, qdate (the working panel's
+  policy rate columns).
+- data/processed/rates_quarterly.csv: Date, qdate and <series>_eoq, <series>_avg, d_<series>,
+  cum_d_<series> for every series.
+"""
+import os
+from typing import Dict, List, Optional
+
 import pandas as pd
 import numpy as np
 
-df = pd.read_csv("data/raw/ffr_upper_limit.csv")
+from quarters import QDATE, parse_dates, qdate_to_date, to_qdate
+
+INPUTS = {
+    "ffr_daily": "data/raw/ffr_upper_limit.csv",
+    "rates_daily": "data/raw/rates",
+}
+OUTPUTS = {
+    "ffr_quarterly": "data/processed/ffr_quarterly.csv",
+    "rates_quarterly": "data/processed/rates_quarterly.csv",
+}
+# FRED series id (file name) -> column name
+RATE_SERIES = {
+    "DFEDTARU": "ffr_upper",
+    "DFEDTARL": "ffr_lower",
+    "DFF": "effr",
+    "DTB3": "tbill_3m",
+    "DTB6": "tbill_6m",
+    "DTB1YR": "tbill_1y",
+}
+POLICY_SERIES = "ffr_upper"
+WINDOW_START = "2022-01-01"  # 2022Q1
+WINDOW_END = "2024-06-30"  # 2024Q2
+
+
+def read_series(path: str) -> pd.DataFrame:
+    """One daily series file as (date, <series>) with numeric values."""
+    df = pd.read_csv(path)
+    date_col, value_col = df.columns[:2]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = RATE_SERIES.get(stem.upper(), stem.lower())
+    return pd.DataFrame({
+        "date": df[date_col],
+        name: pd.to_numeric(df[value_col], errors="coerce"),
+    })
+
+
+def read_rate_dir(path: str) -> pd.DataFrame:
+    """Wide daily frame (date + one column per series) of every CSV in the rate directory."""
+    if not os.path.isdir(path):
+        return pd.DataFrame({"date": pd.Series(dtype=object)})
+    frames = [read_series(os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.lower().endswith(".csv")]
+    wide = pd.DataFrame({"date": pd.Series(dtype=object)})
+    for frame in frames:
+        wide = wide.merge(frame, on="date", how="outer")
+    return wide
+
+
+def load_inputs(names=None) -> dict:
+    names = list(INPUTS) if names is None else names
+    readers = {"ffr_daily": pd.read_csv, "rates_daily": read_rate_dir}
+    return {name: readers[name](INPUTS[name]) for name in names}
+
+
+def quarterly(daily: pd.DataFrame, series: List[str], start: Optional[str] = None,
+              end: Optional[str] = None) -> pd.DataFrame:
+    """Quarter aggregates of the daily series in one grouped pass over quarter codes.
+
+    start and end default to WINDOW_START and WINDOW_END as set when called.
+    """
+    start = WINDOW_START if start is None else start
+    end = WINDOW_END if end is None else end
+    df = daily.assign(date=parse_dates(daily["date"])).dropna(subset=["date"])
+    df = df.sort_values("date", kind="mergesort")
+    codes = to_qdate(df["date"]).astype(int)
+
+    agg = df[series].groupby(codes.to_numpy()).agg(["last", "mean"])
+    # Every quarter in the span, so changes are always against the previous calendar quarter
+    agg = agg.reindex(np.arange(agg.index.min(), agg.index.max() + 1))
+    eoq = agg.xs("last", axis=1, level=1)
+    avg = agg.xs("mean", axis=1, level=1)
+
+    first, last = int(to_qdate([start]).iloc[0]), int(to_qdate([end]).iloc[0])
+    base = eoq.reindex([first - 1]).iloc[0]
+    in_window = (eoq.index >= first) & (eoq.index <= last)
+
+    out = pd.DataFrame({"Date": qdate_to_date(eoq.index[in_window]).to_numpy(),
+                        QDATE: pd.array(eoq.index[in_window], dtype="Int16")})
+    for s in series:
+        out[f"{s}_eoq"] = eoq[s].to_numpy()[in_window]
+        out[f"{s}_avg"] = avg[s].to_numpy()[in_window]
+        out[f"d_{s}"] = eoq[s].diff().to_numpy()[in_window]
+        out[f"cum_d_{s}"] = (eoq[s] - base[s]).to_numpy()[in_window]
+    return out
 
-df.rename(columns={'date': 'Date'}, inplace=True)
 
-df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-df = df.dropna(subset=['Date']).copy()
-df.sort_values('Date', inplace=True)
+def build(ffr_daily: pd.DataFrame, rates_daily: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Quarter-end FFR upper limit with quarterly and cumulative changes, plus all rate series."""
+    df = ffr_daily.rename(columns={"Date": "date"})[["date", POLICY_SERIES]]
+    df = df.assign(date=parse_dates(df["date"]))
+    rates = rates_daily.drop(columns=[POLICY_SERIES], errors="ignore")
+    if len(rates.columns) > 1:
+        df = df.merge(rates.assign(date=parse_dates(rates["date"])), on="date", how="outer")
+    series = [c for c in df.columns if c != "date"]
 
-# Resample to quarter-end using the last available daily value in the quarter
-q = (
-    df.set_index('Date')
-      .resample('Q')
-      .last()
-      .reset_index()
-)
+    q = quarterly(df, series)
+    ffr = pd.DataFrame({
+        "Date": q["Date"],
+        "ffr_upper": q[f"{POLICY_SERIES}_eoq"],
+        "d_ffr": q[f"d_{POLICY_SERIES}"],
+    })
+    # Cumulative change since 2022Q1 plus its 25bp hike (= cum_d_ffr_upper on the actual series)
+    base = ffr["ffr_upper"].iloc[0] if len(ffr) else np.nan
+    ffr["cum_d_ffr"] = ffr["ffr_upper"] - base + 0.25
+    ffr[QDATE] = q[QDATE]
+    return {"ffr_quarterly": ffr, "rates_quarterly": q}
 
-# Quarter-over-quarter change in the FFR upper limit (level differences, in p.p.)
-q['d_ffr'] = q['ffr_upper'].diff()
 
-# Keep only quarters from 2022Q1 to 2024Q2 (inclusive)
-q = q[(q['Date'] >= pd.Timestamp('2022-01-01')) & (q['Date'] <= pd.Timestamp('2024-06-30'))].copy()
+def main() -> None:
+    outputs = build(**load_inputs())
+    for name, frame in outputs.items():
+        frame.to_csv(OUTPUTS[name], index=False)
 
-# Cumulative change since 2022Q1
-base = q['ffr_upper'].iloc[0] if len(q) else np.nan
-q['cum_d_ffr'] = q['ffr_upper'] - base + 0.25
 
-q.to_csv("data/processed/ffr_quarterly.csv", index=False)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Incremental update of the Call Report stages when a new quarter arrives.
+
+deposit_interest_rate.py and bank_credit.py look back only through a bank's previous row (lagged
+deposits, rates and loans) and, for the year-to-date interest items, the last report of the same
+year. That history is kept as tail state next to each output, so an update processes only the
+quarters that are new or whose raw rows changed (restatements) and appends or patches the output:
+
+  data/processed/incremental/<stage>/state.json          per-quarter hashes of the raw rows, input
+                                                         and output fingerprints, kept tails
+  data/processed/incremental/<stage>/tail/<quarter>.<name>.csv
+      lag:  each bank's last levels and rates (deposit rates) or loan levels (bank credit); the
+            bank credit tail also has the last reported small business lending flag, the value
+            working_panel_merge.py carries forward
+      ytd:  each bank and certificate's last year-to-date interest report, with its year
+
+An update:
+1. reads nothing if the input files (with --call-source bulk: the quarter partitions) and the
+   output are unchanged since the last update;
+2. otherwise hashes the raw rows per quarter and finds new, restated and removed quarters;
+3. rebuilds from the earliest of them on, continuing the lags from the tail saved after the
+   quarter before it (later quarters are rebuilt too, since their lags chain), through the same
+   stage functions as the full build (latest_submission, quarterly_interest, deposit_rates,
+   loan_growth);
+4. appends the rows when only quarters after the last one changed, else rewrites the output with
+   those quarters replaced, and saves the tails of the last KEEP_TAILS quarters.
+The first update, a restatement older than the kept tails, a different --call-source, a change to
+the stage's code or an output changed by something else (e.g. a full pipeline run) runs the whole
+history through the same path.
+Rows come in update order: sorted by bank and date within each update, not across updates.
+
+--verify rebuilds the stage from all raw data with its build() and checks that the output holds the
+same rows and values.
+
+Usage:
+  python programs/clean/incremental.py                                   # both stages
+  python programs/clean/incremental.py --stages deposit_interest_rate --call-source bulk
+  python programs/clean/incremental.py --verify
+  python programs/clean/incremental.py --rebuild                         # ignore the saved state
+"""
+import argparse
+import hashlib
+import importlib
+import io
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from quarters import EPOCH_YEAR, QDATE, qdate_label, to_qdate
+
+STATE_DIR = "data/processed/incremental"
+STATE_FILE = "state.json"
+TAIL_DIR = "tail"
+KEEP_TAILS = 8  # quarters back a restatement can reach without a full rebuild
+SOURCES = ["csv", "bulk"]
+ROW_KEYS = ["rssd9001", "rssd9999", "rssd9050"]
+CLEAN_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUND_TRIP = "round_trip"  # read_csv's default float parser can be off by one ulp
+
+
+@dataclass
+class Tail:
+    """Last row per `last_by` of some columns; read back indexed by `index` as a stage's prior."""
+    name: str
+    last_by: List[str]
+    columns: List[str]
+    index: List[str]
+    last_valid: List[str] = field(default_factory=list)  # last non-missing value instead
+
+
+@dataclass
+class IncrementalStage:
+    name: str
+    module: str
+    tails: List[Tail]
+    # (raw frames, priors by tail name) -> (output rows, rows each tail is taken over)
+    process: Callable[[Dict[str, pd.DataFrame], Dict[str, pd.DataFrame]],
+                      Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]]
+
+
+def _deposit_interest_rate(raw: Dict[str, pd.DataFrame], prior: Dict[str, pd.DataFrame]):
+    import deposit_interest_rate as m
+
+    riad = m.latest_submission(raw["riad"])
+    ytd = riad[ROW_KEYS + m.YTD_COLUMNS].assign(year=riad["rssd9999"].dt.year)
+    riad = m.quarterly_interest(riad, prior.get("ytd"))
+    df = m.deposit_rates(riad, m.latest_submission(raw["rcon"]), prior.get("lag"))
+    return df[m.OUTPUT_COLUMNS], {"ytd": ytd, "lag": df[ROW_KEYS + m.LAG_COLUMNS]}
+
+
+def _bank_credit(raw: Dict[str, pd.DataFrame], prior: Dict[str, pd.DataFrame]):
+    import bank_credit as m
+
+    df = m.loan_growth(m.latest_submission(raw["rcon1"]), m.latest_submission(raw["rcon2"]), prior.get("lag"))
+    lag = df[ROW_KEYS + m.LEVEL_COLUMNS + ["small_buz_lending_flag"]]
+    return df.drop(columns=m.LEVEL_COLUMNS), {"lag": lag}
+
+
+STAGES = {
+    "deposit_interest_rate": IncrementalStage(
+        "deposit_interest_rate", "deposit_interest_rate",
+        [Tail("ytd", ["rssd9001", "rssd9050"], ["year", "riad4508", "riad0093", "riadhk04", "riadhk03"],
+              ["rssd9001", "rssd9050", "year"]),
+         Tail("lag", ["rssd9001"], ["rcon2200", "rcon6636", "interest_rate_on_deposit",
+                                    "interest_rate_on_interest_bearing_deposit"], ["rssd9001"])],
+        _deposit_interest_rate,
+    ),
+    "bank_credit": IncrementalStage(
+        "bank_credit", "bank_credit",
+        [Tail("lag", ["rssd9001"], ["single_family_loans", "multifamily_loans", "total_loans",
+                                    "total_loans_not_for_sale", "C&I", "small_buz_lending_flag"],
+              ["rssd9001"], last_valid=["small_buz_lending_flag"])],
+        _bank_credit,
+    ),
+}
+
+
+def _label_code(label: str) -> int:
+    year, quarter = label.split("Q")
+    return (int(year) - EPOCH_YEAR) * 4 + int(quarter) - 1
+
+
+def _label(code: int) -> str:
+    return qdate_label([code]).iloc[0]
+
+
+def _stat(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _extract_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def input_fingerprint(stage: IncrementalStage, source: str) -> Dict[str, Any]:
+    """Size and mtime of each raw CSV, or of each quarter partition of the bulk dataset."""
+    mod = importlib.import_module(stage.module)
+    if source == "bulk":
+        from call_bulk import DATASET_DIR, partitions
+
+        return {os.path.basename(os.path.dirname(p)).split("=", 1)[1]: _stat(p) for p in partitions(DATASET_DIR)}
+    return {name: _stat(path) for name, path in mod.INPUTS.items()}
+
+
+def code_hash(stage: IncrementalStage) -> str:
+    """Hash of the source the stage's rows come from: its module, quarters.py and this file."""
+    h = hashlib.sha256()
+    for module in (stage.module, "quarters", "incremental"):
+        with open(os.path.join(CLEAN_DIR, f"{module}.py"), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def read_raw(stage: IncrementalStage, source: str, quarters: Optional[List[int]] = None) -> Dict[str, pd.DataFrame]:
+    """The stage's raw inputs, optionally only the rows (bulk: the partitions) of some quarters."""
+    mod = importlib.import_module(stage.module)
+    if source == "bulk":
+        from call_bulk import load_extract
+
+        labels = None if quarters is None else [_label(q) for q in quarters]
+        return {name: load_extract(_extract_name(path), quarters=labels) for name, path in mod.INPUTS.items()}
+    raw = mod.load_inputs()
+    if quarters is not None:
+        raw = {name: df[to_qdate(df["rssd9999"]).isin(quarters).to_numpy()].reset_index(drop=True)
+               for name, df in raw.items()}
+    return raw
+
+
+def quarter_hashes(raw: Dict[str, pd.DataFrame]) -> Dict[int, str]:
+    """Order-independent hash of each quarter's raw rows across the inputs."""
+    parts: Dict[int, List[str]] = {}
+    for name in sorted(raw):
+        df = raw[name]
+        codes = to_qdate(df["rssd9999"])
+        if codes.isna().any():
+            raise ValueError(f"{name}: {int(codes.isna().sum())} rows without a parseable report date; "
+                             "run the full build instead.")
+        codes = codes.to_numpy(dtype=np.int64)
+        rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        order = np.argsort(codes, kind="stable")
+        quarters, starts = np.unique(codes[order], return_index=True)
+        sums = np.add.reduceat(rows[order], starts) if len(order) else np.zeros(0, dtype=np.uint64)
+        counts = np.diff(np.r_[starts, len(order)])
+        for q, s, n in zip(quarters, sums, counts):
+            parts.setdefault(int(q), []).append(f"{name}:{int(s):016x}:{n}")
+    return {q: hashlib.sha256("|".join(p).encode()).hexdigest()[:16] for q, p in parts.items()}
+
+
+def _last_rows(tail: Tail, prior: Optional[pd.DataFrame], rows: pd.DataFrame) -> pd.DataFrame:
+    """Each key's last row over prior and rows (rows sorted by key, then date)."""
+    cols = tail.last_by + [c for c in tail.columns if c not in tail.last_by]
+    frames = ([prior[cols]] if prior is not None else []) + [rows[cols]]
+    both = pd.concat(frames, ignore_index=True)
+    last = both.drop_duplicates(tail.last_by, keep="last")
+    if tail.last_valid:
+        valid = both.groupby(tail.last_by)[tail.last_valid].last()
+        last = last.drop(columns=tail.last_valid).merge(valid, left_on=tail.last_by, right_index=True, how="left")
+    return last[cols].reset_index(drop=True)
+
+
+class Updater:
+    """State and output of one stage under incremental updates."""
+
+    def __init__(self, stage: IncrementalStage, source: str = "csv", state_dir: str = STATE_DIR) -> None:
+        self.stage = stage
+        self.source = source
+        self.dir = os.path.join(state_dir, stage.name)
+        mod = importlib.import_module(stage.module)
+        (self.output,) = mod.OUTPUTS.values()
+
+    # -- state ------------------------------------------------------------------------------
+    def load_state(self) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.dir, STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = os.path.join(self.dir, STATE_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(self.dir, STATE_FILE))
+
+    def _tail_path(self, quarter: int, name: str) -> str:
+        return os.path.join(self.dir, TAIL_DIR, f"{_label(quarter)}.{name}.csv")
+
+    def read_tails(self, quarter: int) -> Optional[Dict[str, pd.DataFrame]]:
+        """Tails saved after quarter, or None if they were not kept."""
+        tails = {}
+        for tail in self.stage.tails:
+            path = self._tail_path(quarter, tail.name)
+            if not os.path.exists(path):
+                return None
+            tails[tail.name] = pd.read_csv(path, float_precision=ROUND_TRIP)
+        return tails
+
+    @staticmethod
+    def as_prior(tail: Tail, frame: pd.DataFrame) -> pd.DataFrame:
+        return frame.set_index(tail.index)
+
+    # -- update -----------------------------------------------------------------------------
+    def _start(self, state: Optional[Dict[str, Any]], rebuild: bool) -> Optional[str]:
+        """Why the whole history has to be processed, or None if the saved state can be used."""
+        if rebuild:
+            return "rebuild requested"
+        if state is None:
+            return "no saved state"
+        if state.get("source") != self.source:
+            return f"state is for --call-source {state.get('source')}"
+        if state.get("code") != code_hash(self.stage):
+            return "stage code changed since the last update"
+        if _stat(self.output) != state.get("output"):
+            return f"{self.output} changed since the last update"
+        return None
+
+    def update(self, rebuild: bool = False) -> str:
+        """Bring the output up to date with the raw inputs; returns a one-line summary."""
+        start = time.perf_counter()
+        fingerprint = input_fingerprint(self.stage, self.source)
+        state = self.load_state()
+        reason = self._start(state, rebuild)
+        if reason is None and state["inputs"] == fingerprint:
+            return f"{self.stage.name}: up to date ({len(state['quarters'])} quarters)"
+
+        old = {} if reason is not None else {_label_code(k): v for k, v in state["quarters"].items()}
+        if self.source == "bulk" and reason is None:
+            changed_parts = [_label_code(k) for k, v in fingerprint.items() if state["inputs"].get(k) != v]
+            hashes = dict(old)
+            for q in set(old) - {_label_code(k) for k in fingerprint}:
+                del hashes[q]
+            raw = None
+            if changed_parts:
+                hashes.update(quarter_hashes(read_raw(self.stage, self.source, changed_parts)))
+        else:
+            raw = read_raw(self.stage, self.source)
+            hashes = quarter_hashes(raw)
+
+        changed = sorted(q for q in set(hashes) | set(old) if hashes.get(q) != old.get(q))
+        if reason is None and not changed:
+            self._save_state({**state, "inputs": fingerprint})
+            return f"{self.stage.name}: inputs touched, no quarter changed"
+
+        prior: Dict[str, pd.DataFrame] = {}
+        first = changed[0] if changed else min(hashes)
+        if reason is None:
+            before = [q for q in old if q < first]
+            if before:
+                tails = self.read_tails(max(before))
+                if tails is None:
+                    reason = f"restated {_label(first)} is older than the last {KEEP_TAILS} quarters' tails"
+                else:
+                    prior = {t.name: self.as_prior(t, tails[t.name]) for t in self.stage.tails}
+        if reason is not None:
+            first, prior = min(hashes), {}
+            if raw is None:
+                raw = read_raw(self.stage, self.source)
+
+        quarters = sorted(q for q in hashes if q >= first)
+        if raw is None:
+            raw = read_raw(self.stage, self.source, quarters)
+        else:
+            raw = {name: df[to_qdate(df["rssd9999"]).isin(quarters).to_numpy()].reset_index(drop=True)
+                   for name, df in raw.items()}
+
+        out, tail_rows = self.stage.process(raw, prior)
+        mode = self._write(out, first, full=reason is not None, last=max(old) if old else None)
+        self._save_tails(prior, tail_rows, quarters, keep=sorted(hashes)[-KEEP_TAILS:])
+        self._save_state({
+            "source": self.source,
+            "code": code_hash(self.stage),
+            "inputs": fingerprint,
+            "output": _stat(self.output),
+            "quarters": {_label(q): h for q, h in sorted(hashes.items())},
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        what = f"full build ({reason})" if reason is not None else \
+            f"{mode} {len(quarters)} quarter(s) from {_label(first)} ({len(changed)} new, restated or removed)"
+        return f"{self.stage.name}: {what}, {len(out):,} rows in {time.perf_counter() - start:.2f}s"
+
+    def _write(self, out: pd.DataFrame, first: int, full: bool, last: Optional[int]) -> str:
+        if full or not os.path.exists(self.output):
+            out.to_csv(self.output, index=False)
+            return "wrote"
+        header = pd.read_csv(self.output, nrows=0).columns.tolist()
+        if last is not None and first > last and header == out.columns.tolist():
+            out.to_csv(self.output, mode="a", header=False, index=False)
+            return "appended"
+        existing = pd.read_csv(self.output, parse_dates=["rssd9999"], float_precision=ROUND_TRIP)
+        keep = existing[existing[QDATE] < first]
+        pd.concat([keep, out], ignore_index=True).to_csv(self.output, index=False)
+        return "patched"
+
+    def _save_tails(self, prior: Dict[str, pd.DataFrame], rows: Dict[str, pd.DataFrame],
+                    quarters: List[int], keep: List[int]) -> None:
+        os.makedirs(os.path.join(self.dir, TAIL_DIR), exist_ok=True)
+        for tail in self.stage.tails:
+            frame = rows[tail.name]
+            codes = to_qdate(frame["rssd9999"]).to_numpy(dtype=np.int64)
+            base = prior[tail.name].reset_index() if tail.name in prior else None
+            for q in quarters:
+                if q in keep:
+                    _last_rows(tail, base, frame[codes <= q]).to_csv(self._tail_path(q, tail.name), index=False)
+        for name in os.listdir(os.path.join(self.dir, TAIL_DIR)):
+            if _label_code(name.split(".", 1)[0]) not in keep:
+                os.remove(os.path.join(self.dir, TAIL_DIR, name))
+
+    # -- verification -----------------------------------------------------------------------
+    def verify(self) -> List[str]:
+        """Differences between the output and a full rebuild by the stage's build(); empty if none."""
+        mod = importlib.import_module(self.stage.module)
+        raw = mod.load_inputs(source=self.source)
+        full = mod.build(**raw)
+        buf = io.StringIO()
+        full.to_csv(buf, index=False)
+        buf.seek(0)
+        expected = pd.read_csv(buf, float_precision=ROUND_TRIP)
+        got = pd.read_csv(self.output, float_precision=ROUND_TRIP)
+        problems = []
+        if got.columns.tolist() != expected.columns.tolist():
+            return [f"columns differ: {got.columns.tolist()} vs {expected.columns.tolist()}"]
+        if len(got) != len(expected):
+            problems.append(f"{len(got):,} rows, full rebuild has {len(expected):,}")
+        expected = expected.sort_values(ROW_KEYS).reset_index(drop=True)
+        got = got.sort_values(ROW_KEYS).reset_index(drop=True)
+        if len(got) == len(expected):
+            for col in got.columns:
+                a, b = got[col], expected[col]
+                if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+                    a, b = a.to_numpy(dtype=float), b.to_numpy(dtype=float)
+                    same = (a == b) | (np.isnan(a) & np.isnan(b))
+                else:
+                    same = (a.astype(str) == b.astype(str)).to_numpy()
+                if not same.all():
+                    problems.append(f"{col}: {int((~same).sum()):,} rows differ")
+        return problems
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Append new or restated Call Report quarters to the processed outputs.")
+    ap.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    ap.add_argument("--call-source", choices=SOURCES, default="csv",
+                    help="Raw Call Reports from the WRDS CSVs or the call_bulk.py dataset.")
+    ap.add_argument("--rebuild", action="store_true", help="Ignore the saved state and process every quarter.")
+    ap.add_argument("--verify", action="store_true", help="Compare each output with a full rebuild.")
+    args = ap.parse_args()
+
+    failed = False
+    for name in args.stages:
+        updater = Updater(STAGES[name], args.call_source)
+        print(updater.update(rebuild=args.rebuild))
+        if args.verify:
+            problems = updater.verify()
+            print(f"  verify: {'matches the full rebuild' if not problems else 'MISMATCH'}")
+            for p in problems:
+                print(f"    {p}")
+            failed |= bool(problems)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Lazy build of the working panel with predicate pushdown and early column pruning.
+
+The eager path in working_panel_merge.py reads every processed input in full, merges across the
+whole history and only then applies the policy window, the commercial-bank filter and the
+both-rates-present mask. Here the filters and the final column set are collected into a plan
+first and pushed into each input's read (chunked read_csv with usecols + row predicates), so
+only rows and columns that can reach the panel are loaded and joined.
+
+Two steps of the eager build look at the full history, not just the policy window:
+- the 0.5% / 99.5% rate-trimming thresholds are computed over all quarters;
+- the small business lending flag is carried forward from earlier quarters.
+Both are served by a narrow pre-pass (keys plus the columns they need), after which the window,
+bank and rate filters are pushed into the main scans. The output matches the eager path
+row-for-row (up to the order of tied rows, see compare_to_eager).
+
+Usage:
+  python programs/clean/lazy_panel.py --explain   # print the query plan and exit
+  python programs/clean/lazy_panel.py             # build data/working/working_panel.csv
+  python programs/clean/lazy_panel.py --verify    # also run the eager build and compare
+"""
+import argparse
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from quarters import QDATE, QDATE_DTYPE
+from winsorize import fit_bounds, within_bounds
+import working_panel_merge
+from working_panel_merge import (
+    BANK_CREDIT_CSV,
+    COMMERCIAL_BKCLASS,
+    CONTROLS_CSV,
+    DEPOSIT_INTEREST_RATE_CSV,
+    FFR_CSV,
+    INSTRUMENT_COLUMNS,
+    INSTRUMENTS_CSV,
+    LOAN_DELTA_COLUMNS,
+    OUTLIER_Q_HIGH,
+    OUTLIER_Q_LOW,
+    OUTPUT_CSV,
+    PANEL_KEYS,
+    RATE_COLUMNS,
+    WINSOR_METHOD,
+    Z_COLUMNS,
+    Z_LIMIT,
+    build_panel,
+    finalize_panel,
+    load_inputs,
+    policy_window,
+    print_counts,
+)
+
+CHUNKSIZE = 250_000
+# Columns the eager path drops after the merges; never read them.
+PRUNED_COLUMNS = {'rssdfininstfilingtype'}
+FLAG_COLUMN = 'small_buz_lending_flag'
+
+Predicate = Tuple[str, Callable[[pd.DataFrame], pd.Series]]
+
+
+@dataclass
+class Scan:
+    """Chunked CSV read restricted to a column subset and a conjunction of row predicates."""
+    name: str
+    path: str
+    columns: Optional[List[str]] = None
+    predicates: List[Predicate] = field(default_factory=list)
+
+    def describe(self) -> str:
+        cols = 'all' if self.columns is None else f"{len(self.columns)} [{', '.join(self.columns)}]"
+        lines = [f"Scan {self.name} ({self.path})", f"    columns: {cols}"]
+        for text, _ in self.predicates:
+            lines.append(f"    where:   {text}")
+        return "\n".join(lines)
+
+    def read(self, chunksize: int = CHUNKSIZE) -> pd.DataFrame:
+        parts = []
+        chunk_dtypes = []
+        for chunk in pd.read_csv(self.path, usecols=self.columns, chunksize=chunksize):
+            chunk_dtypes.append(chunk.dtypes)
+            for _, pred in self.predicates:
+                chunk = chunk[pred(chunk)]
+            parts.append(chunk)
+        df = pd.concat(parts, ignore_index=True)
+        if self.columns is not None:
+            df = df[self.columns]
+        # A chunk whose NaNs were all filtered out would otherwise come back as int64 where the
+        # full read gives float64; restore the dtype a single full read would have inferred.
+        for col in df.columns:
+            kinds = [d[col] for d in chunk_dtypes]
+            if all(k.kind in 'iufb' for k in kinds):
+                target = np.result_type(*kinds)
+                if df[col].dtype != target:
+                    df[col] = df[col].astype(target)
+        return df
+
+
+def _header(path: str) -> List[str]:
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _window_text(window: Tuple[int, int]) -> str:
+    return (f"{window[0]} and {window[1]} "
+            f"({working_panel_merge.DATE_START} to {working_panel_merge.DATE_END})")
+
+
+def _in_window(window: Tuple[int, int], col: str = QDATE) -> Predicate:
+    # Same quarter-code comparison as the eager path.
+    start, end = window
+    return f"{col} between {_window_text(window)}", lambda d: (d[col] >= start) & (d[col] <= end)
+
+
+def _up_to_window_end(window: Tuple[int, int], col: str = QDATE) -> Predicate:
+    end = window[1]
+    return f"{col} <= {end} ({working_panel_merge.DATE_END})", lambda d: d[col] <= end
+
+
+BOTH_RATES = (
+    "both deposit rates present",
+    lambda d: d[RATE_COLUMNS[0]].notna() & d[RATE_COLUMNS[1]].notna(),
+)
+SAMPLE_BANK = (
+    f"sophistication_index_z present and BKCLASS in {sorted(COMMERCIAL_BKCLASS)}",
+    lambda d: d['sophistication_index_z'].notna() & d['BKCLASS'].isin(COMMERCIAL_BKCLASS),
+)
+Z_WITHIN_LIMIT = (
+    f"{', '.join(Z_COLUMNS)} within [-{Z_LIMIT}, {Z_LIMIT}]",
+    lambda d: np.logical_and.reduce([d[c].between(-Z_LIMIT, Z_LIMIT) for c in Z_COLUMNS]),
+)
+
+
+class PanelPlan:
+    """Query plan for the working panel: pre-pass scans, window scans, joins and output columns."""
+
+    def __init__(self) -> None:
+        self.window = policy_window()
+        # Inputs join on qdate; only the deposit side keeps its report date (as Date)
+        dep_cols = _header(DEPOSIT_INTEREST_RATE_CSV)
+        credit_cols = [c for c in _header(BANK_CREDIT_CSV)
+                       if c not in PRUNED_COLUMNS | {FLAG_COLUMN, 'rssd9999'}]
+        control_cols = [c for c in _header(CONTROLS_CSV) if c != 'rssd9999']
+        ffr_cols = [c for c in _header(FFR_CSV) if c != 'Date']
+
+        # Pre-pass: full-history statistics over the narrowest possible reads.
+        self.stats_scans = {
+            'deposit': Scan('deposit_interest_rate', DEPOSIT_INTEREST_RATE_CSV,
+                            PANEL_KEYS + RATE_COLUMNS, [BOTH_RATES]),
+            'instruments': Scan('instruments', INSTRUMENTS_CSV,
+                                ['RSSDID', 'sophistication_index_z', 'BKCLASS'], [SAMPLE_BANK]),
+            'flag': Scan('bank_credit', BANK_CREDIT_CSV, PANEL_KEYS + [FLAG_COLUMN],
+                         [_up_to_window_end(self.window),
+                          (f"{FLAG_COLUMN} present", lambda d: d[FLAG_COLUMN].notna())]),
+        }
+        # Window pass: the rate-trim predicate is attached once the thresholds are known.
+        self.window_scans = {
+            'deposit': Scan('deposit_interest_rate', DEPOSIT_INTEREST_RATE_CSV, dep_cols,
+                            [BOTH_RATES, _in_window(self.window)]),
+            'bank_credit': Scan('bank_credit', BANK_CREDIT_CSV, credit_cols, [_in_window(self.window)]),
+            'instruments': Scan('instruments', INSTRUMENTS_CSV, INSTRUMENT_COLUMNS,
+                                [SAMPLE_BANK, Z_WITHIN_LIMIT]),
+            'controls': Scan('controls', CONTROLS_CSV, control_cols, [_in_window(self.window)]),
+            'ffr': Scan('ffr_quarterly', FFR_CSV, ffr_cols, [_in_window(self.window)]),
+        }
+
+        instrument_out = [c for c in INSTRUMENT_COLUMNS if c not in ('RSSDID', 'BKCLASS', 'ASSET')]
+        self.output_columns = (
+            ['Bank ID', 'Date', QDATE]
+            + [c for c in dep_cols if c not in PANEL_KEYS + ['rssd9999']]
+            + [c for c in credit_cols if c not in PANEL_KEYS]
+            + instrument_out
+            + [c for c in control_cols if c not in ('rssd9001', QDATE)]
+            + ['small_buz_lending_flag_asof']
+            + [c for c in ffr_cols if c != QDATE]
+            + ['large_bank']
+        )
+        self.thresholds = None
+
+    def explain(self) -> str:
+        lines = ["Pre-pass (full history; feeds rate-trim thresholds and the as-of lending flag)"]
+        for scan in self.stats_scans.values():
+            lines.append("  " + scan.describe().replace("\n", "\n  "))
+        lines += [
+            "  Join deposit x instruments on rssd9001 -> quantiles "
+            f"{OUTLIER_Q_LOW}/{OUTLIER_Q_HIGH} of {', '.join(RATE_COLUMNS)}",
+            f"  Join deposit keys <- bank_credit flag on {PANEL_KEYS}; ffill by rssd9001; keep window",
+            "",
+            f"Window pass ({QDATE} between {_window_text(self.window)})",
+        ]
+        for scan in self.window_scans.values():
+            lines.append("  " + scan.describe().replace("\n", "\n  "))
+        if self.thresholds is None:
+            lines.append("    (deposit scan also gets: rates within pre-pass thresholds)")
+        lines += [
+            f"  Left join deposit <- bank_credit on {PANEL_KEYS}",
+            "  Inner join <- instruments on rssd9001 (RSSDID)",
+            f"  Left join <- controls on [rssd9001, {QDATE}]",
+            f"  Left join <- as-of lending flag on {PANEL_KEYS}",
+            f"  Left join <- ffr_quarterly on {QDATE}",
+            "  Finalize: large_bank, winsorize ROA / asset_to_equity, cap core_deposit_share",
+            "",
+            f"Output columns ({len(self.output_columns)}): {', '.join(self.output_columns)}",
+        ]
+        return "\n".join(lines)
+
+    def _prepass(self) -> pd.DataFrame:
+        dep = self.stats_scans['deposit'].read()
+        inst = self.stats_scans['instruments'].read().rename(columns={'RSSDID': 'rssd9001'})
+
+        # Same row population the eager path trims on: one row per deposit row and matching
+        # instrument row (the instruments merge is on bank id only).
+        population = dep[['rssd9001'] + RATE_COLUMNS].merge(inst[['rssd9001']], on='rssd9001')
+        print('Bank-quarter before winsorizing: ', len(population))
+        self.thresholds = fit_bounds(population, RATE_COLUMNS, OUTLIER_Q_LOW, OUTLIER_Q_HIGH,
+                                     method=WINSOR_METHOD)
+        thresholds = self.thresholds
+        self.window_scans['deposit'].predicates.append((
+            "rates within pre-pass thresholds",
+            lambda d: within_bounds(d, thresholds, RATE_COLUMNS),
+        ))
+
+        # As-of lending flag: last reported flag at or before each quarter, within bank.
+        flags = self.stats_scans['flag'].read()
+        start, end = self.window
+        asof = dep.loc[dep[QDATE] <= end, PANEL_KEYS].merge(flags, on=PANEL_KEYS, how='left')
+        asof.sort_values(['rssd9001', QDATE], kind='mergesort', inplace=True)
+        asof[FLAG_COLUMN] = asof.groupby('rssd9001')[FLAG_COLUMN].ffill()
+        asof = asof[(asof[QDATE] >= start) & (asof[QDATE] <= end)]
+        asof = asof.drop_duplicates(PANEL_KEYS)
+        asof['small_buz_lending_flag_asof'] = np.where(asof[FLAG_COLUMN].fillna(0) == 1, 1, 0)
+        return asof[PANEL_KEYS + ['small_buz_lending_flag_asof']]
+
+    def collect(self) -> pd.DataFrame:
+        asof = self._prepass()
+        scans = {name: scan.read() for name, scan in self.window_scans.items()}
+
+        instruments = scans['instruments'].rename(columns={'RSSDID': 'rssd9001'})
+        df = scans['deposit'].merge(scans['bank_credit'], on=PANEL_KEYS, how='left')
+        df = df.merge(instruments, on=['rssd9001'], how='inner')
+        df = df.merge(scans['controls'], on=['rssd9001', QDATE], how='left')
+        df = df.merge(asof, on=PANEL_KEYS, how='left')
+        df['small_buz_lending_flag_asof'] = df['small_buz_lending_flag_asof'].fillna(0).astype(int)
+        df.rename(columns={'rssd9001': 'Bank ID', 'rssd9999': 'Date'}, inplace=True)
+        df.drop(columns=['rssd9050', 'BKCLASS'], inplace=True)
+
+        for col in LOAN_DELTA_COLUMNS:
+            df[col] = df[col].fillna(0)
+
+        df.sort_values(['Bank ID', QDATE], inplace=True)
+        df = df.merge(scans['ffr'], on=[QDATE], how='left')
+        df[QDATE] = df[QDATE].astype(QDATE_DTYPE)
+
+        df = finalize_panel(df)
+        print_counts(df)
+        return df[self.output_columns]
+
+
+def compare_to_eager(lazy: pd.DataFrame, eager: pd.DataFrame) -> None:
+    """Raise if the two panels differ.
+
+    Rows that tie on (Bank ID, Date) come from the many-to-one instruments merge and have no
+    defined order in the eager build, so both sides are put in a canonical order first.
+    """
+    assert list(lazy.columns) == list(eager.columns), "column sets differ"
+    order = list(eager.columns)
+    lazy = lazy.sort_values(order, kind='mergesort').reset_index(drop=True)
+    eager = eager.sort_values(order, kind='mergesort').reset_index(drop=True)
+    pd.testing.assert_frame_equal(lazy, eager)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build the working panel with pushed-down filters.")
+    ap.add_argument("--explain", action="store_true", help="Print the query plan and exit.")
+    ap.add_argument("--verify", action="store_true", help="Compare against the eager build.")
+    ap.add_argument("--out", default=OUTPUT_CSV, help="Output CSV path.")
+    args = ap.parse_args()
+
+    plan = PanelPlan()
+    if args.explain:
+        print(plan.explain())
+        return
+
+    df = plan.collect()
+    if args.verify:
+        compare_to_eager(df, build_panel(**load_inputs()))
+        print("Lazy panel matches the eager build.")
+    df.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+County deposit-market dynamics across the SOD history: share changes, entry and exit, and HHI change.
+
+instruments.py measures county concentration as a level within each SOD year. Here the branch
+deposits are summed once into a dense (county-bank pair) x year matrix, with the pairs sorted by
+(fips, RSSDID) as integers and the years in SOD order. Everything is then array arithmetic on it:
+
+- county totals and HHI are np.add.reduceat over each county's contiguous block of pairs;
+- a pair's market share change, entry (present in the year, absent the SOD year before) and exit
+  (present the year before, absent in the year) are differences along the year axis;
+- bank aggregates are np.bincount over the bank code of each pair.
+
+No two years are merged: a pair absent in a year has zero deposits and is not present.
+"Year before" is the previous year in the SOD file, so a gap in the extract spans the gap.
+
+Shares and HHI are on [0, 1] (as in instruments.py). The county HHI change splits exactly into
+  d_hhi = d_hhi_incumbents + d_hhi_entry - d_hhi_exit
+with incumbents' change in squared shares, entrants' squared shares in the year and exiting banks'
+squared shares the year before.
+
+Inputs: data/raw/SOD.csv (YEAR, RSSDID, DEPSUMBR, STCNTYBR)
+Outputs (data/processed/):
+- county_market_dynamics.csv: one row per (YEAR, fips) with deposits: county_deposits, n_banks,
+  hhi, d_hhi and its decomposition, n_entrants / n_exits, entrant_share (entrants' share in the
+  year), exit_share (exiting banks' share the year before), county_deposit_growth.
+- bank_market_dynamics.csv: one row per (YEAR, RSSDID) with branches: n_counties, entries/exits,
+  entered_deposit_share (of the bank's deposits in the year, in counties it entered),
+  exited_deposit_share (of its deposits the year before, in counties it left), and deposit-weighted
+  averages over its counties (weights: its deposits in each county in the year) of the county
+  market share, share change, HHI and HHI change. d_ columns are missing in the first SOD year.
+
+Memory is one float64 and one bool per pair and year (about 1M pairs x 30 years in 270 MB).
+
+Usage:
+  python programs/clean/market_dynamics.py
+  python programs/clean/market_dynamics.py --sod data/raw/vintages/SOD_1994_2024.csv
+"""
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+INPUTS = {"sod": "data/raw/SOD.csv"}
+OUTPUTS = {
+    "county": "data/processed/county_market_dynamics.csv",
+    "bank": "data/processed/bank_market_dynamics.csv",
+}
+SOD_COLUMNS = ["YEAR", "RSSDID", "DEPSUMBR", "STCNTYBR"]
+
+
+@dataclass
+class ShareArrays:
+    """Deposits of every (fips, RSSDID) pair in every SOD year; pairs sorted by fips, then RSSDID."""
+    years: np.ndarray       # (T,) SOD years, ascending
+    fips: np.ndarray        # (C,) county codes, ascending
+    banks: np.ndarray       # (B,) RSSDIDs, ascending
+    county: np.ndarray      # (P,) county index of each pair
+    bank: np.ndarray        # (P,) bank index of each pair
+    starts: np.ndarray      # (C,) first pair of each county
+    deposits: np.ndarray    # (P, T) branch deposits summed per pair and year, 0 if absent
+    present: np.ndarray     # (P, T) the bank has a branch in the county that year
+
+    def by_county(self, x: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(x, self.starts, axis=0)
+
+    def by_bank(self, x: np.ndarray) -> np.ndarray:
+        n_years = x.shape[1]
+        flat = (self.bank[:, None] * n_years + np.arange(n_years)).ravel()
+        return np.bincount(flat, weights=x.ravel(), minlength=len(self.banks) * n_years).reshape(-1, n_years)
+
+
+def share_arrays(sod: pd.DataFrame) -> ShareArrays:
+    """Pair x year deposit and presence arrays from SOD branch rows."""
+    fips = pd.to_numeric(sod["STCNTYBR"], errors="coerce").to_numpy()
+    ok = ~np.isnan(fips) if fips.dtype.kind == "f" else np.ones(len(fips), dtype=bool)
+    fips = fips[ok].astype(np.int64)
+    rssd = sod["RSSDID"].to_numpy()[ok].astype(np.int64)
+    year_codes, years = pd.factorize(sod["YEAR"].to_numpy()[ok], sort=True)
+    deposits = np.nan_to_num(sod["DEPSUMBR"].to_numpy(dtype=float)[ok])
+
+    # Integer pair key in (fips, RSSDID) order; unique() sorts, so pairs come out sorted
+    span = int(rssd.max()) + 1 if len(rssd) else 1
+    pair_codes, pairs = pd.factorize(fips * span + rssd, sort=True)
+    n_pairs, n_years = len(pairs), len(years)
+    flat = pair_codes * n_years + year_codes
+    dep = np.bincount(flat, weights=deposits, minlength=n_pairs * n_years).reshape(n_pairs, n_years)
+    present = (np.bincount(flat, minlength=n_pairs * n_years) > 0).reshape(n_pairs, n_years)
+
+    pair_fips, pair_rssd = pairs // span, pairs % span
+    county_codes, counties = pd.factorize(pair_fips, sort=True)
+    bank_codes, banks = pd.factorize(pair_rssd, sort=True)
+    starts = np.flatnonzero(np.r_[True, county_codes[1:] != county_codes[:-1]])
+    return ShareArrays(np.asarray(years), np.asarray(counties), np.asarray(banks), county_codes, bank_codes,
+                       starts, dep, present)
+
+
+def _lag(x: np.ndarray, fill) -> np.ndarray:
+    """x shifted one year later along axis 1; the first year gets fill."""
+    out = np.empty_like(x)
+    out[:, 0] = fill
+    out[:, 1:] = x[:, :-1]
+    return out
+
+
+def _first_year_missing(x: np.ndarray) -> np.ndarray:
+    x = x.astype(float)
+    x[:, 0] = np.nan
+    return x
+
+
+def dynamics(a: ShareArrays) -> Dict[str, pd.DataFrame]:
+    """County-year and bank-year market dynamics from the share arrays."""
+    totals = a.by_county(a.deposits)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(totals[a.county] > 0, a.deposits / totals[a.county], 0.0)
+    prev_share = _lag(share, 0.0)
+    prev_present = _lag(a.present, False)
+    entry = a.present & ~prev_present
+    exit_ = prev_present & ~a.present
+    incumbent = a.present & prev_present
+    sq, prev_sq = share ** 2, prev_share ** 2
+
+    # -- county-year ------------------------------------------------------------------------
+    hhi = a.by_county(sq)
+    prev_totals = _lag(totals, np.nan)
+    county = {
+        "county_deposits": totals,
+        "n_banks": a.by_county(a.present.astype(np.int64)),
+        "hhi": hhi,
+        "d_hhi": _first_year_missing(hhi - a.by_county(prev_sq)),
+        "d_hhi_incumbents": _first_year_missing(a.by_county(np.where(incumbent, sq - prev_sq, 0.0))),
+        "d_hhi_entry": _first_year_missing(a.by_county(np.where(entry, sq, 0.0))),
+        "d_hhi_exit": _first_year_missing(a.by_county(np.where(exit_, prev_sq, 0.0))),
+        "n_entrants": _first_year_missing(a.by_county(entry.astype(np.int64))),
+        "n_exits": _first_year_missing(a.by_county(exit_.astype(np.int64))),
+        "entrant_share": _first_year_missing(a.by_county(np.where(entry, share, 0.0))),
+        "exit_share": _first_year_missing(a.by_county(np.where(exit_, prev_share, 0.0))),
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        county["county_deposit_growth"] = np.where(prev_totals > 0, totals / prev_totals - 1, np.nan)
+    # A county with no deposits the year before has no HHI to change from
+    for col in ("d_hhi", "d_hhi_incumbents", "d_hhi_entry", "d_hhi_exit", "exit_share"):
+        county[col] = np.where(prev_totals > 0, county[col], np.nan)
+    has = a.by_county(a.present.astype(np.int64)) > 0
+    c_idx, t_idx = np.nonzero(has)
+    county_out = pd.DataFrame({"YEAR": a.years[t_idx], "fips": pd.Series(a.fips[c_idx]).astype(str).str.zfill(5)})
+    for col, x in county.items():
+        county_out[col] = x[c_idx, t_idx]
+
+    # -- bank-year --------------------------------------------------------------------------
+    bank_dep = a.by_bank(a.deposits)
+    prev_bank_dep = _lag(bank_dep, np.nan)
+    d_share = share - prev_share
+    pair_hhi, pair_d_hhi = hhi[a.county], county["d_hhi"][a.county]
+
+    def weighted(x: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return a.by_bank(np.where(a.present, a.deposits * np.nan_to_num(x), 0.0)) / bank_dep
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bank = {
+            "bank_branch_deposits": bank_dep,
+            "n_counties": a.by_bank(a.present.astype(np.int64)),
+            "n_counties_entered": _first_year_missing(a.by_bank(entry.astype(np.int64))),
+            "n_counties_exited": _first_year_missing(a.by_bank(exit_.astype(np.int64))),
+            "entered_deposit_share": _first_year_missing(a.by_bank(np.where(entry, a.deposits, 0.0)) / bank_dep),
+            "exited_deposit_share": np.where(
+                prev_bank_dep > 0, a.by_bank(np.where(exit_, _lag(a.deposits, 0.0), 0.0)) / prev_bank_dep, np.nan),
+            "weighted_county_share": weighted(share),
+            "weighted_d_county_share": _first_year_missing(weighted(d_share)),
+            "weighted_county_hhi": weighted(pair_hhi),
+            # Counties without deposits the year before count as no change
+            "weighted_d_county_hhi": _first_year_missing(weighted(pair_d_hhi)),
+        }
+    b_idx, t_idx = np.nonzero(bank["n_counties"] > 0)
+    bank_out = pd.DataFrame({"YEAR": a.years[t_idx], "RSSDID": a.banks[b_idx]})
+    for col, x in bank.items():
+        bank_out[col] = x[b_idx, t_idx]
+
+    county_out = county_out.sort_values(["YEAR", "fips"], kind="stable").reset_index(drop=True)
+    bank_out = bank_out.sort_values(["YEAR", "RSSDID"], kind="stable").reset_index(drop=True)
+    return {"county": county_out, "bank": bank_out}
+
+
+def build(sod: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    return dynamics(share_arrays(sod[SOD_COLUMNS]))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="County deposit-market dynamics from the SOD history.")
+    ap.add_argument("--sod", default=INPUTS["sod"], help="SOD branch file covering the years to compare.")
+    args = ap.parse_args()
+
+    sod = pd.read_csv(args.sod, usecols=SOD_COLUMNS)
+    t0 = time.perf_counter()
+    a = share_arrays(sod)
+    out = dynamics(a)
+    print(f"{len(a.county):,} county-bank pairs x {len(a.years)} SOD years ({a.years[0]}-{a.years[-1]}) "
+          f"in {time.perf_counter() - t0:.2f}s")
+    for name, frame in out.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+        print(f"Saved {OUTPUTS[name]} ({len(frame):,} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Memory-mapped bank x quarter store for the working panel.
+
+Converts the long working panel (one row per bank-quarter) into dense arrays on disk:
+- values.npy: float array of shape (n_variables, n_banks, n_quarters), NaN where unobserved.
+  Variable-major, so each variable is one contiguous (bank x quarter) slab.
+- mask.npy: bool array (n_banks, n_quarters), True where the bank-quarter is in the panel.
+- banks.npy: int64 bank ids (rssd9001), sorted; row i of every slab is banks[i].
+- quarters.npy: int16 quarter codes on a gap-free calendar, so a lag is a shift along the last
+  axis. The codes are the pipeline's qdate (quarters.py, Stata-style: 2022q1 = 248), taken from the
+  panel's qdate column or derived from its date column, so they join directly with the panels.
+- meta.json: variable names and the source columns used for bank and date.
+
+Reads go through np.load(mmap_mode='r'): nothing is copied or unpickled, and worker processes
+that open the same directory share the pages through the OS cache. Pass the directory path to
+workers, not the arrays.
+
+Usage:
+  python programs/clean/panel_store.py                      # working_panel.csv -> data/working/panel_store
+  python programs/clean/panel_store.py --panel other.csv --out data/working/other_store
+"""
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from quarters import QDATE, ensure_qdate, qdate_to_date
+
+PANEL_CSV = "data/working/working_panel.csv"
+STORE_DIR = "data/working/panel_store"
+BANK_COL = "Bank ID"
+DATE_COL = "Date"
+
+
+def quarter_code(panel: pd.DataFrame, date_col: str = DATE_COL) -> pd.Series:
+    """Int16 qdate of every row: the panel's qdate column, or derived from date_col without one."""
+    cols = [date_col] + ([QDATE] if QDATE in panel.columns else [])
+    return ensure_qdate(panel[cols], date_col)[QDATE]
+
+
+def quarter_end(codes: np.ndarray) -> pd.DatetimeIndex:
+    """Quarter-end dates for qdate codes."""
+    return pd.DatetimeIndex(qdate_to_date(np.asarray(codes)))
+
+
+def build_store(
+    panel: pd.DataFrame,
+    out_dir: str = STORE_DIR,
+    columns: Optional[List[str]] = None,
+    bank_col: str = BANK_COL,
+    date_col: str = DATE_COL,
+    keep: Optional[str] = None,
+    dtype=np.float64,
+) -> "PanelStore":
+    """Write the long panel to out_dir as dense memory-mapped arrays and open it.
+
+    columns defaults to every numeric column except the bank and date keys. Duplicate
+    bank-quarters raise unless keep='first' or keep='last' is given.
+    """
+    if columns is None:
+        columns = [
+            c for c in panel.select_dtypes(include="number").columns if c not in (bank_col, date_col, QDATE)
+        ]
+    non_numeric = [c for c in columns if not pd.api.types.is_numeric_dtype(panel[c])]
+    if non_numeric:
+        raise ValueError(f"Non-numeric columns cannot be stored: {non_numeric}")
+
+    banks = panel[bank_col].to_numpy(dtype=np.int64)
+    qdates = quarter_code(panel, date_col)
+    if qdates.isna().any():
+        raise ValueError(f"Unparseable dates in '{date_col}'.")
+    qcodes = qdates.to_numpy(dtype=np.int16)
+
+    keys = pd.DataFrame({"bank": banks, "quarter": qcodes})
+    dup = keys.duplicated(keep=False).to_numpy()
+    if dup.any():
+        if keep not in ("first", "last"):
+            raise ValueError(
+                f"{dup.sum():,} rows share a (bank, quarter) key; pass keep='first' or keep='last'."
+            )
+        keep_rows = ~keys.duplicated(keep=keep).to_numpy()
+        panel, banks, qcodes = panel[keep_rows], banks[keep_rows], qcodes[keep_rows]
+
+    bank_ids, bank_pos = np.unique(banks, return_inverse=True)
+    quarters = np.arange(qcodes.min(), qcodes.max() + 1, dtype=np.int16)
+    q_pos = qcodes - quarters[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    shape = (len(columns), len(bank_ids), len(quarters))
+    values = np.lib.format.open_memmap(
+        os.path.join(out_dir, "values.npy"), mode="w+", dtype=dtype, shape=shape
+    )
+    for k, col in enumerate(columns):
+        slab = values[k]
+        slab[:] = np.nan
+        slab[bank_pos, q_pos] = panel[col].to_numpy(dtype=dtype, na_value=np.nan)
+    values.flush()
+    del values
+
+    mask = np.zeros(shape[1:], dtype=bool)
+    mask[bank_pos, q_pos] = True
+    np.save(os.path.join(out_dir, "mask.npy"), mask)
+    np.save(os.path.join(out_dir, "banks.npy"), bank_ids)
+    np.save(os.path.join(out_dir, "quarters.npy"), quarters)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"variables": list(columns), "bank_col": bank_col, "date_col": date_col}, f, indent=2)
+    return PanelStore(out_dir)
+
+
+class PanelStore:
+    """Read-only, zero-copy view of a store written by build_store."""
+
+    def __init__(self, path: str = STORE_DIR) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.variables: List[str] = meta["variables"]
+        self.bank_col: str = meta["bank_col"]
+        self.date_col: str = meta["date_col"]
+        self.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+        self.mask = np.load(os.path.join(path, "mask.npy"), mmap_mode="r")
+        self.banks = np.load(os.path.join(path, "banks.npy"), mmap_mode="r")
+        self.quarters = np.load(os.path.join(path, "quarters.npy"), mmap_mode="r")
+        self._var_pos = {v: i for i, v in enumerate(self.variables)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def bank_index(self) -> Dict[int, int]:
+        """Bank id -> row position."""
+        return {int(b): i for i, b in enumerate(self.banks)}
+
+    @property
+    def quarter_index(self) -> Dict[int, int]:
+        """qdate -> column position."""
+        return {int(q): i for i, q in enumerate(self.quarters)}
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return quarter_end(self.quarters)
+
+    def __getitem__(self, variable: str) -> np.ndarray:
+        """(n_banks, n_quarters) read-only view of one variable."""
+        return self.values[self._var_pos[variable]]
+
+    def lag(self, variable: str, k: int = 1) -> np.ndarray:
+        """Variable shifted k quarters along the calendar (NaN where the lag falls outside)."""
+        x = self[variable]
+        out = np.full(x.shape, np.nan, dtype=x.dtype)
+        if k > 0:
+            out[:, k:] = x[:, :-k]
+        elif k < 0:
+            out[:, :k] = x[:, -k:]
+        else:
+            out[:] = x
+        return out
+
+    def to_long(self, variables: Optional[List[str]] = None, all_cells: bool = False) -> pd.DataFrame:
+        """Back to one row per bank-quarter, sorted by bank then date.
+
+        Only cells present in the original panel are returned unless all_cells is set.
+        """
+        variables = self.variables if variables is None else variables
+        if all_cells:
+            b_pos, q_pos = np.indices(self.mask.shape).reshape(2, -1)
+        else:
+            b_pos, q_pos = np.nonzero(self.mask)
+        out = pd.DataFrame({
+            self.bank_col: self.banks[b_pos],
+            self.date_col: quarter_end(self.quarters[q_pos]).strftime("%Y-%m-%d"),
+        })
+        for v in variables:
+            out[v] = self[v][b_pos, q_pos]
+        return out
+
+    def from_array(self, arr: np.ndarray, name: str) -> pd.DataFrame:
+        """Long frame for an arbitrary (n_banks, n_quarters) array aligned with this store."""
+        if arr.shape != self.mask.shape:
+            raise ValueError(f"Expected shape {self.mask.shape}, got {arr.shape}.")
+        b_pos, q_pos = np.nonzero(self.mask)
+        return pd.DataFrame({
+            self.bank_col: self.banks[b_pos],
+            self.date_col: quarter_end(self.quarters[q_pos]).strftime("%Y-%m-%d"),
+            name: arr[b_pos, q_pos],
+        })
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build a memory-mapped bank x quarter panel store.")
+    ap.add_argument("--panel", default=PANEL_CSV, help="Long panel CSV.")
+    ap.add_argument("--out", default=STORE_DIR, help="Output directory.")
+    ap.add_argument("--keep", choices=["first", "last"], default=None,
+                    help="How to resolve duplicate bank-quarters (default: error).")
+    args = ap.parse_args()
+
+    store = build_store(pd.read_csv(args.panel), args.out, keep=args.keep)
+    n_var, n_bank, n_q = store.shape
+    print(f"Saved {n_var} variables x {n_bank:,} banks x {n_q} quarters to {args.out} "
+          f"({int(store.mask.sum()):,} observed cells)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Runs the cleaning stages in dependency order inside one Python process.
+
+Each stage module exposes INPUTS (name -> CSV path), OUTPUTS (name -> CSV path), load_inputs()
+and a build function taking its inputs as DataFrames. Upstream outputs use the same names as
+downstream inputs (e.g. instruments' 'sophistication_index').
+
+Modes:
+- files (default): every stage reads its inputs from disk and writes all of its outputs, the
+  same as running the scripts one after another.
+- --in-memory: stage outputs are handed to downstream stages as DataFrames, skipping the
+  CSV write/parse between stages. Only outputs named with --write are written (default: the
+  working panel); frames are released once no later stage needs them.
+
+Stage inputs and outputs for --list / --dry-run are read from the modules' source (stage_io),
+so planning imports neither the stages nor pandas.
+
+Validation (validation.py) is on by default: inputs are checked when loaded, outputs before they
+are written or handed on, and each stage's declared joins before it runs. Errors stop the run;
+warnings are printed. --validate sample checks a hashed fraction of banks in large files,
+--validate off skips the checks, --strict turns warnings into errors.
+
+Frames are held under the compact dtype plan of dtypes.py (int32 ids, Int16 quarters, uint8
+flags, float32 shares, categorical labels), applied to every input loaded and every output built;
+--dtypes native keeps read_csv's types. --memory-report prints each stage's memory before and
+after the plan.
+
+THESIS_PROFILE=1 (or a directory) profiles the run with spans per stage (profiling.py).
+
+--variant NAME builds into an immutable run directory data/runs/NAME/<key>/ instead of the fixed
+paths, with module constants overridden by --set (runs.py). Unchanged stages are shared between
+variants through the store, so variants can build concurrently without clobbering each other.
+
+Usage:
+  python programs/clean/pipeline.py --list
+  python programs/clean/pipeline.py --dry-run --stages instruments working_panel
+  python programs/clean/pipeline.py --in-memory
+  python programs/clean/pipeline.py --in-memory --write instruments working_panel
+  python programs/clean/pipeline.py --in-memory --stages ffr instruments working_panel
+  python programs/clean/pipeline.py --in-memory --call-source bulk   # Call Reports from call_bulk.py
+  python programs/clean/pipeline.py --in-memory --validate sample --strict
+  python programs/clean/pipeline.py --variant z5 --set working_panel_merge.Z_LIMIT=5
+  python programs/clean/pipeline.py --in-memory --memory-report
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import importlib
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import profiling
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass
+class Stage:
+    name: str
+    module: str
+    func: str = "build"
+
+
+STAGES = [
+    Stage("deposit_interest_rate", "deposit_interest_rate"),
+    Stage("bank_credit", "bank_credit"),
+    Stage("controls", "control"),
+    Stage("ffr", "ffr_clean"),
+    Stage("sophistication_index", "sophistication_index_merge"),
+    Stage("instruments", "instruments"),
+    Stage("working_panel", "working_panel_merge", "build_panel"),
+]
+STAGE_NAMES = [s.name for s in STAGES]
+DEFAULT_WRITE = ["working_panel"]
+# Stages whose raw Call Report inputs can come from the FFIEC bulk dataset instead of WRDS CSVs
+CALL_REPORT_STAGES = {"deposit_interest_rate", "bank_credit", "controls"}
+CLEAN_DIR = os.path.dirname(os.path.abspath(__file__))
+CALL_SOURCES = ["csv", "bulk"]
+VALIDATE_MODES = ["full", "sample", "off"]
+DTYPE_MODES = ["compact", "native"]
+DTYPES = "compact"  # dtypes.DTYPE_PLAN on every frame, or 'native' read_csv types
+MEMORY_REPORT = False
+
+
+def _literal(node: ast.AST, env: Dict[str, Any]) -> Any:
+    """Value of a constant expression: literals, dicts, f-strings and names assigned earlier."""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in env:
+        return env[node.id]
+    if isinstance(node, ast.JoinedStr):
+        return "".join(str(_literal(v.value if isinstance(v, ast.FormattedValue) else v, env)) for v in node.values)
+    if isinstance(node, ast.Dict):
+        return {_literal(k, env): _literal(v, env) for k, v in zip(node.keys, node.values)}
+    raise ValueError(f"not a constant expression: {ast.dump(node)[:60]}")
+
+
+def stage_io(stage: Stage) -> Dict[str, Dict[str, str]]:
+    """A stage's INPUTS and OUTPUTS, read from its module source without importing it."""
+    path = os.path.join(CLEAN_DIR, f"{stage.module}.py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    env: Dict[str, Any] = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                env[node.targets[0].id] = _literal(node.value, env)
+            except ValueError:
+                continue
+    return {"INPUTS": env.get("INPUTS", {}), "OUTPUTS": env.get("OUTPUTS", {})}
+
+
+def print_plan(stages: List[Stage], check_files: bool = True) -> None:
+    """Stages in run order with their inputs (produced upstream, on disk or missing) and outputs."""
+    produced: set = set()
+    for stage in stages:
+        io = stage_io(stage)
+        print(f"{stage.name:24s} {stage.module}.{stage.func}: "
+              f"{', '.join(io['INPUTS'])} -> {', '.join(io['OUTPUTS'])}")
+        if check_files:
+            for name, path in io["INPUTS"].items():
+                status = "upstream" if name in produced else ("ok" if os.path.exists(path) else "MISSING")
+                print(f"    < {name:44s} {path} [{status}]")
+            for name, path in io["OUTPUTS"].items():
+                print(f"    > {name:44s} {path}")
+        produced.update(io["OUTPUTS"])
+
+
+def _as_outputs(mod, result) -> Dict[str, pd.DataFrame]:
+    if isinstance(result, dict):
+        return result
+    (name,) = mod.OUTPUTS
+    return {name: result}
+
+
+def _compact(stage: Stage, frames: Dict[str, pd.DataFrame], what: str) -> Dict[str, pd.DataFrame]:
+    """Frames under the dtype plan (unless DTYPES is 'native'), printing the memory saved if asked."""
+    if DTYPES == "native" or not frames:
+        return frames
+    import dtypes
+    planned = {name: dtypes.apply_plan(frame) for name, frame in frames.items()}
+    if MEMORY_REPORT:
+        before = sum(dtypes.frame_bytes(f) for f in frames.values())
+        after = sum(dtypes.frame_bytes(f) for f in planned.values())
+        print(f"[{stage.name}] {what}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+              f"({100 * (1 - after / before) if before else 0:.0f}% saved)")
+    return planned
+
+
+def _load_inputs(stage: Stage, mod, names: List[str], call_source: str) -> Dict[str, pd.DataFrame]:
+    if stage.name in CALL_REPORT_STAGES:
+        frames = mod.load_inputs(names, source=call_source)
+    else:
+        frames = mod.load_inputs(names)
+    return _compact(stage, frames, "inputs")
+
+
+class _Validator:
+    """Runs validation.py checks for the pipeline and keeps track of their time and checked files."""
+
+    def __init__(self, mode: str = "full", strict: bool = False) -> None:
+        self.mode = mode
+        self.strict = strict
+        self.checked: set = set()
+        self.elapsed = 0.0
+        if mode != "off":
+            import validation
+            self.v = validation
+            self.sample = validation.SAMPLE_FRACTION if mode == "sample" else None
+
+    def frames(self, frames: Dict[str, pd.DataFrame], paths: Dict[str, str], stage: Optional[str] = None) -> None:
+        """Check frames by name (skipping files already checked in this run) and the stage's joins."""
+        if self.mode == "off":
+            return
+        t0 = time.perf_counter()
+        found = self.v.check_frames(frames, paths, self.sample, skip=self.checked)
+        if stage is not None:
+            found += self.v.check_merges(stage, frames, self.sample)
+        self.checked.update(paths[name] for name in frames if name in paths)
+        self.elapsed += time.perf_counter() - t0
+        self.v.report(found, self.strict)
+
+    def timing(self) -> str:
+        text = f" (validation {self.elapsed:.2f}s)" if self.mode != "off" else ""
+        self.elapsed = 0.0
+        return text
+
+
+def run_files(stages: List[Stage], call_source: str = "csv", validate: str = "full", strict: bool = False) -> None:
+    check = _Validator(validate, strict)
+    for stage in stages:
+        t0 = time.perf_counter()
+        mod = importlib.import_module(stage.module)
+        profiling.instrument(mod)
+        with profiling.span(stage.name):
+            # Same as the script's main(), without handing it this process's command line
+            inputs = _load_inputs(stage, mod, list(mod.INPUTS), call_source)
+            check.frames(inputs, mod.INPUTS, stage.name)
+            outputs = _compact(stage, _as_outputs(mod, getattr(mod, stage.func)(**inputs)), "outputs")
+            check.frames(outputs, mod.OUTPUTS)
+            for name, frame in outputs.items():
+                frame.to_csv(mod.OUTPUTS[name], index=False)
+        print(f"[{stage.name}] done in {time.perf_counter() - t0:.1f}s{check.timing()}")
+
+
+def run_in_memory(stages: List[Stage], write: Optional[List[str]] = None, call_source: str = "csv",
+                  validate: str = "full", strict: bool = False) -> Dict[str, pd.DataFrame]:
+    """Run stages passing frames directly; returns the last stage's outputs (and any still held)."""
+    write = DEFAULT_WRITE if write is None else write
+    check = _Validator(validate, strict)
+    modules = {s.name: importlib.import_module(s.module) for s in stages}
+    for mod in modules.values():
+        profiling.instrument(mod)
+    write_all = "all" in write
+
+    # Last stage that consumes each name, so frames can be dropped as soon as possible.
+    last_use = {}
+    for i, stage in enumerate(stages):
+        for name in modules[stage.name].INPUTS:
+            last_use[name] = i
+
+    frames: Dict[str, pd.DataFrame] = {}
+    for i, stage in enumerate(stages):
+        mod = modules[stage.name]
+        t0 = time.perf_counter()
+        with profiling.span(stage.name):
+            inputs = {name: frames[name] for name in mod.INPUTS if name in frames}
+            missing = [name for name in mod.INPUTS if name not in frames]
+            if missing:
+                inputs.update(_load_inputs(stage, mod, missing, call_source))
+            # upstream frames were checked as outputs; the loaded ones and the joins are new
+            check.frames(inputs, mod.INPUTS, stage.name)
+            outputs = _compact(stage, _as_outputs(mod, getattr(mod, stage.func)(**inputs)), "outputs")
+            del inputs
+            check.frames(outputs, mod.OUTPUTS)
+
+            for name, frame in outputs.items():
+                if write_all or name in write:
+                    frame.to_csv(mod.OUTPUTS[name], index=False)
+                    print(f"[{stage.name}] wrote {mod.OUTPUTS[name]}")
+                frames[name] = frame
+        if i < len(stages) - 1:
+            for name in [n for n in frames if last_use.get(n, -1) <= i]:
+                del frames[name]
+        print(f"[{stage.name}] done in {time.perf_counter() - t0:.1f}s{check.timing()}")
+    return frames
+
+
+def configure(dtypes: str = "compact", memory_report: bool = False) -> None:
+    """Set the dtype mode and memory report for the runners in this process."""
+    global DTYPES, MEMORY_REPORT
+    DTYPES, MEMORY_REPORT = dtypes, memory_report
+
+
+def select_stages(names: Optional[List[str]]) -> List[Stage]:
+    if not names:
+        return list(STAGES)
+    unknown = [n for n in names if n not in STAGE_NAMES]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {unknown}. Choose from {STAGE_NAMES}.")
+    return [s for s in STAGES if s.name in names]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Run the cleaning pipeline in one process.")
+    ap.add_argument("--in-memory", action="store_true",
+                    help="Pass DataFrames between stages instead of CSV round-trips.")
+    ap.add_argument("--write", nargs="+", default=None,
+                    help="Outputs to write in --in-memory mode ('all' for every output).")
+    ap.add_argument("--stages", nargs="+", default=None,
+                    help=f"Subset of stages to run, in pipeline order ({', '.join(STAGE_NAMES)}).")
+    ap.add_argument("--call-source", choices=CALL_SOURCES, default="csv",
+                    help="Raw Call Report inputs: WRDS CSVs in data/raw, or the call_bulk.py dataset.")
+    ap.add_argument("--list", action="store_true", help="List stages and their outputs, then exit.")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="Show the plan with each input's source (upstream, on disk, missing), then exit.")
+    ap.add_argument("--validate", choices=VALIDATE_MODES, default="full",
+                    help="Schema and invariant checks: every row, a sample of banks in large files, or none.")
+    ap.add_argument("--strict", action="store_true", help="Treat validation warnings as errors.")
+    ap.add_argument("--dtypes", choices=DTYPE_MODES, default=DTYPES,
+                    help="Hold frames under the compact dtype plan (dtypes.py) or as read_csv types them.")
+    ap.add_argument("--memory-report", action="store_true",
+                    help="Print each stage's input and output memory before and after the dtype plan.")
+    ap.add_argument("--variant", default=None,
+                    help="Build into the run directory data/runs/VARIANT/<key> (see runs.py).")
+    ap.add_argument("--set", nargs="+", default=None, metavar="MODULE.NAME=VALUE",
+                    help="Override module constants for a --variant build.")
+    args = ap.parse_args()
+    if args.set and not args.variant:
+        ap.error("--set requires --variant")
+    configure(args.dtypes, args.memory_report)
+
+    stages = select_stages(args.stages)
+    if args.list or args.dry_run:
+        print_plan(stages, check_files=args.dry_run)
+        return
+
+    with profiling.from_env("pipeline"):
+        if args.variant:
+            import runs
+            runs.run_variant(stages, args.variant, runs.parse_params(args.set), args.call_source,
+                             args.validate, args.strict)
+        elif args.in_memory:
+            run_in_memory(stages, args.write, args.call_source, args.validate, args.strict)
+        else:
+            run_files(stages, args.call_source, args.validate, args.strict)
+
+
+if __name__ == "__main__":
+    main()
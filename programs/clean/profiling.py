@@ -0,0 +1,344 @@
+"""
+Opt-in profiling of the pipeline, build and fetch entry points, with spans by stage and operation.
+
+Nothing here runs unless a profile is started: with --profile on thesis_bank.py, or with the
+THESIS_PROFILE environment variable for scripts that call from_env() (pipeline.py). While a profile
+is active:
+
+- spans: each pipeline stage is a span, and so is every function of the modules in SPAN_MODULES
+  (the Call Report stages, instruments, the working panel merge, the fetch scripts), wrapped
+  when the module is imported by the runners; spans nest per thread;
+- op timers: the pandas calls that dominate a rebuild (read_csv, to_csv, merges, sorts,
+  de-duplication, groupby shift/transform/aggregations, ...) and HTTP requests through requests
+  are timed, attributed to the innermost span; an op called inside another op counts once;
+- sampling: a thread records every thread's Python stack every INTERVAL seconds, prefixed with the
+  thread's open spans and current op, so flame graphs group by stage and operation;
+- optionally (cprofile=True) cProfile on the main thread.
+
+The module source is not edited: wrappers are installed on module attributes and removed when the
+profile stops. Stopping writes to the profile directory (PROFILE_DIR/<time>-<label> by default):
+
+  speedscope.json   sampled profile per thread, for https://www.speedscope.app
+  stacks.folded     the same samples as folded stacks (flamegraph.pl, speedscope, inferno)
+  ops.csv           per (span, op): calls, seconds, max seconds, result rows
+  spans.csv         per span path: calls and inclusive seconds
+  profile.prof      cProfile stats (pstats / snakeviz), if requested
+
+and prints the top-N ops and spans.
+
+Usage:
+  python programs/thesis_bank.py --profile clean deposit_interest_rate instruments working_panel
+  python programs/thesis_bank.py --profile --profile-dir data/profiles/acs --profile-top 30 fetch acs --year 2022
+  THESIS_PROFILE=1 python programs/clean/pipeline.py --in-memory
+"""
+import collections
+import contextlib
+import csv
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_DIR = "data/profiles"
+ENV_VAR = "THESIS_PROFILE"
+INTERVAL = 0.005  # seconds between stack samples
+TOP_N = 15
+# Modules whose functions become spans when profiled
+SPAN_MODULES = {
+    "deposit_interest_rate", "bank_credit", "control", "instruments", "working_panel_merge", "quarters",
+    "acs_county_fetch", "hmda_county_fetch", "irs_county_fetch",
+}
+# (module, class or None, attribute) timed as ops
+PANDAS_OPS = [
+    ("pandas", None, "read_csv"),
+    ("pandas", None, "read_parquet"),
+    ("pandas", None, "merge"),
+    ("pandas", None, "concat"),
+    ("pandas", "DataFrame", "merge"),
+    ("pandas", "DataFrame", "join"),
+    ("pandas", "DataFrame", "sort_values"),
+    ("pandas", "DataFrame", "drop_duplicates"),
+    ("pandas", "DataFrame", "pivot"),
+    ("pandas", "DataFrame", "to_csv"),
+    ("pandas", "DataFrame", "to_parquet"),
+    ("pandas", "DataFrame", "apply"),
+    ("pandas", "Series", "apply"),
+    ("pandas", "Series", "map"),
+]
+GROUPBY_OPS = ["shift", "diff", "pct_change", "transform", "agg", "aggregate", "apply", "sum", "mean",
+               "first", "last", "size", "count", "quantile", "cumsum"]
+HTTP_OP = ("requests", "Session", "request")
+
+_ACTIVE: Optional["Profiler"] = None
+_INHERITED = object()
+
+
+class Profiler:
+    """One profile: spans, op timers, the stack sampler and the patches that feed them."""
+
+    def __init__(self, out_dir: Optional[str] = None, label: str = "run", interval: float = INTERVAL,
+                 top: int = TOP_N, cprofile: bool = False) -> None:
+        self.label = label
+        self.out_dir = out_dir or os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}")
+        self.interval = interval
+        self.top = top
+        self.cprofile = cprofile
+        self.local = threading.local()
+        self.tags: Dict[int, List[str]] = {}  # thread id -> open spans and op, read by the sampler
+        self.ops: Dict[Tuple[str, str], List[float]] = collections.defaultdict(lambda: [0, 0.0, 0.0, 0])
+        self.spans: Dict[str, List[float]] = collections.defaultdict(lambda: [0, 0.0])
+        self.samples: Dict[Tuple[str, Tuple[str, ...]], int] = collections.Counter()
+        self.patches: List[Tuple[Any, str, Any]] = []
+        self.wrappers: Dict[int, Callable] = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._cprofile = None
+        self.start_time = 0.0
+        self.wall = 0.0
+
+    # -- spans and ops ----------------------------------------------------------------------
+    def _stack(self) -> List[str]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+            self.tags[threading.get_ident()] = stack
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        stack = self._stack()
+        stack.append(name)
+        path = ";".join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                rec = self.spans[path]
+                rec[0] += 1
+                rec[1] += elapsed
+
+    def _op(self, name: str, func: Callable, args, kwargs):
+        stack = self._stack()
+        if stack and stack[-1].startswith("op:"):
+            return func(*args, **kwargs)  # already inside a timed op
+        stack.append(f"op:{name}")
+        start = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            # Recorded also when the op raises: a failed request still waited
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            try:
+                rows = len(result)
+            except TypeError:
+                rows = 0
+            where = stack[-1] if stack else "(none)"
+            with self.lock:
+                rec = self.ops[(where, name)]
+                rec[0] += 1
+                rec[1] += elapsed
+                rec[2] = max(rec[2], elapsed)
+                rec[3] += rows
+
+    # -- patching ---------------------------------------------------------------------------
+    def _patch(self, owner: Any, attr: str, wrapper: Callable) -> None:
+        # An inherited method is shadowed on owner and the shadow deleted again on stop
+        self.patches.append((owner, attr, vars(owner).get(attr, _INHERITED)))
+        setattr(owner, attr, wrapper)
+
+    def _op_wrapper(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            return self._op(name, func, args, kwargs)
+        return timed
+
+    def _span_wrapper(self, name: str, func: Callable) -> Callable:
+        wrapped = self.wrappers.get(id(func))
+        if wrapped is None:
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            wrapped._profiled = True
+            self.wrappers[id(func)] = wrapped
+        return wrapped
+
+    def _patch_ops(self) -> None:
+        import importlib
+        for module, cls, attr in PANDAS_OPS + [HTTP_OP]:
+            try:
+                mod = importlib.import_module(module)
+            except ImportError:
+                continue
+            owner = getattr(mod, cls) if cls else mod
+            name = f"http.{attr}" if module == "requests" else (f"{cls}.{attr}" if cls else attr)
+            self._patch(owner, attr, self._op_wrapper(name, getattr(owner, attr)))
+        from pandas.core.groupby.generic import DataFrameGroupBy, SeriesGroupBy
+        for cls in (DataFrameGroupBy, SeriesGroupBy):
+            for attr in GROUPBY_OPS:
+                if hasattr(cls, attr):
+                    self._patch(cls, attr, self._op_wrapper(f"groupby.{attr}", getattr(cls, attr)))
+
+    def instrument(self, module) -> None:
+        """Wrap the module's functions (and those it imported from other span modules) as spans."""
+        short = module.__name__.rsplit(".", 1)[-1]
+        if short not in SPAN_MODULES:
+            return
+        for attr, obj in list(vars(module).items()):
+            if not inspect.isfunction(obj) or getattr(obj, "_profiled", False) or attr == "main":
+                continue
+            owner = obj.__module__.rsplit(".", 1)[-1]
+            if owner in SPAN_MODULES:
+                self._patch(module, attr, self._span_wrapper(f"{owner}.{obj.__name__}", obj))
+
+    # -- sampling ---------------------------------------------------------------------------
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                tags = tuple(self.tags.get(tid, ()))
+                self.samples[(names.get(tid, str(tid)), tags + tuple(stack))] += 1
+
+    # -- lifecycle --------------------------------------------------------------------------
+    def start(self) -> "Profiler":
+        global _ACTIVE
+        if _ACTIVE is not None:
+            raise ValueError("A profile is already active.")
+        _ACTIVE = self
+        self._patch_ops()
+        for name in SPAN_MODULES:
+            if name in sys.modules:
+                self.instrument(sys.modules[name])
+        self.start_time = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        if self.cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def stop(self) -> None:
+        global _ACTIVE
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self.wall = time.perf_counter() - self.start_time
+        self._stop.set()
+        self._sampler.join()
+        for owner, attr, original in reversed(self.patches):
+            if original is _INHERITED:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self.patches.clear()
+        _ACTIVE = None
+        self.write()
+        self.print_summary()
+
+    # -- output -----------------------------------------------------------------------------
+    def write(self) -> None:
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, "stacks.folded"), "w", encoding="utf-8") as f:
+            for (thread, stack), n in sorted(self.samples.items()):
+                f.write(f"{thread};{';'.join(stack)} {n}\n")
+        with open(os.path.join(self.out_dir, "speedscope.json"), "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(), f)
+        with open(os.path.join(self.out_dir, "ops.csv"), "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["span", "op", "calls", "seconds", "max_seconds", "rows"])
+            for (where, op), (calls, secs, peak, rows) in sorted(self.ops.items(), key=lambda kv: -kv[1][1]):
+                w.writerow([where, op, calls, f"{secs:.6f}", f"{peak:.6f}", rows])
+        with open(os.path.join(self.out_dir, "spans.csv"), "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["span", "calls", "seconds"])
+            for path, (calls, secs) in sorted(self.spans.items(), key=lambda kv: -kv[1][1]):
+                w.writerow([path, calls, f"{secs:.6f}"])
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(self.out_dir, "profile.prof"))
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Samples in speedscope's file format: one sampled profile per thread, weights in seconds."""
+        frames: Dict[str, int] = {}
+        by_thread: Dict[str, List[Tuple[List[int], int]]] = collections.defaultdict(list)
+        for (thread, stack), n in self.samples.items():
+            by_thread[thread].append(([frames.setdefault(s, len(frames)) for s in stack], n))
+        profiles = []
+        for thread, rows in sorted(by_thread.items()):
+            weights = [n * self.interval for _, n in rows]
+            profiles.append({"type": "sampled", "name": thread, "unit": "seconds", "startValue": 0,
+                             "endValue": sum(weights), "samples": [s for s, _ in rows], "weights": weights})
+        return {"$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": {"frames": [{"name": name} for name in frames]},
+                "profiles": profiles, "name": self.label, "exporter": "thesis-bank profiling.py"}
+
+    def print_summary(self) -> None:
+        print(f"Profile '{self.label}': {self.wall:.1f}s wall, {sum(self.samples.values()):,} samples -> {self.out_dir}")
+        ops = sorted(self.ops.items(), key=lambda kv: -kv[1][1])[:self.top]
+        if ops:
+            print(f"Top {len(ops)} ops by time (summed over threads, so % of wall can exceed 100):")
+            for (where, op), (calls, secs, peak, rows) in ops:
+                print(f"  {secs:8.2f}s {100 * secs / self.wall if self.wall else 0:5.1f}%  {op:26s} x{calls:<6d} "
+                      f"max {peak:6.2f}s  in {where}")
+        spans = sorted(self.spans.items(), key=lambda kv: -kv[1][1])[:self.top]
+        if spans:
+            print(f"Top {len(spans)} spans by inclusive time:")
+            for path, (calls, secs) in spans:
+                print(f"  {secs:8.2f}s  x{calls:<6d} {path.replace(';', ' > ')}")
+
+
+# -- module-level hooks (no-ops without an active profile) --------------------------------------
+def active() -> Optional[Profiler]:
+    return _ACTIVE
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    if _ACTIVE is None:
+        yield
+        return
+    with _ACTIVE.span(name):
+        yield
+
+
+def instrument(module) -> None:
+    if _ACTIVE is not None:
+        _ACTIVE.instrument(module)
+
+
+@contextlib.contextmanager
+def profiled(label: str, out_dir: Optional[str] = None, **options) -> Iterator[Profiler]:
+    prof = Profiler(out_dir, label, **options).start()
+    try:
+        yield prof
+    finally:
+        prof.stop()
+
+
+def from_env(label: str):
+    """profiled(label) if THESIS_PROFILE is set ('1' for the default directory, else a directory)."""
+    value = os.environ.get(ENV_VAR, "").strip()
+    if not value or value == "0" or _ACTIVE is not None:
+        return contextlib.nullcontext()
+    return profiled(label, None if value == "1" else value)
@@ -0,0 +1,85 @@
+"""
+Quarter calendar shared by the cleaning scripts.
+
+Quarters are coded like Stata's qdate (quarters since 1960q1: 2022q1 = 248) and stored as
+nullable Int16, two bytes per row. Stages carry a 'qdate' column next to their report date and
+the panel merges join on it instead of on date strings or timestamps, so each date column is
+parsed once, where it enters the pipeline.
+
+Date parsing goes through the distinct values: a Call Report extract has millions of rows but only
+a few dozen report dates, so parse_dates converts each distinct string once and broadcasts.
+
+bank_lag is the per-bank lag the Call Report stages take changes against; it can continue from the
+last rows of an earlier build, which is how incremental.py appends a quarter.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+QDATE = "qdate"
+QDATE_DTYPE = "Int16"
+EPOCH_YEAR = 1960  # Stata: tq(1960q1) == 0
+
+
+def parse_dates(values) -> pd.Series:
+    """Dates normalized to midnight; unparseable entries become NaT (errors='coerce')."""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.normalize()
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce").dt.normalize()
+    out = parsed.to_numpy()[np.maximum(codes, 0)]
+    out[codes < 0] = np.datetime64("NaT")
+    return pd.Series(out, index=values.index, dtype="datetime64[ns]")
+
+
+def to_qdate(values) -> pd.Series:
+    """Int16 quarter codes for dates (datetimes or date strings); missing dates stay <NA>."""
+    dates = parse_dates(values)
+    codes = (dates.dt.year - EPOCH_YEAR) * 4 + dates.dt.quarter - 1
+    return codes.astype(QDATE_DTYPE)
+
+
+def qdate_to_date(codes) -> pd.Series:
+    """Quarter-end dates for quarter codes."""
+    codes = pd.Series(codes).astype("float64")
+    parts = pd.DataFrame({"year": EPOCH_YEAR + codes // 4, "month": 3 * (codes % 4 + 1), "day": 1})
+    starts = pd.to_datetime(parts, errors="coerce")
+    return starts + pd.offsets.MonthEnd(0)
+
+
+def qdate_label(codes) -> pd.Series:
+    """'2022Q1'-style labels for quarter codes."""
+    codes = pd.Series(codes).astype("Int64")
+    labels = (EPOCH_YEAR + codes // 4).astype(str) + "Q" + (codes % 4 + 1).astype(str)
+    return labels.where(codes.notna())
+
+
+def ensure_qdate(df: pd.DataFrame, date_col: str) -> pd.DataFrame:
+    """df with an Int16 qdate column, derived from date_col if the frame does not carry one."""
+    if QDATE in df.columns:
+        if df[QDATE].dtype != QDATE_DTYPE:
+            df = df.assign(**{QDATE: df[QDATE].astype(QDATE_DTYPE)})
+        return df
+    pos = df.columns.get_loc(date_col) + 1
+    df = df.copy()
+    df.insert(pos, QDATE, to_qdate(df[date_col]))
+    return df
+
+
+def bank_lag(df: pd.DataFrame, column: str, prior: Optional[pd.DataFrame] = None,
+             keys: Sequence[str] = ("rssd9001",)) -> pd.Series:
+    """Value of column in the previous row of the same keys; df must be sorted by keys, then date.
+
+    prior (indexed by keys) supplies the previous value for each group's first row, e.g. the last
+    quarter already processed (incremental.py); without it the first row has no lag.
+    """
+    keys = list(keys)
+    lag = df.groupby(keys)[column].shift(1)
+    if prior is None:
+        return lag
+    first = ~df.duplicated(keys)
+    index = pd.MultiIndex.from_frame(df[keys]) if len(keys) > 1 else pd.Index(df[keys[0]])
+    carried = pd.Series(prior[column].reindex(index).to_numpy(), index=df.index)
+    return lag.mask(first, carried)
@@ -0,0 +1,365 @@
+"""
+Run-scoped, immutable outputs so parameter variants of the pipeline can build side by side.
+
+The fixed-path pipeline writes data/processed/*.csv and data/working/working_panel.csv, so two
+builds with different settings overwrite each other. Here every stage's outputs go to a
+content-keyed store instead, and each run gets its own directory of links into it:
+
+  data/runs/store/<stage>/<stage key>/...      stage outputs, written once, read-only
+  data/runs/<variant>/<run key>/processed/...  hard links to the store (symlinks, else copies)
+  data/runs/<variant>/<run key>/working/...
+  data/runs/<variant>/<run key>/run.json       parameters, call source and stage keys
+  data/runs/<variant>/current -> <run key>     the variant's latest run
+
+A stage key hashes the stage, its module's source and that of the shared helper modules
+(quarters.py, winsorize.py, ...), the parameters that apply to it (its own module's and the
+helpers') and the keys of its inputs: the upstream stage key for inputs built in the same run,
+otherwise the size and modification time of the file (or of every file under a directory) on
+disk. A stage whose key is already in the store is not rebuilt; variants that share upstream settings therefore share those
+stages' files through links instead of recomputing or copying them. The run key hashes the
+variant's stage keys.
+
+Parameters are module constants overridden for the run (--set working_panel_merge.Z_LIMIT=5);
+values are Python literals, anything else is taken as a string. They change module globals read
+when the build runs; a constant copied at import (into another constant or a function default) is
+rejected, since overriding it would leave the build unchanged.
+
+Store directories are built under a temporary name and renamed into place, and 'current' is
+replaced atomically, so concurrent builds of different (or the same) variants never see a partial
+directory: the first rename of a stage key wins and later builders keep the winner's files.
+
+Usage:
+  python programs/clean/pipeline.py --variant baseline
+  python programs/clean/pipeline.py --variant z5 --set working_panel_merge.Z_LIMIT=5 &
+  python programs/clean/pipeline.py --variant kll --set working_panel_merge.WINSOR_METHOD=kll &
+  python programs/clean/runs.py                          # variants, their current run and runs
+  python programs/analysis/stage1.py --panel data/runs/z5/current/working/working_panel.csv
+"""
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import pipeline
+import profiling
+
+RUNS_DIR = "data/runs"
+STORE_DIR = os.path.join(RUNS_DIR, "store")
+CURRENT = "current"
+MANIFEST = "run.json"
+KEY_LENGTH = 16
+DATA_PREFIX = "data/"
+STAGE_MODULES = {s.module for s in pipeline.STAGES}
+# Orchestration modules that do not change stage outputs
+RUNNER_MODULES = {"pipeline", "runs", "validation", "profiling"}
+
+
+def _digest(payload: Any) -> str:
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:KEY_LENGTH]
+
+
+def fingerprint(path: str) -> Any:
+    """Size and mtime of a file, of every file under a directory, or None if it does not exist."""
+    if os.path.isdir(path):
+        entries = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                st = os.stat(full)
+                entries.append([os.path.relpath(full, path), st.st_size, st.st_mtime_ns])
+        return sorted(entries)
+    if os.path.exists(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+    return None
+
+
+def source_hash(module: str) -> str:
+    with open(os.path.join(pipeline.CLEAN_DIR, f"{module}.py"), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:KEY_LENGTH]
+
+
+def shared_source_hash() -> str:
+    """Hash of the helper modules in programs/clean (all but the stage and runner modules)."""
+    names = sorted(f[:-3] for f in os.listdir(pipeline.CLEAN_DIR) if f.endswith(".py"))
+    skip = STAGE_MODULES | RUNNER_MODULES
+    return _digest({name: source_hash(name) for name in names if name not in skip})
+
+
+def parse_params(assignments: Optional[List[str]]) -> Dict[str, Dict[str, Any]]:
+    """'module.NAME=value' strings -> {module: {NAME: value}}."""
+    params: Dict[str, Dict[str, Any]] = {}
+    for item in assignments or []:
+        target, sep, raw = item.partition("=")
+        module, dot, name = target.partition(".")
+        if not sep or not dot or not name:
+            raise ValueError(f"Expected module.NAME=value, got '{item}'.")
+        try:
+            value = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            value = raw
+        params.setdefault(module, {})[name] = value
+    return params
+
+
+def bound_at_import(module: str) -> Dict[str, str]:
+    """Module constants whose value is copied at import: into another module-level (or class-level)
+    assignment or into a function default. Overriding one of them would not reach the build."""
+    path = os.path.join(pipeline.CLEAN_DIR, f"{module}.py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    def names(node: Optional[ast.AST]) -> List[str]:
+        return [n.id for n in ast.walk(node) if isinstance(n, ast.Name)] if node is not None else []
+
+    bound: Dict[str, str] = {}
+    body = list(tree.body)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            body += node.body
+    for node in body:
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            derived = ", ".join(t for target in targets for t in names(target))
+            for name in names(node.value):
+                bound.setdefault(name, f"used to compute {derived} at import")
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            label = getattr(node, "name", "lambda")
+            for default in node.args.defaults + [d for d in node.args.kw_defaults if d is not None]:
+                for name in names(default):
+                    bound.setdefault(name, f"bound as a default of {label}()")
+    return bound
+
+
+def apply_params(params: Dict[str, Dict[str, Any]]) -> None:
+    for module, values in params.items():
+        mod = importlib.import_module(module)
+        bound = bound_at_import(module)
+        for name in values:
+            if not hasattr(mod, name):
+                raise ValueError(f"{module} has no constant {name}.")
+            if name in bound:
+                raise ValueError(f"{module}.{name} is {bound[name]}; setting it would not change the build.")
+        for name, value in values.items():
+            setattr(mod, name, value)
+
+
+def _input_fingerprint(stage: pipeline.Stage, path: str, call_source: str) -> Any:
+    if stage.name in pipeline.CALL_REPORT_STAGES and call_source == "bulk":
+        from call_bulk import DATASET_DIR
+        return fingerprint(DATASET_DIR)
+    return fingerprint(path)
+
+
+def stage_key(stage: pipeline.Stage, io: Dict[str, Dict[str, str]], params: Dict[str, Dict[str, Any]],
+              upstream: Dict[str, str], call_source: str, shared: str = "") -> str:
+    inputs = {
+        name: {"stage": upstream[name]} if name in upstream else _input_fingerprint(stage, path, call_source)
+        for name, path in io["INPUTS"].items()
+    }
+    return _digest({
+        "stage": stage.name,
+        "func": stage.func,
+        "source": source_hash(stage.module),
+        "shared_source": shared,
+        "params": {m: v for m, v in params.items() if m == stage.module or m not in STAGE_MODULES},
+        "call_source": call_source if stage.name in pipeline.CALL_REPORT_STAGES else None,
+        "dtypes": pipeline.DTYPES,
+        "inputs": inputs,
+    })
+
+
+def _relative(path: str) -> str:
+    """Path of an output inside a run directory: data/processed/x.csv -> processed/x.csv."""
+    return path[len(DATA_PREFIX):] if path.startswith(DATA_PREFIX) else path
+
+
+def link_file(src: str, dst: str) -> str:
+    """Hard link src to dst, falling back to a relative symlink, then a copy; returns the method."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+        return "symlink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+def _publish(tmp: str, final: str) -> bool:
+    """Rename a finished temporary directory into place; False if another build got there first."""
+    try:
+        os.rename(tmp, final)
+        return True
+    except OSError:
+        if not os.path.isdir(final):
+            raise
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+
+def _tmp_dir(parent: str) -> str:
+    path = os.path.join(parent, f".tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    return path
+
+
+def store_outputs(stage: pipeline.Stage, key: str, outputs, paths: Dict[str, str]) -> str:
+    """Write a stage's output frames under its key, read-only; returns the store directory."""
+    final = os.path.join(STORE_DIR, stage.name, key)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    tmp = _tmp_dir(os.path.dirname(final))
+    for name, frame in outputs.items():
+        dst = os.path.join(tmp, _relative(paths[name]))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        frame.to_csv(dst, index=False)
+        os.chmod(dst, 0o444)
+    _publish(tmp, final)
+    return final
+
+
+def set_current(variant_dir: str, run_key: str) -> None:
+    """Point <variant>/current at run_key atomically (a CURRENT text file where symlinks fail)."""
+    link = os.path.join(variant_dir, CURRENT)
+    tmp = f"{link}.tmp-{os.getpid()}"
+    try:
+        os.symlink(run_key, tmp)
+    except OSError:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(run_key + "\n")
+    os.replace(tmp, link)
+
+
+def current_run(variant: str) -> Optional[str]:
+    link = os.path.join(RUNS_DIR, variant, CURRENT)
+    if os.path.islink(link):
+        return os.readlink(link)
+    if os.path.isfile(link):
+        with open(link, encoding="utf-8") as f:
+            return f.read().strip()
+    return None
+
+
+def run_variant(stages: List[pipeline.Stage], variant: str, params: Optional[Dict[str, Dict[str, Any]]] = None,
+                call_source: str = "csv", validate: str = "full", strict: bool = False) -> str:
+    """Build the stages for one variant into its own run directory; returns that directory.
+
+    Stages found in the store are reused; outputs built in this process are handed on in memory.
+    """
+    import pandas as pd
+
+    params = params or {}
+    apply_params(params)
+    check = pipeline._Validator(validate, strict)
+    produced: Dict[str, str] = {}  # output name -> producing stage key
+    locations: Dict[str, str] = {}  # output name -> file in the store
+    frames: Dict[str, pd.DataFrame] = {}
+    keys: Dict[str, str] = {}
+    shared = shared_source_hash()
+    last_use = {}
+    for i, stage in enumerate(stages):
+        for name in pipeline.stage_io(stage)["INPUTS"]:
+            last_use[name] = i
+
+    for i, stage in enumerate(stages):
+        t0 = time.perf_counter()
+        io = pipeline.stage_io(stage)
+        key = stage_key(stage, io, params, produced, call_source, shared)
+        keys[stage.name] = key
+        store = os.path.join(STORE_DIR, stage.name, key)
+        if os.path.isdir(store):
+            status = "reused"
+        else:
+            mod = importlib.import_module(stage.module)
+            profiling.instrument(mod)
+            with profiling.span(stage.name):
+                inputs = {name: frames[name] for name in mod.INPUTS if name in frames}
+                stored = {name: pd.read_csv(locations[name]) for name in mod.INPUTS
+                          if name not in inputs and name in locations}
+                inputs.update(pipeline._compact(stage, stored, "inputs"))
+                missing = [name for name in mod.INPUTS if name not in inputs]
+                if missing:
+                    inputs.update(pipeline._load_inputs(stage, mod, missing, call_source))
+                check.frames(inputs, mod.INPUTS, stage.name)
+                outputs = pipeline._as_outputs(mod, getattr(mod, stage.func)(**inputs))
+                outputs = pipeline._compact(stage, outputs, "outputs")
+                del inputs
+                check.frames(outputs, mod.OUTPUTS)
+                store_outputs(stage, key, outputs, mod.OUTPUTS)
+            frames.update(outputs)
+            status = "built"
+        for name, path in io["OUTPUTS"].items():
+            produced[name] = key
+            locations[name] = os.path.join(store, _relative(path))
+        for name in [n for n in frames if last_use.get(n, -1) <= i]:
+            del frames[name]
+        print(f"[{stage.name}] {status} {key} in {time.perf_counter() - t0:.1f}s{check.timing()}")
+
+    run_key = _digest({"variant": variant, "stages": keys})
+    variant_dir = os.path.join(RUNS_DIR, variant)
+    run_dir = os.path.join(variant_dir, run_key)
+    if not os.path.isdir(run_dir):
+        os.makedirs(variant_dir, exist_ok=True)
+        tmp = _tmp_dir(variant_dir)
+        methods = set()
+        for stage in stages:
+            for name, path in pipeline.stage_io(stage)["OUTPUTS"].items():
+                methods.add(link_file(locations[name], os.path.join(tmp, _relative(path))))
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({
+                "variant": variant,
+                "run": run_key,
+                "params": params,
+                "call_source": call_source,
+                "stages": keys,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }, f, indent=2, default=str)
+        _publish(tmp, run_dir)
+        print(f"[{variant}] run {run_key} ({', '.join(sorted(methods))})")
+    set_current(variant_dir, run_key)
+    print(f"[{variant}] current -> {run_dir}")
+    return run_dir
+
+
+def list_runs() -> None:
+    if not os.path.isdir(RUNS_DIR):
+        print(f"No runs under {RUNS_DIR}.")
+        return
+    for variant in sorted(os.listdir(RUNS_DIR)):
+        variant_dir = os.path.join(RUNS_DIR, variant)
+        if variant_dir == STORE_DIR or not os.path.isdir(variant_dir):
+            continue
+        current = current_run(variant)
+        print(f"{variant} (current: {current})")
+        for run in sorted(os.listdir(variant_dir)):
+            if run == CURRENT:
+                continue
+            manifest = os.path.join(variant_dir, run, MANIFEST)
+            if not os.path.isfile(manifest):
+                continue
+            with open(manifest, encoding="utf-8") as f:
+                info = json.load(f)
+            mark = "*" if run == current else " "
+            print(f"  {mark} {run}  {info['created']}  params={json.dumps(info['params'])}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="List pipeline variants and their run directories.")
+    ap.parse_args()
+    list_runs()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,17 @@
 import pandas as pd
 import numpy as np
 
-acs = pd.read_csv("data/raw/ACS.csv")
-irs = pd.read_csv("data/raw/IRS.csv")
-hmda = pd.read_csv("data/raw/HMDA.csv")
-
-hmda["fips5"] = hmda["fips5"].str[2:]
-hmda.loc[hmda["orig_total"] <= 20, "refi_share"] = pd.NA
-hmda.rename(columns={"fips5": "fips"}, inplace=True)
-na_pct = hmda["refi_share"].isna().mean() * 100
-print(f"refi_share NA counties: {na_pct:.2f}% ({hmda['refi_share'].isna().sum()} of {len(hmda)})")
-med_refi = pd.to_numeric(hmda["refi_share"], errors="coerce").median()
-hmda["refi_share"] = hmda["refi_share"].fillna(med_refi)
-
-df = acs.merge(irs, on="fips", how="inner")
-df['fips'] = df['fips'].astype(str).str.zfill(5)
-df = df.merge(hmda, on="fips", how="inner")
-df = df[df['state_fips_x'] != '72'] 
-df.drop(columns=['state_abbr', 'state_fips_y', 'county_fips_y', 'county_name'], inplace=True)
-
-df['median_hh_income'] = np.log(df['median_hh_income'])
-df['median_hh_income_z'] = (df['median_hh_income'] - df['median_hh_income'].mean()) / df['median_hh_income'].std()
-df['share_ba_plus_z'] = (df['share_ba_plus'] - df['share_ba_plus'].mean()) / df['share_ba_plus'].std()
-df['share_age_65plus_z'] = (df['share_age_65plus'] - df['share_age_65plus'].mean()) / df['share_age_65plus'].std()
-df['share_internet_sub_z'] = (df['share_internet_sub'] - df['share_internet_sub'].mean()) / df['share_internet_sub'].std()
-df['share_dividend_z'] = (df['share_dividend'] - df['share_dividend'].mean()) / df['share_dividend'].std()
-df['share_interest_z'] = (df['share_interest'] - df['share_interest'].mean()) / df['share_interest'].std()
-df['refi_share_z'] = (df['refi_share'] - df['refi_share'].mean()) / df['refi_share'].std()
+INPUTS = {
+    "acs": "data/raw/ACS.csv",
+    "irs": "data/raw/IRS.csv",
+    "hmda": "data/raw/HMDA.csv",
+}
+OUTPUTS = {
+    "sophistication_index": "data/processed/sophistication_index.csv",
+    "sophistication_index_pca_scores": "data/processed/sophistication_index_pca_scores.csv",
+    "sophistication_index_pca_loadings": "data/processed/sophistication_index_pca_loadings.csv",
+    "sophistication_index_pca_explained_variance": "data/processed/sophistication_index_pca_explained_variance.csv",
+}
 
 FEATURE_COLUMNS = [
     "median_hh_income_z",
@@ -37,33 +22,89 @@ FEATURE_COLUMNS = [
     "share_interest_z",
     "refi_share_z",
 ]
+RAW_FEATURES = [c[:-2] for c in FEATURE_COLUMNS]
 
-# PCA on z-scored features
-work = df.dropna(subset=FEATURE_COLUMNS).copy()
-X = work[FEATURE_COLUMNS].to_numpy(dtype=float)
-X_centered = X - X.mean(axis=0, keepdims=True)
-U, S, Vt = np.linalg.svd(X_centered, full_matrices=False)
-n = X_centered.shape[0]
-eigvals = (S ** 2) / (n - 1)
-explained_ratio = eigvals / eigvals.sum()
-components = Vt.T
-scores = X_centered @ components
-loadings = components * np.sqrt(eigvals.reshape(1, -1))
-pc_cols = [f"PC{i+1}" for i in range(scores.shape[1])]
-
-scores_df = pd.DataFrame(scores, columns=pc_cols, index=work.index)
-scores_df.insert(0, "fips", work["fips"].astype(str).values)
-scores_df.to_csv("data/processed/sophistication_index_pca_scores.csv", index=False)
-
-loadings_df = pd.DataFrame(loadings, index=FEATURE_COLUMNS, columns=pc_cols).reset_index()
-loadings_df = loadings_df.rename(columns={"index": "variable"})
-loadings_df.to_csv("data/processed/sophistication_index_pca_loadings.csv", index=False)
-
-explained_df = pd.DataFrame({"component": pc_cols, "explained_variance_ratio": explained_ratio})
-explained_df.to_csv("data/processed/sophistication_index_pca_explained_variance.csv", index=False)
-
-# Keep PC1 and PC2 in the main df
-df = df.merge(scores_df[["fips","PC1","PC2"]], on="fips", how="left")
-df['sophistication_index'] = -df['PC1']
-
-df.to_csv("data/processed/sophistication_index.csv", index=False)
+
+def load_inputs(names=None) -> dict:
+    names = list(INPUTS) if names is None else names
+    return {name: pd.read_csv(INPUTS[name]) for name in names}
+
+
+def merge_features(acs: pd.DataFrame, irs: pd.DataFrame, hmda: pd.DataFrame) -> pd.DataFrame:
+    """County rows with the raw features (log income), before standardization."""
+    hmda = hmda.copy()
+    hmda["fips5"] = hmda["fips5"].str[2:]
+    hmda.loc[hmda["orig_total"] <= 20, "refi_share"] = pd.NA
+    hmda.rename(columns={"fips5": "fips"}, inplace=True)
+    na_pct = hmda["refi_share"].isna().mean() * 100
+    print(f"refi_share NA counties: {na_pct:.2f}% ({hmda['refi_share'].isna().sum()} of {len(hmda)})")
+    med_refi = pd.to_numeric(hmda["refi_share"], errors="coerce").median()
+    hmda["refi_share"] = hmda["refi_share"].fillna(med_refi)
+
+    df = acs.merge(irs, on="fips", how="inner")
+    df['fips'] = df['fips'].astype(str).str.zfill(5)
+    df = df.merge(hmda, on="fips", how="inner")
+    df = df[df['state_fips_x'] != '72'] 
+    df.drop(columns=['state_abbr', 'state_fips_y', 'county_fips_y', 'county_name'], inplace=True)
+
+    df['median_hh_income'] = np.log(df['median_hh_income'])
+    return df
+
+
+def standardize(df: pd.DataFrame, by=None) -> pd.DataFrame:
+    """Add the *_z feature columns; z-scores are taken within each group of `by` if given."""
+    for raw, z in zip(RAW_FEATURES, FEATURE_COLUMNS):
+        if by is None:
+            mean, std = df[raw].mean(), df[raw].std()
+        else:
+            grouped = df.groupby(by)[raw]
+            mean, std = grouped.transform("mean"), grouped.transform("std")
+        df[z] = (df[raw] - mean) / std
+    return df
+
+
+def build(acs: pd.DataFrame, irs: pd.DataFrame, hmda: pd.DataFrame) -> dict:
+    """County sophistication index and PCA outputs, keyed like OUTPUTS."""
+    df = standardize(merge_features(acs, irs, hmda))
+
+    # PCA on z-scored features
+    work = df.dropna(subset=FEATURE_COLUMNS).copy()
+    X = work[FEATURE_COLUMNS].to_numpy(dtype=float)
+    X_centered = X - X.mean(axis=0, keepdims=True)
+    U, S, Vt = np.linalg.svd(X_centered, full_matrices=False)
+    n = X_centered.shape[0]
+    eigvals = (S ** 2) / (n - 1)
+    explained_ratio = eigvals / eigvals.sum()
+    components = Vt.T
+    scores = X_centered @ components
+    loadings = components * np.sqrt(eigvals.reshape(1, -1))
+    pc_cols = [f"PC{i+1}" for i in range(scores.shape[1])]
+
+    scores_df = pd.DataFrame(scores, columns=pc_cols, index=work.index)
+    scores_df.insert(0, "fips", work["fips"].astype(str).values)
+
+    loadings_df = pd.DataFrame(loadings, index=FEATURE_COLUMNS, columns=pc_cols).reset_index()
+    loadings_df = loadings_df.rename(columns={"index": "variable"})
+
+    explained_df = pd.DataFrame({"component": pc_cols, "explained_variance_ratio": explained_ratio})
+
+    # Keep PC1 and PC2 in the main df
+    df = df.merge(scores_df[["fips","PC1","PC2"]], on="fips", how="left")
+    df['sophistication_index'] = -df['PC1']
+
+    return {
+        "sophistication_index": df,
+        "sophistication_index_pca_scores": scores_df,
+        "sophistication_index_pca_loadings": loadings_df,
+        "sophistication_index_pca_explained_variance": explained_df,
+    }
+
+
+def main() -> None:
+    outputs = build(**load_inputs())
+    for name, frame in outputs.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+
+
+if __name__ == "__main__":
+    main()
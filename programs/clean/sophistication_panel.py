@@ -0,0 +1,222 @@
+"""
+County x vintage sophistication index: the sophistication_index_merge.py PCA run for every
+ACS/IRS/HMDA vintage at once.
+
+Inputs (one directory per vintage, cached after the first fetch):
+- data/raw/vintages/<year>/ACS.csv:  ACS 5-year ending in <year> (acs_county_fetch.fetch_counties)
+- data/raw/vintages/<year>/IRS.csv:  SOI county file for tax year <year> (irs_county_fetch.fetch_county)
+- data/raw/vintages/<year>/HMDA.csv: refi share pooled over <year>-1 and <year>, like the 2020-2021
+  baseline (hmda_county_fetch.fetch_years). The HMDA Data Browser API starts in 2018, so earlier
+  vintages need HMDA.csv placed in the cache by hand.
+Files already in the cache are never refetched; --fetch fills in missing ones.
+
+Per vintage the features are merged and cleaned exactly as in sophistication_index_merge.py and
+z-scored within the vintage. The PCA is one batched np.linalg.svd over a zero-padded
+(n_vintages, max_counties, 7) stack; padding rows are zero after centering and do not change the
+singular values or components. Component signs are aligned to the baseline vintage's own SVD, so
+the baseline rows reproduce sophistication_index_merge.build on the same inputs and
+sophistication_index = -PC1 keeps its meaning in every year (a standalone SVD per year would
+flip signs arbitrarily). Cached files are read with FIPS codes as strings.
+
+--fixed-loadings projects every vintage's z-scores onto the baseline components instead of
+re-estimating them, so year-to-year changes reflect the counties and not the weights.
+
+Outputs:
+- data/processed/sophistication_index_panel.csv: one row per (fips, year) with PC1, PC2 and
+  sophistication_index. instruments.py joins it on (YEAR, fips) when given this file.
+- data/processed/sophistication_index_panel_loadings.csv: (year, variable) x PC loadings.
+- data/processed/sophistication_index_panel_explained_variance.csv: (year, component) ratios.
+
+Usage:
+  python programs/clean/sophistication_panel.py --fetch
+  python programs/clean/sophistication_panel.py --years 2019 2020 2021 2022 2023 --fixed-loadings
+"""
+import argparse
+import os
+import sys
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from sophistication_index_merge import FEATURE_COLUMNS, merge_features, standardize
+
+VINTAGE_DIR = "data/raw/vintages"
+YEARS = list(range(2015, 2024))
+BASELINE_YEAR = 2021
+FETCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fetch")
+
+OUTPUTS = {
+    "sophistication_index_panel": "data/processed/sophistication_index_panel.csv",
+    "sophistication_index_panel_loadings": "data/processed/sophistication_index_panel_loadings.csv",
+    "sophistication_index_panel_explained_variance": "data/processed/sophistication_index_panel_explained_variance.csv",
+}
+SOURCES = ["acs", "irs", "hmda"]
+SOURCE_FILES = {"acs": "ACS.csv", "irs": "IRS.csv", "hmda": "HMDA.csv"}
+# Keep FIPS strings (leading zeros) when reading the cached files back
+SOURCE_DTYPES = {
+    "acs": {"fips": str, "state_fips": str, "county_fips": str},
+    "irs": {"fips": str, "state_fips": str, "county_fips": str},
+    "hmda": {"fips5": str},
+}
+
+
+def vintage_path(year: int, source: str, root: str = VINTAGE_DIR) -> str:
+    return os.path.join(root, str(year), SOURCE_FILES[source])
+
+
+def fetch_source(year: int, source: str) -> pd.DataFrame:
+    """Download one source for one vintage with the fetch scripts' own functions."""
+    if FETCH_DIR not in sys.path:
+        sys.path.insert(0, FETCH_DIR)
+    if source == "acs":
+        from acs_county_fetch import fetch_counties
+        return fetch_counties(year, api_key=os.environ.get("CENSUS_API_KEY", "").strip())
+    if source == "irs":
+        from irs_county_fetch import fetch_county
+        return fetch_county(year)
+    from hmda_county_fetch import fetch_years
+    return fetch_years([year - 1, year])
+
+
+def load_vintage(year: int, fetch: bool = False, root: str = VINTAGE_DIR) -> Dict[str, pd.DataFrame]:
+    """acs/irs/hmda frames for one vintage, from the cache (fetched and cached first if allowed)."""
+    out = {}
+    for source in SOURCES:
+        path = vintage_path(year, source, root)
+        if not os.path.exists(path):
+            if not fetch:
+                raise FileNotFoundError(f"{path} is not cached; rerun with --fetch or add it by hand.")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fetch_source(year, source).to_csv(path, index=False)
+            print(f"Cached {path}")
+        out[source] = pd.read_csv(path, dtype=SOURCE_DTYPES[source])
+    return out
+
+
+def stack_features(vintages: Dict[int, Dict[str, pd.DataFrame]]) -> pd.DataFrame:
+    """Merged county features for every vintage, with a 'year' column and within-year z-scores."""
+    frames = []
+    for year, inputs in sorted(vintages.items()):
+        df = merge_features(**inputs)
+        df.insert(0, "year", year)
+        frames.append(df)
+    return standardize(pd.concat(frames, ignore_index=True), by="year")
+
+
+def batched_pca(X: np.ndarray, year_codes: np.ndarray, n_years: int,
+                components: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """PCA of each year's rows of X in one stacked SVD.
+
+    X is (n_rows, n_features); year_codes gives each row's year position in [0, n_years).
+    If components (n_features, n_features) is given it is used for every year instead of each
+    year's own. Returns per-row scores and per-year components, eigenvalues and row counts.
+    """
+    counts = np.bincount(year_codes, minlength=n_years)
+    if (counts < 2).any():
+        raise ValueError(f"Every vintage needs at least two complete counties; got {counts.tolist()}.")
+    k = X.shape[1]
+    means = np.stack([np.bincount(year_codes, weights=X[:, j], minlength=n_years) for j in range(k)], axis=1)
+    Xc = X - (means / counts[:, None])[year_codes]
+
+    # Zero-padded (year, position-within-year, feature) stack
+    order = np.argsort(year_codes, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    pos = np.empty_like(year_codes)
+    pos[order] = np.arange(len(order)) - starts[year_codes[order]]
+    stack = np.zeros((n_years, counts.max(), k))
+    stack[year_codes, pos] = Xc
+
+    if components is None:
+        _, S, Vt = np.linalg.svd(stack, full_matrices=False)
+        V = np.swapaxes(Vt, 1, 2)
+        eigvals = S ** 2 / (counts[:, None] - 1)
+    else:
+        V = np.broadcast_to(components, (n_years, k, k)).copy()
+        # Variance of each projected score within its year
+        eigvals = np.einsum("ynk,ynk->yk", stack @ V, stack @ V) / (counts[:, None] - 1)
+
+    scores = (stack @ V)[year_codes, pos]
+    return {"scores": scores, "components": V, "eigvals": eigvals, "counts": counts}
+
+
+def alignment_signs(V: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """(n_years, n_components) +/-1 flips that point each year's components like the reference."""
+    signs = np.sign(np.einsum("yfk,fk->yk", V, reference))
+    signs[signs == 0] = 1
+    return signs
+
+
+def build_panel(vintages: Dict[int, Dict[str, pd.DataFrame]], baseline_year: int = BASELINE_YEAR,
+                fixed_loadings: bool = False) -> Dict[str, pd.DataFrame]:
+    """County x vintage index and per-vintage PCA outputs, keyed like OUTPUTS."""
+    if baseline_year not in vintages:
+        raise ValueError(f"Baseline vintage {baseline_year} is not among {sorted(vintages)}.")
+    df = stack_features(vintages)
+    years = sorted(vintages)
+    work = df.dropna(subset=FEATURE_COLUMNS)
+    year_codes = np.searchsorted(years, work["year"].to_numpy())
+    X = work[FEATURE_COLUMNS].to_numpy(dtype=float)
+
+    # Reference signs: the baseline vintage's own (unpadded) SVD, as in sophistication_index_merge
+    base = X[year_codes == years.index(baseline_year)]
+    _, _, base_vt = np.linalg.svd(base - base.mean(axis=0, keepdims=True), full_matrices=False)
+    reference = base_vt.T
+
+    pca = batched_pca(X, year_codes, len(years), components=reference if fixed_loadings else None)
+    V, scores, eigvals = pca["components"], pca["scores"], pca["eigvals"]
+    if not fixed_loadings:
+        signs = alignment_signs(V, reference)
+        V = V * signs[:, None, :]
+        scores = scores * signs[year_codes]
+
+    pc_cols = [f"PC{i+1}" for i in range(len(FEATURE_COLUMNS))]
+    scores = pd.DataFrame(scores, columns=pc_cols, index=work.index)
+    out = df[["fips", "year"]].join(scores[["PC1", "PC2"]])
+    out["sophistication_index"] = -out["PC1"]
+
+    loadings = V * np.sqrt(eigvals)[:, None, :]
+    loadings_df = pd.DataFrame(loadings.reshape(-1, len(pc_cols)), columns=pc_cols)
+    loadings_df.insert(0, "variable", np.tile(FEATURE_COLUMNS, len(years)))
+    loadings_df.insert(0, "year", np.repeat(years, len(FEATURE_COLUMNS)))
+
+    ratio = eigvals / eigvals.sum(axis=1, keepdims=True)
+    explained_df = pd.DataFrame({
+        "year": np.repeat(years, len(pc_cols)),
+        "component": np.tile(pc_cols, len(years)),
+        "explained_variance_ratio": ratio.ravel(),
+        "n_counties": np.repeat(pca["counts"], len(pc_cols)),
+    })
+
+    return {
+        "sophistication_index_panel": out.sort_values(["year", "fips"]).reset_index(drop=True),
+        "sophistication_index_panel_loadings": loadings_df,
+        "sophistication_index_panel_explained_variance": explained_df,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build the county x vintage sophistication index.")
+    ap.add_argument("--years", type=int, nargs="+", default=YEARS, help="Vintages (default: 2015-2023).")
+    ap.add_argument("--baseline", type=int, default=BASELINE_YEAR,
+                    help="Vintage whose components fix the signs (and the loadings with --fixed-loadings).")
+    ap.add_argument("--fixed-loadings", action="store_true",
+                    help="Project every vintage onto the baseline components instead of re-estimating.")
+    ap.add_argument("--fetch", action="store_true", help="Fetch and cache vintages missing from the cache.")
+    ap.add_argument("--cache", default=VINTAGE_DIR, help="Per-vintage input cache directory.")
+    args = ap.parse_args()
+
+    years = sorted(set(args.years) | {args.baseline})
+    vintages = {y: load_vintage(y, fetch=args.fetch, root=args.cache) for y in years}
+    outputs = build_panel(vintages, args.baseline, args.fixed_loadings)
+    for name, frame in outputs.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+        print(f"Saved {OUTPUTS[name]} ({len(frame):,} rows)")
+
+    ev = outputs["sophistication_index_panel_explained_variance"]
+    pc1 = ev[ev["component"] == "PC1"].set_index("year")["explained_variance_ratio"]
+    print("PC1 explained variance by vintage: " + ", ".join(f"{y}: {v:.1%}" for y, v in pc1.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Stability of the PCA sophistication index under county resampling and leave-one-feature-out.
+
+Bootstrap: each draw resamples counties with replacement (multiplicity weights), re-standardizes
+the features on the draw and takes PC1 of the resulting 7 x 7 correlation matrix. With 7 features
+the z-scored SVD of sophistication_index_merge.py is exactly the eigendecomposition of that matrix,
+so a chunk of draws is two matrix products (weighted first and second moments) and one batched
+np.linalg.eigh over a (draws, 7, 7) stack. Each draw's components are sign-aligned to the
+full-sample ones before summarizing.
+
+Every draw's index (-PC1 score, with the draw's own standardization) is evaluated for all counties
+and pushed through the instruments.py bank weighting in a single sparse product:
+bank-year x county branch-deposit weights (DEPSUMBR / DEPDOM, renormalized over counties with an
+index) times the county x draw index matrix, then z-scored across bank-years per draw.
+
+Leave-one-feature-out: the same PCA with each feature dropped in turn (one batched eigh over the
+seven 6 x 6 correlation matrices), with the correlation of the resulting county index and bank
+exposures against the full version.
+
+Counties with any missing feature are left out of the draws, as in the PCA itself. When no county
+has a missing feature the unit-weight estimate equals sophistication_index_merge.py and the bank
+exposures equal instruments.py's sophistication_index_z.
+
+Inputs: data/raw/ACS.csv, IRS.csv, HMDA.csv (as sophistication_index_merge.py), data/raw/SOD.csv.
+Outputs (data/processed/):
+- sophistication_stability_loadings.csv: loading and explained-variance estimates with bootstrap
+  mean, standard error and percentile bands, per component.
+- sophistication_stability_counties.csv: county index with standard error and band.
+- sophistication_stability_banks.csv: bank-year sophistication_index_z with standard error and band.
+- sophistication_stability_lofo.csv: leave-one-feature-out PC1 loadings and correlations.
+
+Usage:
+  python programs/clean/sophistication_stability.py --draws 2000 --workers 4
+"""
+import argparse
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import sophistication_index_merge as sim
+
+SOD_CSV = "data/raw/SOD.csv"
+OUTPUTS = {
+    "loadings": "data/processed/sophistication_stability_loadings.csv",
+    "counties": "data/processed/sophistication_stability_counties.csv",
+    "banks": "data/processed/sophistication_stability_banks.csv",
+    "lofo": "data/processed/sophistication_stability_lofo.csv",
+}
+N_DRAWS = 2000
+CHUNK = 250
+ALPHA = 0.05
+
+
+def county_features(acs: pd.DataFrame, irs: pd.DataFrame, hmda: pd.DataFrame) -> Tuple[pd.Series, np.ndarray]:
+    """fips and feature matrix (n_counties, 7) for counties with every feature.
+
+    Features are centered on their full-sample means: correlations and z-scores are unchanged, and
+    the moment sums of the draws avoid cancellation (log income is around 11).
+    """
+    df = sim.merge_features(acs, irs, hmda)
+    df = df.dropna(subset=sim.RAW_FEATURES)
+    X = df[sim.RAW_FEATURES].to_numpy(dtype=float)
+    return df["fips"].astype(str).str.zfill(5).reset_index(drop=True), X - X.mean(axis=0)
+
+
+def bank_weights(sod: pd.DataFrame, fips: pd.Series) -> Tuple[pd.DataFrame, sparse.csr_matrix]:
+    """Bank-year keys and the (bank-years x counties) branch-deposit weight matrix of instruments.py."""
+    sod = sod[["YEAR", "RSSDID", "DEPDOM", "DEPSUMBR", "STCNTYBR"]].copy()
+    sod["fips"] = sod["STCNTYBR"].astype(str).str.zfill(5)
+    sod["weight"] = sod["DEPSUMBR"] / sod["DEPDOM"]
+    banks = sod[["YEAR", "RSSDID"]].drop_duplicates().sort_values(["YEAR", "RSSDID"]).reset_index(drop=True)
+
+    col = pd.Index(fips).get_indexer(sod["fips"])
+    keep = (col >= 0) & np.isfinite(sod["weight"].to_numpy())
+    row = pd.MultiIndex.from_frame(banks).get_indexer(pd.MultiIndex.from_frame(sod[["YEAR", "RSSDID"]]))
+    W = sparse.csr_matrix(
+        (sod["weight"].to_numpy()[keep], (row[keep], col[keep])), shape=(len(banks), len(fips))
+    )
+    return banks, W
+
+
+def correlation_eigh(S1: np.ndarray, S2: np.ndarray, n: np.ndarray):
+    """Batched PCA from weighted moments.
+
+    S1 (B, k) and S2 (B, k, k) are weighted sums of x and x x'; n (B,) the total weights.
+    Returns means, standard deviations (ddof=1), eigenvalues (B, k) descending and eigenvectors
+    (B, k, k) with components in columns.
+    """
+    mean = S1 / n[:, None]
+    cov = (S2 - np.einsum("bi,bj->bij", S1, mean)) / (n - 1)[:, None, None]
+    sd = np.sqrt(np.einsum("bii->bi", cov))
+    corr = cov / (sd[:, :, None] * sd[:, None, :])
+    vals, vecs = np.linalg.eigh(corr)
+    return mean, sd, vals[:, ::-1], vecs[:, :, ::-1]
+
+
+def align(vecs: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Flip each draw's components to point the same way as the reference (k, k) components."""
+    signs = np.sign(np.einsum("bfk,fk->bk", vecs, reference))
+    signs[signs == 0] = 1
+    return vecs * signs[:, None, :]
+
+
+def county_index(X: np.ndarray, mean: np.ndarray, sd: np.ndarray, pc1: np.ndarray) -> np.ndarray:
+    """(n_counties, B) index = -PC1 score, each draw using its own standardization."""
+    u = pc1 / sd
+    return -(X @ u.T - np.einsum("bk,bk->b", mean, u)[None, :])
+
+
+def bank_exposure(W: sparse.csr_matrix, index: np.ndarray) -> np.ndarray:
+    """(n_bank_years, B) z-scored deposit-weighted index, renormalized over counties with an index."""
+    has = ~np.isnan(index[:, :1])
+    num = W @ np.where(np.isnan(index), 0.0, index)
+    den = W @ has.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exp = np.where(den > 0, num / den, np.nan)
+    return (exp - np.nanmean(exp, axis=0)) / np.nanstd(exp, axis=0, ddof=1)
+
+
+def full_sample(X: np.ndarray, W: sparse.csr_matrix) -> Dict[str, np.ndarray]:
+    """Unit-weight PCA, county index and bank exposures (the point estimates)."""
+    n = np.array([len(X)], dtype=float)
+    mean, sd, vals, vecs = correlation_eigh(X.sum(0)[None], (X.T @ X)[None], n)
+    # Signs follow the SVD in sophistication_index_merge.py, so the index keeps its orientation
+    _, _, Vt = np.linalg.svd((X - mean) / sd, full_matrices=False)
+    vecs = align(vecs, Vt.T)
+    index = county_index(X, mean, sd, vecs[:, :, 0])
+    return {"mean": mean[0], "sd": sd[0], "eigvals": vals[0], "components": vecs[0],
+            "index": index[:, 0], "bank": bank_exposure(W, index)[:, 0]}
+
+
+def bootstrap_chunk(X: np.ndarray, W: sparse.csr_matrix, reference: np.ndarray, n_draws: int,
+                    seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    """One chunk of county-bootstrap draws. Runs in worker processes."""
+    rng = np.random.default_rng(seed)
+    n, k = X.shape
+    counts = rng.multinomial(n, np.full(n, 1.0 / n), size=n_draws).astype(float)
+    S1 = counts @ X
+    S2 = (counts @ (X[:, :, None] * X[:, None, :]).reshape(n, k * k)).reshape(n_draws, k, k)
+    mean, sd, vals, vecs = correlation_eigh(S1, S2, np.full(n_draws, float(n)))
+    vecs = align(vecs, reference)
+    index = county_index(X, mean, sd, vecs[:, :, 0])
+    return {
+        "eigvals": vals,
+        "loadings": vecs * np.sqrt(vals)[:, None, :],
+        "index": index.astype(np.float32),
+        "bank": bank_exposure(W, index).astype(np.float32),
+    }
+
+
+def bootstrap(X: np.ndarray, W: sparse.csr_matrix, reference: np.ndarray, n_draws: int = N_DRAWS,
+              seed: int = 0, chunk: int = CHUNK, workers: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """All draws, concatenated along the draw axis. Results do not depend on `workers`."""
+    sizes = [min(chunk, n_draws - i) for i in range(0, n_draws, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(X, W, reference, size, s) for size, s in zip(sizes, seeds)]
+    if workers == 1 or len(args) == 1:
+        parts = [bootstrap_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(bootstrap_chunk, *zip(*args)))
+    return {
+        "eigvals": np.concatenate([p["eigvals"] for p in parts]),
+        "loadings": np.concatenate([p["loadings"] for p in parts]),
+        "index": np.concatenate([p["index"] for p in parts], axis=1),
+        "bank": np.concatenate([p["bank"] for p in parts], axis=1),
+    }
+
+
+def leave_one_feature_out(X: np.ndarray, W: sparse.csr_matrix, est: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """PC1 with each feature dropped, compared with the full index and bank exposures."""
+    k = X.shape[1]
+    keep = np.array([[j for j in range(k) if j != f] for f in range(k)])  # (k, k-1)
+    Xs = X[:, keep]  # (n, k, k-1): variant f uses columns keep[f]
+    n = np.full(k, float(len(X)))
+    S1 = Xs.sum(0)
+    S2 = np.einsum("nfi,nfj->fij", Xs, Xs)
+    mean, sd, vals, vecs = correlation_eigh(S1, S2, n)
+    ref = est["components"][keep, 0]  # full PC1 restricted to the kept features
+    signs = np.sign(np.einsum("fi,fi->f", vecs[:, :, 0], ref))
+    signs[signs == 0] = 1
+    pc1 = vecs[:, :, 0] * signs[:, None]
+
+    u = pc1 / sd
+    index = -(np.einsum("nfi,fi->nf", Xs, u) - np.einsum("fi,fi->f", mean, u)[None, :])
+    bank = bank_exposure(W, index)
+    ok = ~np.isnan(est["bank"])
+
+    rows = []
+    for f, feature in enumerate(sim.FEATURE_COLUMNS):
+        row = {
+            "dropped": feature,
+            "pc1_explained_variance_ratio": vals[f, 0] / vals[f].sum(),
+            "corr_county_index": np.corrcoef(index[:, f], est["index"])[0, 1],
+            "corr_bank_exposure": np.corrcoef(bank[ok, f], est["bank"][ok])[0, 1],
+        }
+        loadings = dict(zip(np.array(sim.FEATURE_COLUMNS)[keep[f]], pc1[f] * np.sqrt(vals[f, 0])))
+        row.update({f"PC1_{c}": loadings.get(c, np.nan) for c in sim.FEATURE_COLUMNS})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _bands(draws: np.ndarray, alpha: float, axis: int) -> Dict[str, np.ndarray]:
+    with warnings.catch_warnings():
+        # Bank-years without usable deposits are NaN in every draw
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo, hi = np.nanpercentile(draws, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=axis)
+        return {"boot_mean": np.nanmean(draws, axis=axis), "se": np.nanstd(draws, axis=axis, ddof=1),
+                "lower": lo, "upper": hi}
+
+
+def summarize(fips: pd.Series, banks: pd.DataFrame, est: Dict[str, np.ndarray],
+              draws: Dict[str, np.ndarray], alpha: float = ALPHA) -> Dict[str, pd.DataFrame]:
+    """Estimate and bootstrap bands for loadings, explained variance, counties and bank-years."""
+    k = len(sim.FEATURE_COLUMNS)
+    pcs = [f"PC{i+1}" for i in range(k)]
+    est_loadings = est["components"] * np.sqrt(est["eigvals"])[None, :]
+
+    loadings = pd.DataFrame({
+        "component": np.repeat(pcs, k),
+        "variable": np.tile(sim.FEATURE_COLUMNS, k),
+        "estimate": est_loadings.T.ravel(),
+        **{key: v.T.ravel() for key, v in _bands(draws["loadings"], alpha, axis=0).items()},
+    })
+    ratio = draws["eigvals"] / draws["eigvals"].sum(axis=1, keepdims=True)
+    explained = pd.DataFrame({
+        "component": pcs,
+        "variable": "explained_variance_ratio",
+        "estimate": est["eigvals"] / est["eigvals"].sum(),
+        **_bands(ratio, alpha, axis=0),
+    })
+
+    counties = pd.DataFrame({"fips": fips, "sophistication_index": est["index"],
+                             **_bands(draws["index"], alpha, axis=1)})
+    bank = banks.copy()
+    bank["sophistication_index_z"] = est["bank"]
+    for key, v in _bands(draws["bank"], alpha, axis=1).items():
+        bank[key] = v
+    return {"loadings": pd.concat([explained, loadings], ignore_index=True),
+            "counties": counties, "banks": bank}
+
+
+def run(n_draws: int = N_DRAWS, seed: int = 0, chunk: int = CHUNK, workers: Optional[int] = None,
+        alpha: float = ALPHA) -> Dict[str, pd.DataFrame]:
+    fips, X = county_features(**sim.load_inputs())
+    banks, W = bank_weights(pd.read_csv(SOD_CSV), fips)
+    est = full_sample(X, W)
+    t0 = time.perf_counter()
+    draws = bootstrap(X, W, est["components"], n_draws, seed, chunk, workers)
+    print(f"{n_draws:,} bootstrap draws over {len(X):,} counties and {len(banks):,} bank-years "
+          f"in {time.perf_counter() - t0:.1f}s")
+    out = summarize(fips, banks, est, draws, alpha)
+    out["lofo"] = leave_one_feature_out(X, W, est)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Bootstrap and leave-one-feature-out stability of the sophistication index.")
+    ap.add_argument("--draws", type=int, default=N_DRAWS, help="Number of county-bootstrap draws.")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="Draws per batched eigendecomposition.")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    ap.add_argument("--alpha", type=float, default=ALPHA, help="Two-sided band level (default: 0.05).")
+    args = ap.parse_args()
+
+    out = run(args.draws, args.seed, args.chunk, args.workers, args.alpha)
+    for name, frame in out.items():
+        frame.to_csv(OUTPUTS[name], index=False)
+        print(f"Saved {OUTPUTS[name]} ({len(frame):,} rows)")
+
+    pc1 = out["loadings"].query("component == 'PC1'")
+    print(pc1[["variable", "estimate", "se", "lower", "upper"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Embedded SQL over the pipeline's files: DuckDB in process, no server, no load step.
+
+connect() opens an in-memory DuckDB database with one view per file:
+- every stage output under its pipeline name (deposit_interest_rate, bank_credit, controls,
+  ffr_quarterly, sophistication_index, instruments, working_panel, ...), read from the fixed paths
+  or, with run_dir / --variant, from a run directory of runs.py;
+- every raw stage input under its input name (sod, riad, rcon_deposit, acs, ...);
+- any other CSV in data/raw and data/processed under its lower-case file stem, and the
+  quarter-partitioned call_bulk dataset (call_bulk.py) as 'call_bulk' with its 'quarter' column.
+Views are lazy: a query scans only the columns it uses, filters are pushed into the scan (row
+groups of the parquet dataset are skipped by their statistics) and the scan runs on all cores.
+query() returns a DataFrame.
+
+build_instruments_sql() is instruments.build written as SQL over the SOD and sophistication index
+views (branch weights, county HHI, division shares, branch density, z-scores); --benchmark-instruments
+times it against the pandas build on the same files and reports the largest difference. The pandas
+build stays the pipeline's implementation.
+
+DuckDB is optional (pip install duckdb); nothing else in the pipeline imports this module.
+
+Usage:
+  python programs/clean/sql_backend.py --views
+  python programs/clean/sql_backend.py "SELECT COUNT(*) FROM instruments WHERE SA > 0.5"
+  python programs/clean/sql_backend.py --variant z5 "SELECT qdate, AVG(d_deposit_rate) FROM working_panel GROUP BY 1"
+  python programs/clean/sql_backend.py --benchmark-instruments --threads 8
+"""
+import argparse
+import glob
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+from call_bulk import DATASET_DIR
+from instruments import DIVISION_CODE_MAP, STATE_FIPS_TO_USPS, STATE_TO_CENSUS_DIVISION
+
+SCAN_DIRS = ["data/raw", "data/processed"]
+# Tables the instruments query reads; build_instruments_sql() takes other view names
+SOD_VIEW = "sod"
+INDEX_VIEW = "sophistication_index"
+INSTRUMENT_KEYS = ["YEAR", "RSSDID"]
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("The SQL backend needs duckdb (pip install duckdb); the pandas pipeline does not.")
+    return duckdb
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(path: str) -> str:
+    return "'" + path.replace("'", "''") + "'"
+
+
+def _scan(path: str) -> Optional[str]:
+    """Table function reading a file or partitioned dataset, or None for unsupported files."""
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*", "part.parquet"))
+        if files:
+            return f"read_parquet({_literal(os.path.join(path, '*', 'part.parquet'))}, hive_partitioning = true)"
+        files = glob.glob(os.path.join(path, "*", "part.csv"))
+        if files:
+            return f"read_csv_auto({_literal(os.path.join(path, '*', 'part.csv'))}, hive_partitioning = true)"
+        return None
+    if path.endswith(".parquet"):
+        return f"read_parquet({_literal(path)})"
+    if path.endswith(".csv"):
+        return f"read_csv_auto({_literal(path)})"
+    return None
+
+
+def view_paths(run_dir: Optional[str] = None) -> Dict[str, str]:
+    """View name -> file for the stage outputs and inputs and the other files under SCAN_DIRS that exist."""
+    outputs: Dict[str, str] = {}
+    inputs: Dict[str, str] = {}
+    for stage in pipeline.STAGES:
+        io = pipeline.stage_io(stage)
+        for name, path in io["OUTPUTS"].items():
+            if run_dir is not None:
+                path = os.path.join(run_dir, path[len("data/"):] if path.startswith("data/") else path)
+            outputs[name] = path
+        for name, path in io["INPUTS"].items():
+            inputs.setdefault(name, path)
+    paths = dict(outputs)
+    for name, path in inputs.items():
+        if name not in paths and path not in paths.values():
+            paths[name] = path
+    paths.setdefault("call_bulk", DATASET_DIR)
+    for directory in SCAN_DIRS:
+        for path in sorted(glob.glob(os.path.join(directory, "*.csv"))):
+            stem = os.path.splitext(os.path.basename(path))[0].lower()
+            if stem not in paths and path not in paths.values():
+                paths[stem] = path
+    return {name: path for name, path in paths.items() if os.path.exists(path) and _scan(path) is not None}
+
+
+def connect(threads: Optional[int] = None, run_dir: Optional[str] = None, views: Optional[Dict[str, str]] = None):
+    """In-memory DuckDB connection with a view per pipeline file (view_paths unless views is given)."""
+    duckdb = _duckdb()
+    con = duckdb.connect(":memory:")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    for name, path in (view_paths(run_dir) if views is None else views).items():
+        con.execute(f"CREATE VIEW {_quote(name)} AS SELECT * FROM {_scan(path)}")
+    return con
+
+
+def query(sql: str, params: Optional[Sequence[Any]] = None, con=None) -> pd.DataFrame:
+    """Result of a SQL query over the pipeline views as a DataFrame."""
+    con = connect() if con is None else con
+    return con.execute(sql, params or []).df()
+
+
+def _register_maps(con) -> None:
+    """State and census-division lookups of instruments.py as tables."""
+    state = pd.DataFrame({"state_fips": list(STATE_FIPS_TO_USPS), "state_usps": list(STATE_FIPS_TO_USPS.values())})
+    state["census_division"] = state["state_usps"].map(STATE_TO_CENSUS_DIVISION)
+    state["division_code"] = state["census_division"].map(DIVISION_CODE_MAP)
+    con.register("_state_map", state)
+
+
+def instruments_sql(sod: str = SOD_VIEW, index: str = INDEX_VIEW, index_has_year: bool = False) -> str:
+    """instruments.build as one query. The bank row (NAMEFULL, ASSET, fips, ...) is its first SOD row."""
+    index_keys = "YEAR, fips" if index_has_year else "fips"
+    index_year = '"year" AS YEAR, ' if index_has_year else ""
+    divisions = list(DIVISION_CODE_MAP.values())
+    division_cols = ",\n        ".join(
+        f"CASE WHEN d.any_division THEN COALESCE(d.{c}, 0) END AS {c}" for c in divisions)
+    division_sums = ",\n        ".join(
+        f"CASE WHEN b.DEPDOM > 0 THEN SUM(s.DEPSUMBR) FILTER (WHERE s.division_code = '{c}') / b.DEPDOM "
+        f"ELSE 0 END AS {c}" for c in divisions)
+    return f"""
+WITH si AS (
+    SELECT {index_year}
+        CASE WHEN length(CAST(fips AS VARCHAR)) < 5 THEN lpad(CAST(fips AS VARCHAR), 5, '0')
+             ELSE CAST(fips AS VARCHAR) END AS fips,
+        sophistication_index
+    FROM {index}
+),
+branches AS (
+    SELECT
+        r.row_id, r.YEAR, r.RSSDID, r.NAMEFULL, r.ASSET, r.BKCLASS, r.DEPDOM, r.DEPSUMBR, r.fips,
+        left(r.fips, 2) AS state_fips, m.state_usps, m.census_division, m.division_code,
+        CASE WHEN r.DEPDOM <> 0 THEN r.DEPSUMBR / r.DEPDOM END AS weight,
+        si.sophistication_index
+    FROM (
+        SELECT rowid AS row_id, YEAR, RSSDID, NAMEFULL, ASSET, BKCLASS, DEPDOM, DEPSUMBR,
+            CASE WHEN length(CAST(STCNTYBR AS VARCHAR)) < 5 THEN lpad(CAST(STCNTYBR AS VARCHAR), 5, '0')
+                 ELSE CAST(STCNTYBR AS VARCHAR) END AS fips
+        FROM {sod}
+    ) r
+    LEFT JOIN _state_map m ON m.state_fips = left(r.fips, 2)
+    LEFT JOIN si ON {" AND ".join(f"si.{k} = r.{k}" for k in index_keys.split(", "))}
+),
+bank AS (
+    SELECT YEAR, RSSDID,
+        COUNT(*) AS branch_count,
+        arg_min(DEPDOM, row_id) FILTER (WHERE DEPDOM IS NOT NULL) AS DEPDOM,
+        SUM(weight) FILTER (WHERE sophistication_index IS NOT NULL) AS si_weight,
+        SUM(weight * sophistication_index) FILTER (WHERE sophistication_index IS NOT NULL) AS si_weighted
+    FROM branches
+    GROUP BY YEAR, RSSDID
+),
+division AS (
+    SELECT s.YEAR, s.RSSDID, bool_or(s.division_code IS NOT NULL) AS any_division,
+        {division_sums}
+    FROM branches s JOIN bank b USING (YEAR, RSSDID)
+    GROUP BY s.YEAR, s.RSSDID, b.DEPDOM
+),
+county_bank AS (
+    SELECT YEAR, fips, RSSDID, COALESCE(SUM(DEPSUMBR), 0) AS deposits, SUM(weight) AS weight
+    FROM branches
+    GROUP BY YEAR, fips, RSSDID
+),
+county_hhi AS (
+    SELECT YEAR, fips,
+        COALESCE(SUM(CASE WHEN total <> 0 THEN (deposits / total) ^ 2 END), 0) AS hhi
+    FROM (SELECT *, SUM(deposits) OVER (PARTITION BY YEAR, fips) AS total FROM county_bank)
+    GROUP BY YEAR, fips
+),
+bank_hhi AS (
+    SELECT c.YEAR, c.RSSDID,
+        CASE WHEN SUM(c.weight) > 0 THEN SUM(c.weight * h.hhi) / SUM(c.weight) END AS hhi
+    FROM county_bank c JOIN county_hhi h USING (YEAR, fips)
+    GROUP BY c.YEAR, c.RSSDID
+),
+first_row AS (
+    SELECT * FROM branches
+    QUALIFY row_number() OVER (PARTITION BY YEAR, RSSDID ORDER BY row_id) = 1
+),
+measures AS (
+    SELECT f.YEAR, f.RSSDID, f.NAMEFULL, f.ASSET, f.BKCLASS, f.DEPDOM, f.fips, f.state_fips,
+        f.state_usps, f.census_division,
+        CASE WHEN b.si_weight > 0 THEN b.si_weighted / b.si_weight END AS si,
+        h.hhi,
+        CASE WHEN b.DEPDOM > 0 THEN b.branch_count / (b.DEPDOM / 1e9) END AS density,
+        {division_cols}
+    FROM first_row f
+    JOIN bank b USING (YEAR, RSSDID)
+    LEFT JOIN bank_hhi h USING (YEAR, RSSDID)
+    LEFT JOIN division d USING (YEAR, RSSDID)
+)
+SELECT YEAR, RSSDID, NAMEFULL, ASSET, BKCLASS, DEPDOM, fips, state_fips, state_usps, census_division,
+    (si - AVG(si) OVER ()) / stddev_samp(si) OVER () AS sophistication_index_z,
+    (hhi - AVG(hhi) OVER ()) / stddev_samp(hhi) OVER () AS hhi_z,
+    (density - AVG(density) OVER ()) / stddev_samp(density) OVER () AS branch_density_z,
+    {", ".join(divisions)}
+FROM measures
+ORDER BY YEAR, RSSDID
+"""
+
+
+def build_instruments_sql(con, sod: str = SOD_VIEW, index: str = INDEX_VIEW) -> pd.DataFrame:
+    """instruments.build computed by DuckDB from the SOD and sophistication index views.
+
+    SOD is copied into a table first so rowid follows file order, which picks the same bank row
+    as the pandas build.
+    """
+    _register_maps(con)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _sod AS SELECT * FROM {_quote(sod)}")
+    columns = [r[0] for r in con.execute(f"DESCRIBE {_quote(index)}").fetchall()]
+    sql = instruments_sql("_sod", _quote(index), index_has_year="year" in columns)
+    try:
+        return con.execute(sql).df()
+    finally:
+        con.execute("DROP TABLE _sod")
+
+
+def compare_frames(left: pd.DataFrame, right: pd.DataFrame, keys: List[str]) -> Dict[str, float]:
+    """Largest absolute difference per numeric column (NaN placement counts as inf); labels must match."""
+    if len(left) != len(right):
+        raise ValueError(f"row counts differ: {len(left)} vs {len(right)}")
+    left = left.sort_values(keys).reset_index(drop=True)
+    right = right.sort_values(keys).reset_index(drop=True)
+    diffs: Dict[str, float] = {}
+    for col in left.columns:
+        a, b = left[col], right[col]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            a, b = a.to_numpy(dtype=float), b.to_numpy(dtype=float)
+            if (np.isnan(a) != np.isnan(b)).any():
+                diffs[col] = float("inf")
+            else:
+                both = ~np.isnan(a)
+                diffs[col] = float(np.abs(a[both] - b[both]).max()) if both.any() else 0.0
+        else:
+            same = (a.astype(str).to_numpy() == b.astype(str).to_numpy()) | (a.isna().to_numpy() & b.isna().to_numpy())
+            diffs[col] = 0.0 if same.all() else float("inf")
+    return diffs
+
+
+def benchmark_instruments(con, repeat: int = 3) -> Dict[str, Any]:
+    """Best-of-repeat seconds for the pandas and SQL instrument builds and their largest difference.
+
+    Both time reading the inputs: pandas parses the CSVs, DuckDB scans them.
+    """
+    import instruments
+
+    timings: Dict[str, List[float]] = {"pandas": [], "sql": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        expected = instruments.build(**instruments.load_inputs())
+        timings["pandas"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        got = build_instruments_sql(con)
+        timings["sql"].append(time.perf_counter() - start)
+    diffs = compare_frames(expected, got[list(expected.columns)], INSTRUMENT_KEYS)
+    return {"pandas_s": min(timings["pandas"]), "sql_s": min(timings["sql"]), "rows": len(got),
+            "max_diff": max(diffs.values()), "diffs": diffs}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="SQL over the pipeline's raw and processed files (DuckDB).")
+    ap.add_argument("sql", nargs="?", help="Query to run; the result is printed.")
+    ap.add_argument("--views", action="store_true", help="List the views and the files behind them.")
+    ap.add_argument("--threads", type=int, default=None, help="DuckDB worker threads (default: all cores).")
+    ap.add_argument("--variant", default=None, help="Read stage outputs from data/runs/VARIANT/current (runs.py).")
+    ap.add_argument("--out", default=None, help="Write the query result to this CSV instead of printing it.")
+    ap.add_argument("--benchmark-instruments", action="store_true",
+                    help="Time instruments.build against its SQL version on the same files.")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per engine for --benchmark-instruments.")
+    args = ap.parse_args()
+
+    run_dir = None
+    if args.variant:
+        import runs
+
+        key = runs.current_run(args.variant)
+        if key is None:
+            raise SystemExit(f"no runs for variant '{args.variant}'")
+        run_dir = os.path.join(runs.RUNS_DIR, args.variant, key)
+    paths = view_paths(run_dir)
+    con = connect(args.threads, views=paths)
+
+    if args.views:
+        for name, path in paths.items():
+            print(f"{name:44s} {path}")
+    if args.benchmark_instruments:
+        res = benchmark_instruments(con, args.repeat)
+        print(f"instruments: {res['rows']} bank-years; pandas {res['pandas_s']:.3f}s, "
+              f"sql {res['sql_s']:.3f}s; max |difference| {res['max_diff']:.3g}")
+        for col, diff in res["diffs"].items():
+            if diff > 1e-9:
+                print(f"    {col:28s} {diff:.3g}")
+    if args.sql:
+        result = query(args.sql, con=con)
+        if args.out:
+            result.to_csv(args.out, index=False)
+            print(f"{len(result)} rows -> {args.out}")
+        else:
+            print(result.to_string(index=False))
+    if not (args.views or args.benchmark_instruments or args.sql):
+        ap.error("give a query, --views or --benchmark-instruments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,547 @@
+"""
+Schemas and invariants checked on the files passed between cleaning stages.
+
+SCHEMAS maps each input or output path (as in the stages' INPUTS / OUTPUTS) to the columns it
+must carry and the invariants its rows must satisfy; MERGES lists, per pipeline stage, the joins
+it performs with the key cardinality it assumes. pipeline.py checks every frame it loads or
+builds (outputs before they are written) and each stage's joins before the stage runs. Checks
+on a column the frame lacks are skipped, so files written before a column existed still pass.
+
+Checks are vectorized so they can stay on in production runs:
+- key columns are factorized to one integer code per row; uniqueness, group sums and
+  within-group constancy are bincounts or gathers over those codes;
+- string formats (FIPS) are checked on the distinct values only and broadcast back;
+- merge cardinality factorizes both sides' keys jointly and counts, per left row, the right
+  rows it would match, which is the row blow-up of the join without performing it.
+
+Sampling (--sample FRACTION, or pipeline.py --validate sample) is meant for very large raw
+files. Rows are kept by a hash of the schema's sample_by column (the bank id), so a sampled bank
+keeps all of its rows: key uniqueness and per-bank-year sums remain exact for the sampled banks.
+Frames below SAMPLE_MIN_ROWS are always checked in full.
+
+Severity: 'error' checks raise ValidationError (a ValueError) once all checks of a frame ran;
+'warn' checks only print. Known issues in the current inputs (DEPDOM of zero, the instruments
+merge on bank id only across several SOD years) are declared as warnings.
+
+Usage:
+  python programs/clean/validation.py                          # every declared file on disk
+  python programs/clean/validation.py data/raw/SOD.csv --sample 0.05
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from quarters import QDATE
+
+SAMPLE_FRACTION = 0.05
+SAMPLE_MIN_ROWS = 100_000
+MAX_EXAMPLES = 3
+# Summed SOD branch deposits differ from the reported DEPDOM by rounding (up to ~5e-5 relative on
+# current data), so a one-division bank's share can sit just above 1
+SHARE_TOLERANCE = 1e-4
+# U.S. state (and DC, PR) FIPS codes; territories other than PR do not appear in SOD or ACS
+STATE_FIPS = {
+    1, 2, 4, 5, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28,
+    29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 44, 45, 46, 47, 48, 49, 50, 51, 53,
+    54, 55, 56, 72,
+}
+_STATE_TABLE = np.isin(np.arange(100), list(STATE_FIPS))
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def _column_codes(s: pd.Series):
+    """Integer codes of a column and their count; -1 for missing values.
+
+    Integer columns with a compact range (bank ids, years, quarters) are offset directly instead
+    of hashed.
+    """
+    if pd.api.types.is_integer_dtype(s) and not s.hasnans and len(s):
+        v = s.to_numpy(dtype=np.int64)
+        lo, hi = v.min(), v.max()
+        if hi - lo < max(4 * len(v), 1 << 16):
+            return v - lo, int(hi - lo + 1)
+    c, uniques = pd.factorize(s)
+    return c.astype(np.int64), len(uniques)
+
+
+def key_codes(df: pd.DataFrame, keys: Sequence[str], cache: Optional[Dict] = None) -> np.ndarray:
+    """One int64 code per row for the key columns (not necessarily dense); -1 where any key is missing.
+
+    cache (a dict) keeps the codes per key tuple, so several checks on the same keys share them.
+    """
+    if cache is not None and tuple(keys) in cache:
+        return cache[tuple(keys)]
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    span = 1
+    for col in keys:
+        c, n = _column_codes(df[col])
+        missing |= c < 0
+        codes = codes * (n + 1) + c
+        span *= n + 1
+        if span > max(4 * len(df), 1 << 16):
+            # re-densify so bincounts stay small and the mixed-radix product cannot overflow
+            codes, uniques = pd.factorize(codes)
+            codes, span = codes.astype(np.int64), len(uniques)
+    codes[missing] = -1
+    if cache is not None:
+        cache[tuple(keys)] = codes
+    return codes
+
+
+def _group_sizes(codes: np.ndarray) -> np.ndarray:
+    """Size of each row's group (0 for rows with missing keys)."""
+    valid = codes >= 0
+    counts = np.bincount(codes[valid], minlength=codes.max(initial=-1) + 1)
+    return np.where(valid, counts[np.maximum(codes, 0)], 0)
+
+
+@dataclass
+class Check:
+    """An invariant on a frame; violations() returns a boolean mask of offending rows."""
+    severity: str = field(default="error", kw_only=True)
+    note: str = field(default="", kw_only=True)
+
+    @property
+    def columns(self) -> List[str]:
+        raise NotImplementedError
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+
+@dataclass
+class Unique(Check):
+    keys: List[str]
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.keys)
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        if all(pd.api.types.is_integer_dtype(df[k]) for k in self.keys):
+            return _group_sizes(key_codes(df, self.keys, cache)) > 1
+        # float or string keys: one 64-bit row hash and a sort instead of factorizing every column
+        h = pd.util.hash_pandas_object(df[self.keys], index=False).to_numpy()
+        s = np.sort(h)
+        repeated = s[1:][s[1:] == s[:-1]]
+        if not len(repeated):
+            return np.zeros(len(df), dtype=bool)
+        return np.isin(h, repeated) & ~df[self.keys].isna().to_numpy().any(axis=1)
+
+    def describe(self) -> str:
+        return f"unique ({', '.join(self.keys)})"
+
+
+@dataclass
+class NotNull(Check):
+    cols: List[str]
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.cols)
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        return df[self.cols].isna().to_numpy().any(axis=1)
+
+    def describe(self) -> str:
+        return f"not null ({', '.join(self.cols)})"
+
+
+@dataclass
+class Range(Check):
+    """lo <= column <= hi (lo < column if open_lo); NaN allowed unless allow_na is False."""
+    column: str
+    lo: float = -np.inf
+    hi: float = np.inf
+    open_lo: bool = False
+    allow_na: bool = True
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.column]
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        v = pd.to_numeric(df[self.column], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        na = np.isnan(v)
+        with np.errstate(invalid="ignore"):
+            ok = ((v > self.lo) if self.open_lo else (v >= self.lo)) & (v <= self.hi)
+        return ~ok & ~na if self.allow_na else ~ok
+
+    def describe(self) -> str:
+        return f"{self.column} in {'(' if self.open_lo else '['}{self.lo:g}, {self.hi:g}]"
+
+
+@dataclass
+class Fips(Check):
+    """5-digit county FIPS with a known state code; strings may carry a prefix of `prefix` characters.
+
+    Integer columns (FIPS read by read_csv without dtype=str) are checked numerically.
+    """
+    column: str
+    prefix: int = 0
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.column]
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        s = df[self.column]
+        if pd.api.types.is_numeric_dtype(s):
+            v = s.to_numpy(dtype=float, na_value=np.nan)
+            with np.errstate(invalid="ignore"):
+                ok = (v >= 1000) & (v < 100_000) & (v == np.floor(v))
+            state = np.where(ok, v // 1000, 0).astype(np.int64)
+            return ~(ok & _STATE_TABLE[state])
+        codes, uniques = pd.factorize(s)
+        ok = np.array([self._valid(u) for u in uniques], dtype=bool)
+        return (codes < 0) | ~ok[np.maximum(codes, 0)]
+
+    def _valid(self, value) -> bool:
+        value = str(value)[self.prefix:]
+        return len(value) == 5 and value.isdigit() and int(value[:2]) in STATE_FIPS
+
+    def describe(self) -> str:
+        return f"{self.column} is a 5-digit county FIPS" + (f" after {self.prefix} prefix chars" if self.prefix else "")
+
+
+@dataclass
+class GroupSum(Check):
+    """Per group of keys, sum(numerator / denominator) is within tol of target."""
+    keys: List[str]
+    numerator: str
+    denominator: str
+    target: float = 1.0
+    tol: float = 1e-3
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.keys) + [self.numerator, self.denominator]
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        codes = key_codes(df, self.keys, cache)
+        valid = codes >= 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = df[self.numerator].to_numpy(dtype=float) / df[self.denominator].to_numpy(dtype=float)
+        # non-finite ratios make the group's sum non-finite, which flags the group
+        sums = np.bincount(codes[valid], weights=ratio[valid], minlength=codes.max(initial=-1) + 1)
+        with np.errstate(invalid="ignore"):
+            bad = ~(np.abs(sums - self.target) <= self.tol)
+        return valid & bad[np.maximum(codes, 0)]
+
+    def describe(self) -> str:
+        return f"sum {self.numerator}/{self.denominator} = {self.target:g} per ({', '.join(self.keys)})"
+
+
+@dataclass
+class Constant(Check):
+    """column takes one value within each group of keys; flags rows that differ from the group's first."""
+    keys: List[str]
+    column: str
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.keys) + [self.column]
+
+    def violations(self, df: pd.DataFrame, cache: Optional[Dict] = None) -> np.ndarray:
+        codes = key_codes(df, self.keys, cache)
+        valid = codes >= 0
+        s = df[self.column]
+        if pd.api.types.is_numeric_dtype(s):
+            values = s.to_numpy(dtype=float, na_value=np.nan)
+        else:
+            values = pd.factorize(s)[0].astype(float)
+            values[values < 0] = np.nan
+        # each group's first value: reversed fancy assignment lets the first row write last
+        first = np.empty(codes.max(initial=-1) + 1)
+        first[codes[valid][::-1]] = values[valid][::-1]
+        expected = first[np.maximum(codes, 0)]
+        same = (values == expected) | (np.isnan(values) & np.isnan(expected))
+        return valid & ~same
+
+    def describe(self) -> str:
+        return f"{self.column} constant within ({', '.join(self.keys)})"
+
+
+@dataclass
+class Schema:
+    columns: List[str]
+    checks: List[Check] = field(default_factory=list)
+    sample_by: Optional[str] = None
+
+
+@dataclass
+class Merge:
+    """A stage's join of input `left` with input `right`, and the cardinality it assumes."""
+    left: str
+    right: str
+    left_on: List[str]
+    right_on: List[str]
+    validate: str = "many_to_one"
+    severity: str = "error"
+    note: str = ""
+
+    def describe(self) -> str:
+        return f"{self.left}({', '.join(self.left_on)}) -> {self.right}({', '.join(self.right_on)}) {self.validate}"
+
+
+@dataclass
+class Violation:
+    source: str
+    check: str
+    severity: str
+    rows: int
+    checked: int
+    examples: str = ""
+    note: str = ""
+
+    def __str__(self) -> str:
+        text = f"[{self.severity}] {self.source}: {self.check}: {self.rows:,} of {self.checked:,} rows"
+        if self.examples:
+            text += f"; e.g. {self.examples}"
+        if self.note:
+            text += f" ({self.note})"
+        return text
+
+
+CALL_KEYS = ["rssd9001", "rssd9999"]
+CALL_RAW = Schema(["rssd9001", "rssd9999", "rssdsubmissiondate"], [NotNull(CALL_KEYS)], sample_by="rssd9001")
+BANK_QUARTER = ["rssd9001", QDATE]
+
+SCHEMAS: Dict[str, Schema] = {
+    # Raw Call Report extracts: resubmissions repeat (rssd9001, rssd9999) and are de-duplicated by the stages
+    "data/raw/riad.csv": CALL_RAW,
+    "data/raw/rcon_deposit.csv": CALL_RAW,
+    "data/raw/rcon_credit_1.csv": CALL_RAW,
+    "data/raw/rcon_credit_2.csv": CALL_RAW,
+    "data/raw/rcon_control_1.csv": CALL_RAW,
+    "data/raw/rcon_control_2.csv": CALL_RAW,
+    "data/raw/riad_control.csv": CALL_RAW,
+    "data/raw/ffr_upper_limit.csv": Schema(["date", "ffr_upper"], [
+        Unique(["date"]), Range("ffr_upper", 0, 25),
+    ]),
+    "data/raw/SOD.csv": Schema(
+        ["YEAR", "RSSDID", "DEPDOM", "DEPSUMBR", "STCNTYBR"],
+        [
+            NotNull(["YEAR", "RSSDID", "STCNTYBR"]),
+            Fips("STCNTYBR", severity="warn", note="branches outside the 50 states, DC and PR get no division"),
+            Range("DEPSUMBR", 0),
+            Range("DEPDOM", 0, open_lo=True, severity="warn", note="zero DEPDOM gives infinite branch weights"),
+            Constant(["YEAR", "RSSDID"], "DEPDOM"),
+            GroupSum(["YEAR", "RSSDID"], "DEPSUMBR", "DEPDOM", severity="warn",
+                     note="branch weights DEPSUMBR / DEPDOM should sum to 1 per bank-year"),
+            Unique(["YEAR", "RSSDID", "STCNTYBR", "DEPSUMBR"], severity="warn",
+                   note="identical branch rows, probably loaded twice"),
+        ],
+        sample_by="RSSDID",
+    ),
+    "data/raw/ACS.csv": Schema(["fips", "median_hh_income", "share_ba_plus", "share_age_65plus", "share_internet_sub"], [
+        Unique(["fips"]), Fips("fips"),
+        Range("median_hh_income", 0, open_lo=True),
+        Range("share_ba_plus", 0, 1), Range("share_age_65plus", 0, 1), Range("share_internet_sub", 0, 1),
+    ]),
+    "data/raw/IRS.csv": Schema(["fips", "share_dividend", "share_interest"], [
+        Unique(["fips"]), Fips("fips"), Range("share_dividend", 0, 1), Range("share_interest", 0, 1),
+    ]),
+    # fips5 carries a two-character prefix ('US01001') that sophistication_index_merge.py slices off
+    "data/raw/HMDA.csv": Schema(["fips5", "orig_total", "refi_share"], [
+        Unique(["fips5"]), Fips("fips5", prefix=2), Range("orig_total", 0), Range("refi_share", 0, 1),
+    ]),
+    "data/processed/sophistication_index.csv": Schema(["fips", "sophistication_index"], [
+        Unique(["fips"]), Fips("fips"),
+        NotNull(["sophistication_index"], severity="warn",
+                note="counties without ACS/IRS/HMDA coverage (Loving County, TX) get no index"),
+    ]),
+    "data/processed/instruments.csv": Schema(
+        ["YEAR", "RSSDID", "sophistication_index_z", "hhi_z", "branch_density_z", "NE", "PC"],
+        [Unique(["YEAR", "RSSDID"])]
+        + [Range(c, 0, 1 + SHARE_TOLERANCE, severity="warn", note="division deposits exceed DEPDOM")
+           for c in ["NE", "MA", "EC", "WC", "SA", "ES", "WS", "MT", "PC"]],
+        sample_by="RSSDID",
+    ),
+    "data/processed/deposit_interest_rate.csv": Schema(
+        ["rssd9001", "rssd9999", "interest_rate_on_deposit"], [Unique(BANK_QUARTER)], sample_by="rssd9001",
+    ),
+    "data/processed/bank_credit.csv": Schema(
+        ["rssd9001", "rssd9999", "rssd9050"], [Unique(BANK_QUARTER)], sample_by="rssd9001",
+    ),
+    "data/processed/controls.csv": Schema(
+        ["rssd9001", "rssd9999", "ROA"], [Unique(BANK_QUARTER)], sample_by="rssd9001",
+    ),
+    "data/processed/ffr_quarterly.csv": Schema(["Date", "ffr_upper", "d_ffr"], [Unique(["Date"]), NotNull(["Date"])]),
+    "data/processed/rates_quarterly.csv": Schema(["Date", QDATE], [Unique([QDATE])]),
+    "data/working/working_panel.csv": Schema(
+        ["Bank ID", "Date", "d_ffr", "large_bank"],
+        [
+            Unique(["Bank ID", QDATE], severity="warn",
+                   note="instruments merged on bank id only repeat bank-quarters across SOD years"),
+            Range("sophistication_index_z", -10, 10), Range("hhi_z", -10, 10), Range("branch_density_z", -10, 10),
+        ],
+        sample_by="Bank ID",
+    ),
+}
+
+# Joins by stage, on the stage's input names
+MERGES: Dict[str, List[Merge]] = {
+    "working_panel": [
+        Merge("deposit_interest_rate", "bank_credit", BANK_QUARTER + ["rssd9050"], BANK_QUARTER + ["rssd9050"]),
+        Merge("deposit_interest_rate", "instruments", ["rssd9001"], ["RSSDID"], severity="warn",
+              note="instruments are merged on bank id only; each extra SOD year repeats bank-quarters"),
+        Merge("deposit_interest_rate", "controls", BANK_QUARTER, BANK_QUARTER),
+        Merge("deposit_interest_rate", "ffr_quarterly", [QDATE], [QDATE]),
+    ],
+    "sophistication_index": [
+        Merge("acs", "irs", ["fips"], ["fips"], validate="one_to_one"),
+    ],
+}
+
+
+def sample_mask(df: pd.DataFrame, column: str, fraction: float) -> np.ndarray:
+    """Rows whose `column` value hashes into the sampled fraction (all rows of a sampled bank)."""
+    h = pd.util.hash_array(df[column].to_numpy())
+    return h < np.uint64(fraction * float(2 ** 64 - 1))
+
+
+def _examples(df: pd.DataFrame, bad: np.ndarray, columns: Sequence[str]) -> str:
+    first = np.flatnonzero(bad)[:50 * MAX_EXAMPLES]
+    rows = df.iloc[first][[c for c in columns if c in df.columns]].drop_duplicates().head(MAX_EXAMPLES)
+    return "; ".join(", ".join(f"{k}={v}" for k, v in row.items()) for row in rows.to_dict("records"))
+
+
+def check_frame(df: pd.DataFrame, schema: Schema, source: str, sample: Optional[float] = None) -> List[Violation]:
+    """Run a schema on a frame; sample (0-1] checks the rows of a hashed fraction of sample_by."""
+    missing = [c for c in schema.columns if c not in df.columns]
+    if missing:
+        return [Violation(source, f"missing columns {missing}", "error", len(df), len(df))]
+    if sample is not None and sample < 1 and schema.sample_by and len(df) >= SAMPLE_MIN_ROWS:
+        df = df[sample_mask(df, schema.sample_by, sample)]
+        source = f"{source} (sample {sample:g})"
+
+    found = []
+    cache: Dict = {}
+    for check in schema.checks:
+        if any(c not in df.columns for c in check.columns):
+            continue  # optional column absent (e.g. an older file)
+        bad = check.violations(df, cache)
+        n_bad = int(bad.sum())
+        if n_bad:
+            found.append(Violation(source, check.describe(), check.severity, n_bad, len(df),
+                                   _examples(df, bad, getattr(check, "keys", check.columns)), check.note))
+    return found
+
+
+def check_merge(frames: Dict[str, pd.DataFrame], merge: Merge, sample: Optional[float] = None) -> List[Violation]:
+    """Cardinality of a left join of frames[left] with frames[right], without performing it."""
+    left, right = frames[merge.left], frames[merge.right]
+    if any(c not in left.columns for c in merge.left_on) or any(c not in right.columns for c in merge.right_on):
+        return []
+    source = merge.describe()
+    if sample is not None and sample < 1 and max(len(left), len(right)) >= SAMPLE_MIN_ROWS:
+        left = left[sample_mask(left, merge.left_on[0], sample)]
+        right = right[sample_mask(right, merge.right_on[0], sample)]
+        source = f"{source} (sample {sample:g})"
+
+    keys = pd.concat([
+        left[merge.left_on].set_axis(merge.left_on, axis=1),
+        right[merge.right_on].set_axis(merge.left_on, axis=1),
+    ], ignore_index=True)
+    for lcol, rcol in zip(merge.left_on, merge.right_on):
+        # int vs float keys (NaN on one side) must land on the same codes
+        if left[lcol].dtype != right[rcol].dtype and pd.api.types.is_numeric_dtype(keys[lcol]):
+            keys[lcol] = keys[lcol].astype(float)
+    codes = key_codes(keys, merge.left_on)
+    lc, rc = codes[:len(left)], codes[len(left):]
+    right_counts = np.bincount(rc[rc >= 0], minlength=codes.max(initial=-1) + 1)
+    matches = np.where(lc >= 0, right_counts[np.maximum(lc, 0)], 0)
+
+    found = []
+    many = matches > 1
+    if merge.validate in ("many_to_one", "one_to_one") and many.any():
+        rows = int(np.maximum(matches, 1).sum())
+        found.append(Violation(source, f"right keys not unique: left join gives {rows:,} rows from {len(left):,}",
+                               merge.severity, int(many.sum()), len(left),
+                               _examples(left, many, merge.left_on), merge.note))
+    if merge.validate in ("one_to_many", "one_to_one"):
+        dup = _group_sizes(lc) > 1
+        if dup.any():
+            found.append(Violation(source, "left keys not unique", merge.severity, int(dup.sum()), len(left),
+                                   _examples(left, dup, merge.left_on), merge.note))
+    return found
+
+
+def check_frames(frames: Dict[str, pd.DataFrame], paths: Dict[str, str], sample: Optional[float] = None,
+                 skip: Sequence[str] = ()) -> List[Violation]:
+    """Check every frame (by name) whose path has a schema, except paths already checked (skip)."""
+    found = []
+    for name, frame in frames.items():
+        path = paths.get(name)
+        if path in SCHEMAS and path not in skip:
+            found += check_frame(frame, SCHEMAS[path], path, sample)
+    return found
+
+
+def check_merges(stage: str, frames: Dict[str, pd.DataFrame], sample: Optional[float] = None) -> List[Violation]:
+    """Cardinality checks of a stage's declared joins on its input frames."""
+    found = []
+    for merge in MERGES.get(stage, []):
+        if merge.left in frames and merge.right in frames:
+            found += check_merge(frames, merge, sample)
+    return found
+
+
+def report(violations: List[Violation], strict: bool = False) -> None:
+    """Print every violation; raise ValidationError if any is an error (or any at all if strict)."""
+    for v in violations:
+        print(v)
+    errors = [v for v in violations if v.severity == "error" or strict]
+    if errors:
+        raise ValidationError(f"{len(errors)} validation error(s):\n" + "\n".join(str(v) for v in errors))
+
+
+def validate_file(path: str, sample: Optional[float] = None, strict: bool = False) -> float:
+    """Read a declared file, check it and report; returns the check time in seconds (excluding the read)."""
+    df = pd.read_csv(path)
+    t0 = time.perf_counter()
+    violations = check_frame(df, SCHEMAS[path], path, sample)
+    elapsed = time.perf_counter() - t0
+    report(violations, strict)
+    return elapsed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Check declared schemas and invariants of pipeline files.")
+    ap.add_argument("paths", nargs="*", help="Declared files to check (default: every one present).")
+    ap.add_argument("--sample", type=float, default=None,
+                    help=f"Check a hashed fraction of banks in large files (e.g. {SAMPLE_FRACTION}).")
+    ap.add_argument("--strict", action="store_true", help="Treat warnings as errors.")
+    args = ap.parse_args()
+
+    paths = args.paths or [p for p in SCHEMAS if os.path.exists(p)]
+    unknown = [p for p in paths if p not in SCHEMAS]
+    if unknown:
+        raise SystemExit(f"No schema declared for {unknown}.")
+    failed = 0
+    for path in paths:
+        try:
+            elapsed = validate_file(path, args.sample, args.strict)
+            print(f"{path}: checked in {elapsed:.3f}s")
+        except ValidationError as err:
+            print(f"{path}: FAILED ({err.args[0].splitlines()[0]})")
+            failed += 1
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Streaming winsorization with mergeable quantile sketches.
+
+Outlier bounds are fit in one pass over chunked or partitioned input and applied in a second
+pass, so a panel never has to be held in memory whole. Bounds can be global or per group (e.g.
+per date, as in the deposit-rate plot).
+
+Quantile estimators (method=...):
+- 'kll':   KLL sketch (Karnin, Lang & Liberty 2016). Fixed memory (~3k items per column and group
+           for the default k), mergeable across chunks, partitions or worker processes; rank error
+           shrinks roughly as 1/k.
+- 'exact': keeps every value and matches pandas' Series.quantile (linear interpolation). Meant
+           for validation and for in-memory frames where exact reproduction matters.
+
+Sources accepted by fit_bounds / iter_chunks: a DataFrame, a CSV path, a list of either (one
+partition per element), or a zero-argument callable returning an iterator of DataFrames.
+
+Usage:
+  python programs/clean/winsorize.py IN.csv OUT.csv --columns ROA asset_to_equity
+  python programs/clean/winsorize.py IN.csv OUT.csv --columns interest_rate_on_deposit --by rssd9999
+  python programs/clean/winsorize.py IN.csv OUT.csv --columns ROA --validate   # sketch vs exact
+"""
+import argparse
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+OUTLIER_Q_LOW = 0.005
+OUTLIER_Q_HIGH = 0.995
+CHUNKSIZE = 250_000
+DEFAULT_K = 2048
+ALL = "all"  # index label of the single row of global (ungrouped) bounds
+
+Source = Union[pd.DataFrame, str, list, Callable[[], Iterator[pd.DataFrame]]]
+
+
+class KLLSketch:
+    """Mergeable KLL quantile sketch over float values (NaNs are ignored)."""
+
+    def __init__(self, k: int = DEFAULT_K, seed: int = 0) -> None:
+        self.k = k
+        self.n = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            if self.levels[h].size > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                buf = np.sort(self.levels[h])
+                # An odd leftover stays at this level; the rest is halved and promoted.
+                keep, buf = (buf[-1:], buf[:-1]) if buf.size % 2 else (buf[:0], buf)
+                offset = self._rng.integers(2)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], buf[offset::2]])
+                self.levels[h] = keep
+            h += 1
+
+    def update(self, values) -> "KLLSketch":
+        x = np.asarray(values, dtype=float)
+        x = x[~np.isnan(x)]
+        if x.size:
+            self.n += x.size
+            self.levels[0] = np.concatenate([self.levels[0], x])
+            self._compress()
+        return self
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, qs) -> np.ndarray:
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(lv.size, 2 ** h) for h, lv in enumerate(self.levels)])
+        order = np.argsort(items, kind="mergesort")
+        items, cum = items[order], np.cumsum(weights[order])
+        idx = np.searchsorted(cum, qs * cum[-1], side="left")
+        return items[np.minimum(idx, items.size - 1)]
+
+
+class ExactQuantiles:
+    """Same interface as KLLSketch, but keeps all values; matches Series.quantile."""
+
+    def __init__(self, **_) -> None:
+        self.parts: List[np.ndarray] = []
+        self.n = 0
+
+    def update(self, values) -> "ExactQuantiles":
+        x = np.asarray(values, dtype=float)
+        x = x[~np.isnan(x)]
+        self.parts.append(x)
+        self.n += x.size
+        return self
+
+    def merge(self, other: "ExactQuantiles") -> "ExactQuantiles":
+        self.parts.extend(other.parts)
+        self.n += other.n
+        return self
+
+    def quantiles(self, qs) -> np.ndarray:
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        # percentile on q * 100, as pandas does, so bounds agree to the last bit
+        return np.percentile(np.concatenate(self.parts), qs * 100.0)
+
+
+SKETCHES = {"kll": KLLSketch, "exact": ExactQuantiles}
+
+
+def iter_chunks(source: Source, columns: Optional[List[str]] = None,
+                chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """Yield DataFrame chunks from a frame, CSV path, list of partitions or chunk factory."""
+    if isinstance(source, pd.DataFrame):
+        frame = source if columns is None else source[columns]
+        for start in range(0, len(frame), chunksize):
+            yield frame.iloc[start:start + chunksize]
+    elif isinstance(source, str):
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunksize)
+    elif isinstance(source, (list, tuple)):
+        for part in source:
+            yield from iter_chunks(part, columns, chunksize)
+    elif callable(source):
+        for chunk in source():
+            yield chunk if columns is None else chunk[columns]
+    else:
+        raise TypeError(f"Unsupported source type: {type(source).__name__}")
+
+
+def fit_sketches(
+    source: Source,
+    columns: List[str],
+    by: Optional[str] = None,
+    method: str = "kll",
+    k: int = DEFAULT_K,
+    chunksize: int = CHUNKSIZE,
+) -> Dict[str, dict]:
+    """One streaming pass: {column: {group: sketch}} (group is ALL when by is None).
+
+    The result of two calls on different partitions can be combined with merge_sketches.
+    """
+    sketch_cls = SKETCHES[method]
+    read_cols = list(columns) + ([by] if by else [])
+    sketches: Dict[str, dict] = {col: {} for col in columns}
+    for chunk in iter_chunks(source, read_cols, chunksize):
+        if by is None:
+            groups = {ALL: np.arange(len(chunk))}
+        else:
+            groups = chunk.groupby(by, sort=False).indices
+        for col in columns:
+            values = chunk[col].to_numpy(dtype=float, na_value=np.nan)
+            per_col = sketches[col]
+            for key, idx in groups.items():
+                if key not in per_col:
+                    per_col[key] = sketch_cls(k=k)
+                per_col[key].update(values[idx])
+    return sketches
+
+
+def merge_sketches(a: Dict[str, dict], b: Dict[str, dict]) -> Dict[str, dict]:
+    """Combine two fit_sketches results (e.g. from separate partitions or processes)."""
+    for col, groups in b.items():
+        target = a.setdefault(col, {})
+        for key, sketch in groups.items():
+            if key in target:
+                target[key].merge(sketch)
+            else:
+                target[key] = sketch
+    return a
+
+
+def sketch_bounds(sketches: Dict[str, dict], lower: float = OUTLIER_Q_LOW,
+                  upper: float = OUTLIER_Q_HIGH) -> pd.DataFrame:
+    """Bounds table indexed by group with '<col>_low' / '<col>_high' columns."""
+    out = {}
+    for col, groups in sketches.items():
+        keys = list(groups)
+        q = np.array([groups[g].quantiles([lower, upper]) for g in keys]).reshape(len(keys), 2)
+        out[f"{col}_low"] = pd.Series(q[:, 0], index=keys)
+        out[f"{col}_high"] = pd.Series(q[:, 1], index=keys)
+    bounds = pd.DataFrame(out)
+    return bounds.sort_index() if ALL not in bounds.index else bounds
+
+
+def fit_bounds(
+    source: Source,
+    columns: List[str],
+    lower: float = OUTLIER_Q_LOW,
+    upper: float = OUTLIER_Q_HIGH,
+    by: Optional[str] = None,
+    method: str = "kll",
+    k: int = DEFAULT_K,
+    chunksize: int = CHUNKSIZE,
+) -> pd.DataFrame:
+    """First pass: lower/upper quantile bounds per column, globally or per group."""
+    sketches = fit_sketches(source, columns, by=by, method=method, k=k, chunksize=chunksize)
+    return sketch_bounds(sketches, lower, upper)
+
+
+def _lookup(chunk: pd.DataFrame, bounds: pd.DataFrame, columns: List[str],
+            by: Optional[str]) -> dict:
+    if by is None:
+        return {c: (bounds.at[ALL, f"{c}_low"], bounds.at[ALL, f"{c}_high"]) for c in columns}
+    aligned = bounds.reindex(chunk[by].to_numpy())
+    return {c: (aligned[f"{c}_low"].to_numpy(), aligned[f"{c}_high"].to_numpy()) for c in columns}
+
+
+def within_bounds(chunk: pd.DataFrame, bounds: pd.DataFrame, columns: List[str],
+                  by: Optional[str] = None) -> np.ndarray:
+    """Row mask: every column lies within its bounds (missing values fall outside)."""
+    keep = np.ones(len(chunk), dtype=bool)
+    for c, (lo, hi) in _lookup(chunk, bounds, columns, by).items():
+        v = chunk[c].to_numpy(dtype=float, na_value=np.nan)
+        keep &= (v >= lo) & (v <= hi)
+    return keep
+
+
+def apply_bounds(chunk: pd.DataFrame, bounds: pd.DataFrame, columns: List[str],
+                 by: Optional[str] = None, how: str = "clip") -> pd.DataFrame:
+    """Second pass, per chunk: clip values to the bounds, or drop rows outside them.
+
+    how='drop' keeps a row only if every column lies within its bounds (missing values are
+    dropped, as with the comparisons in working_panel_merge.py).
+    """
+    if how == "drop":
+        return chunk[within_bounds(chunk, bounds, columns, by)]
+    if how != "clip":
+        raise ValueError(f"how must be 'clip' or 'drop', got {how!r}")
+    chunk = chunk.copy()
+    for c, (lo, hi) in _lookup(chunk, bounds, columns, by).items():
+        if by is not None:
+            lo, hi = pd.Series(lo, index=chunk.index), pd.Series(hi, index=chunk.index)
+        chunk[c] = chunk[c].clip(lower=lo, upper=hi)
+    return chunk
+
+
+def winsorize_frame(df: pd.DataFrame, columns: List[str], lower: float = OUTLIER_Q_LOW,
+                    upper: float = OUTLIER_Q_HIGH, by: Optional[str] = None,
+                    how: str = "clip", method: str = "exact") -> pd.DataFrame:
+    """In-memory convenience: fit and apply in one call (exact by default)."""
+    bounds = fit_bounds(df, columns, lower, upper, by=by, method=method, chunksize=max(len(df), 1))
+    return apply_bounds(df, bounds, columns, by=by, how=how)
+
+
+def winsorize_csv(src: Source, dst: str, columns: List[str], lower: float = OUTLIER_Q_LOW,
+                  upper: float = OUTLIER_Q_HIGH, by: Optional[str] = None, how: str = "clip",
+                  method: str = "kll", k: int = DEFAULT_K,
+                  chunksize: int = CHUNKSIZE) -> pd.DataFrame:
+    """Two streaming passes over src; writes the winsorized rows to dst and returns the bounds."""
+    bounds = fit_bounds(src, columns, lower, upper, by=by, method=method, k=k, chunksize=chunksize)
+    header = True
+    for chunk in iter_chunks(src, None, chunksize):
+        apply_bounds(chunk, bounds, columns, by=by, how=how).to_csv(
+            dst, mode="w" if header else "a", header=header, index=False
+        )
+        header = False
+    return bounds
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Streaming two-pass winsorization of a CSV file.")
+    ap.add_argument("src", help="Input CSV.")
+    ap.add_argument("dst", help="Output CSV.")
+    ap.add_argument("--columns", nargs="+", required=True, help="Columns to winsorize.")
+    ap.add_argument("--by", default=None, help="Group column for per-group bounds (e.g. rssd9999).")
+    ap.add_argument("--lower", type=float, default=OUTLIER_Q_LOW)
+    ap.add_argument("--upper", type=float, default=OUTLIER_Q_HIGH)
+    ap.add_argument("--how", choices=["clip", "drop"], default="clip")
+    ap.add_argument("--method", choices=list(SKETCHES), default="kll")
+    ap.add_argument("--k", type=int, default=DEFAULT_K, help="KLL accuracy parameter.")
+    ap.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    ap.add_argument("--validate", action="store_true",
+                    help="Also fit exact bounds and report the sketch's deviation.")
+    args = ap.parse_args()
+
+    bounds = winsorize_csv(args.src, args.dst, args.columns, args.lower, args.upper, by=args.by,
+                           how=args.how, method=args.method, k=args.k, chunksize=args.chunksize)
+    print(bounds.to_string())
+    if args.validate:
+        exact = fit_bounds(args.src, args.columns, args.lower, args.upper, by=args.by,
+                           method="exact", chunksize=args.chunksize)
+        diff = (bounds - exact.reindex(bounds.index)).abs()
+        print("Max absolute deviation from exact bounds:")
+        print(diff.max().to_string())
+    print(f"Saved winsorized rows to {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
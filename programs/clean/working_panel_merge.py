@@ -8,9 +8,14 @@ Sources and citations:
   'N' (National), 'NM' (State nonmember), 'SM' (State member) denote commercial banks.
 - Regional shares and instruments: constructed from FDIC Summary of Deposits (SOD).
 """
+from typing import Tuple
+
 import pandas as pd
 import numpy as np
 
+from quarters import QDATE, ensure_qdate, to_qdate
+from winsorize import apply_bounds, fit_bounds
+
 # File paths
 PROC_DIR = "data/processed"
 WORK_DIR = "data/working"
@@ -20,34 +25,90 @@ INSTRUMENTS_CSV = f"{PROC_DIR}/instruments.csv"
 FFR_CSV = f"{PROC_DIR}/ffr_quarterly.csv"
 CONTROLS_CSV = f"{PROC_DIR}/controls.csv"
 OUTPUT_CSV = f"{WORK_DIR}/working_panel.csv"
+INPUTS = {
+    "deposit_interest_rate": DEPOSIT_INTEREST_RATE_CSV,
+    "bank_credit": BANK_CREDIT_CSV,
+    "instruments": INSTRUMENTS_CSV,
+    "controls": CONTROLS_CSV,
+    "ffr_quarterly": FFR_CSV,
+}
+OUTPUTS = {"working_panel": OUTPUT_CSV}
 
 # Constants
 ASSET_LARGE_THRESHOLD = 1_000_000
 OUTLIER_Q_LOW = 0.005
 OUTLIER_Q_HIGH = 0.995
 Z_LIMIT = 10
+# 'exact' reproduces pandas .quantile(); 'kll' uses the streaming sketch from winsorize.py
+WINSOR_METHOD = "exact"
 COMMERCIAL_BKCLASS = {'N', 'NM', 'SM'}
 DATE_START = "2022-01-01"
 DATE_END = "2023-09-30"
+# Inputs are joined on the integer quarter code; rssd9999 is kept from the deposit side only
+PANEL_KEYS = ['rssd9001', QDATE, 'rssd9050']
+INSTRUMENT_COLUMNS = [
+    'RSSDID', 'sophistication_index_z', 'ASSET', 'BKCLASS',
+    'hhi_z', 'branch_density_z', 'NE', 'MA', 'EC', 'WC', 'SA', 'ES', 'WS', 'MT', 'PC'
+]
+RATE_COLUMNS = ['interest_rate_on_deposit', 'interest_rate_on_interest_bearing_deposit']
+Z_COLUMNS = ['sophistication_index_z', 'hhi_z', 'branch_density_z']
+LOAN_DELTA_COLUMNS = [
+    'd_multifamily_loans', 'd_single_family_loans', 'd_total_loans',
+    'd_total_loans_not_for_sale', 'd_C&I'
+]
+
+
+def policy_window() -> Tuple[int, int]:
+    """DATE_START and DATE_END as quarter codes, converted when called so overrides of the dates apply."""
+    start, end = (int(q) for q in to_qdate([DATE_START, DATE_END]))
+    return start, end
+
+
+def finalize_panel(df: pd.DataFrame) -> pd.DataFrame:
+    """Size flag and winsorization applied to the policy-window sample."""
+    # Large bank indicator (size threshold)
+    df['large_bank'] = np.where(df['ASSET'] > ASSET_LARGE_THRESHOLD, 1, 0)
+    df.drop(columns=['ASSET'], inplace=True)
+
+    # Winsorize ROA and asset_to_equity at 0.5% / 99.5%; cap core_deposit_share below 1
+    winsor_cols = ['ROA', 'asset_to_equity']
+    bounds = fit_bounds(df, winsor_cols, OUTLIER_Q_LOW, OUTLIER_Q_HIGH, method=WINSOR_METHOD)
+    df = apply_bounds(df, bounds, winsor_cols, how='clip')
+
+    df['core_deposit_share'] = np.minimum(df['core_deposit_share'], 0.999)
+    return df
+
+
+def print_counts(df: pd.DataFrame) -> None:
+    print('Bank-quarter after winsorizing: ', len(df))
+    print('Large bank: ', len(df[df['large_bank'] == 1]))
+    print('Small bank: ', len(df[df['large_bank'] == 0]))
+
+
+def load_inputs(names=None) -> dict:
+    names = list(INPUTS) if names is None else names
+    return {name: pd.read_csv(INPUTS[name]) for name in names}
 
-def main() -> None:
-    # Load inputs
-    deposit_interest_rate = pd.read_csv(DEPOSIT_INTEREST_RATE_CSV)
-    bank_credit = pd.read_csv(BANK_CREDIT_CSV)
-    instruments = pd.read_csv(INSTRUMENTS_CSV)
-    controls = pd.read_csv(CONTROLS_CSV)
+
+def build_panel(
+    deposit_interest_rate: pd.DataFrame,
+    bank_credit: pd.DataFrame,
+    instruments: pd.DataFrame,
+    controls: pd.DataFrame,
+    ffr_quarterly: pd.DataFrame,
+) -> pd.DataFrame:
+    # Quarter codes as join keys (derived from the dates for files written before qdate existed)
+    deposit_interest_rate = ensure_qdate(deposit_interest_rate, 'rssd9999')
+    bank_credit = ensure_qdate(bank_credit, 'rssd9999').drop(columns=['rssd9999'])
+    controls = ensure_qdate(controls, 'rssd9999').drop(columns=['rssd9999'])
+    ffr_quarterly = ensure_qdate(ffr_quarterly, 'Date').drop(columns=['Date'])
 
     # Merge core inputs
-    df = deposit_interest_rate.merge(
-        bank_credit, on=['rssd9001', 'rssd9999', 'rssd9050'], how='left'
-    )
-    instruments = instruments[
-        ['RSSDID', 'sophistication_index_z', 'ASSET', 'BKCLASS',
-         'hhi_z', 'branch_density_z', 'NE', 'MA', 'EC', 'WC', 'SA', 'ES', 'WS', 'MT', 'PC']
-    ]
+    df = deposit_interest_rate.merge(bank_credit, on=PANEL_KEYS, how='left')
+    instruments = instruments[INSTRUMENT_COLUMNS]
     instruments.rename(columns={'RSSDID': 'rssd9001'}, inplace=True)
     df = df.merge(instruments, on=['rssd9001'], how='left')
-    df = df.merge(controls, on=['rssd9001', 'rssd9999'], how='left')
+    df = df.merge(controls, on=['rssd9001', QDATE], how='left')
     # Harmonize identifiers
     df.rename(columns={'rssd9001': 'Bank ID', 'rssd9999': 'Date'}, inplace=True)
     df.drop(columns=['rssd9050', 'rssdfininstfilingtype'], inplace=True)
@@ -57,14 +118,11 @@ def main() -> None:
     df = df[mask].copy()
 
     # Set missing deltas to zero (true zeros or missing changes)
-    df['d_multifamily_loans'] = df['d_multifamily_loans'].fillna(0)
-    df['d_single_family_loans'] = df['d_single_family_loans'].fillna(0)
-    df['d_total_loans'] = df['d_total_loans'].fillna(0)
-    df['d_total_loans_not_for_sale'] = df['d_total_loans_not_for_sale'].fillna(0)
-    df['d_C&I'] = df['d_C&I'].fillna(0)
+    for col in LOAN_DELTA_COLUMNS:
+        df[col] = df[col].fillna(0)
 
     # Small business lending flag (semi-annual) → carry forward last available within bank
-    df.sort_values(['Bank ID', 'Date'], inplace=True)
+    df.sort_values(['Bank ID', QDATE], inplace=True)
     last_flag = df.groupby('Bank ID')['small_buz_lending_flag'].ffill()
     df['small_buz_lending_flag_asof'] = np.where(last_flag.fillna(0) == 1, 1, 0)
     df.drop(columns=['small_buz_lending_flag'], inplace=True)
@@ -85,15 +143,8 @@ def main() -> None:
     print('Bank-quarter before winsorizing: ', len(df))
     
     # Drop outliers in rate series using 0.5% / 99.5% thresholds
-    low_dep = df['interest_rate_on_deposit'].quantile(OUTLIER_Q_LOW)
-    high_dep = df['interest_rate_on_deposit'].quantile(OUTLIER_Q_HIGH)
-    low_ib = df['interest_rate_on_interest_bearing_deposit'].quantile(OUTLIER_Q_LOW)
-    high_ib = df['interest_rate_on_interest_bearing_deposit'].quantile(OUTLIER_Q_HIGH)
-    mask_rates = (
-        (df['interest_rate_on_deposit'] >= low_dep) & (df['interest_rate_on_deposit'] <= high_dep) &
-        (df['interest_rate_on_interest_bearing_deposit'] >= low_ib) & (df['interest_rate_on_interest_bearing_deposit'] <= high_ib)
-    )
-    df = df[mask_rates].copy()
+    bounds = fit_bounds(df, RATE_COLUMNS, OUTLIER_Q_LOW, OUTLIER_Q_HIGH, method=WINSOR_METHOD)
+    df = apply_bounds(df, bounds, RATE_COLUMNS, how='drop').copy()
 
     # Keep z-scores strictly within [-Z_LIMIT, Z_LIMIT]
     mask_z = (
@@ -104,34 +155,23 @@ def main() -> None:
     df = df[mask_z].copy()
 
     # Merge FFR and keep policy window
-    ffr = pd.read_csv(FFR_CSV)
-    df = df.merge(ffr, on=['Date'], how='left')
-    mask = (df['Date'] >= DATE_START) & (df['Date'] <= DATE_END)
-    df = df[mask]
-
-    # Large bank indicator (size threshold)
-    df['large_bank'] = np.where(df['ASSET'] > ASSET_LARGE_THRESHOLD, 1, 0)
-    df.drop(columns=['ASSET'], inplace=True)
+    df = df.merge(ffr_quarterly, on=[QDATE], how='left')
+    mask = df[QDATE].between(*policy_window())
+    df = df[mask.fillna(False).astype(bool)]
 
-    # Winsorize ROA and asset_to_equity at 0.5% / 99.5%; cap core_deposit_share below 1
-    low_roa = df['ROA'].quantile(OUTLIER_Q_LOW)
-    high_roa = df['ROA'].quantile(OUTLIER_Q_HIGH)
-    df['ROA'] = df['ROA'].clip(lower=low_roa, upper=high_roa)
+    df = finalize_panel(df)
 
-    low_ae = df['asset_to_equity'].quantile(OUTLIER_Q_LOW)
-    high_ae = df['asset_to_equity'].quantile(OUTLIER_Q_HIGH)
-    df['asset_to_equity'] = df['asset_to_equity'].clip(lower=low_ae, upper=high_ae)
+    # Count after winsorizing
+    print_counts(df)
+    return df
 
-    df['core_deposit_share'] = np.minimum(df['core_deposit_share'], 0.999)
 
-    # Count after winsorizing
-    print('Bank-quarter after winsorizing: ', len(df))
-    print('Large bank: ', len(df[df['large_bank'] == 1]))
-    print('Small bank: ', len(df[df['large_bank'] == 0]))
+def main() -> None:
+    df = build_panel(**load_inputs())
 
     # Save
     df.to_csv(OUTPUT_CSV, index=False)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -26,7 +26,14 @@ How to run:
   #    Or restrict to your counties via a CSV with a column named "fips" (5-digit):
   python acs_county_fetch.py --filter-county-list county_list.csv --out data/raw/ACS_filtered.csv
 
+  #    Force the old one-request-per-state path (e.g., if the nationwide query is refused):
+  python acs_county_fetch.py --per-state
+
 Notes:
+  - Requests are planned automatically: one nationwide `for=county:*` query per chunk of at most
+    50 variables (the API's per-request cap, NAME included), fetched concurrently and joined on
+    (state, county). The per-state path (`in=state:XX`, chunked the same way) is used if the
+    nationwide query fails, or with --per-state.
   - Uses *only* B tables to avoid S-table naming headaches.
   - Year defaults to 2021 (the 2017–2021 ACS 5-year). Change with --year if you must.
   - All FIPS fields are strings; leading zeros preserved.
@@ -35,6 +42,9 @@ Notes:
 import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import List, Optional
 
 import pandas as pd
 import requests
@@ -45,6 +55,9 @@ import requests
 # -----------------------------
 DEFAULT_YEAR = 2021  # ACS 5-year vintage aligned with 2017–2021
 BASE_URL_TMPL = "https://api.census.gov/data/{year}/acs/acs5"
+MAX_VARS_PER_REQUEST = 50  # Census API cap on the 'get' list, NAME included
+MAX_WORKERS = 8  # concurrent requests
+GEO_KEYS = ["state", "county"]
 
 # Variables we need (B tables for stability)
 ACS_VARS = [
@@ -94,36 +107,62 @@ def _request_with_retries(url: str, params: dict, max_retries: int = 5, backoff:
     return r
 
 
-def fetch_state_counties(year: int, state_fips: str, api_key: str = "") -> pd.DataFrame:
+def plan_requests(variables: List[str] = ACS_VARS, max_vars: int = MAX_VARS_PER_REQUEST) -> List[List[str]]:
     """
-    Fetch all counties for a given state FIPS from ACS 5-year and return as DataFrame.
+    Split NAME + variables into 'get' lists of at most max_vars entries each.
+    """
+    fields = ["NAME"] + [v for v in variables if v != "NAME"]
+    return [fields[i:i + max_vars] for i in range(0, len(fields), max_vars)]
+
+
+def fetch_chunk(year: int, fields: List[str], api_key: str = "", state_fips: Optional[str] = None) -> pd.DataFrame:
+    """
+    One ACS request: the given fields for every county, nationwide or within one state.
     """
     base_url = BASE_URL_TMPL.format(year=year)
     params = {
-        "get": ",".join(["NAME"] + ACS_VARS),
+        "get": ",".join(fields),
         "for": "county:*",
-        "in": f"state:{state_fips}",
     }
+    if state_fips is not None:
+        params["in"] = f"state:{state_fips}"
     if api_key:
         params["key"] = api_key
 
     r = _request_with_retries(base_url, params)
     data = r.json()
-    header = data[0]
-    rows = data[1:]
-    df = pd.DataFrame(rows, columns=header)
+    df = pd.DataFrame(data[1:], columns=data[0])
 
     # Ensure string types for FIPS components
     df["state"] = df["state"].astype(str).str.zfill(2)
     df["county"] = df["county"].astype(str).str.zfill(3)
+    return df
+
+
+def fetch_raw(year: int, api_key: str = "", variables: List[str] = ACS_VARS, state_fips: Optional[str] = None,
+              workers: int = MAX_WORKERS) -> pd.DataFrame:
+    """
+    All variables for every county (optionally one state): one request per variable chunk, fetched
+    concurrently and column-joined on (state, county).
+    """
+    chunks = plan_requests(variables)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        frames = list(pool.map(lambda fields: fetch_chunk(year, fields, api_key, state_fips), chunks))
+    df = reduce(lambda left, right: left.merge(right, on=GEO_KEYS, how="inner", validate="one_to_one"), frames)
 
     # Cast numeric columns
-    for v in ACS_VARS:
+    for v in variables:
         df[v] = pd.to_numeric(df[v], errors="coerce")
-
     return df
 
 
+def fetch_state_counties(year: int, state_fips: str, api_key: str = "") -> pd.DataFrame:
+    """
+    Fetch all counties for a given state FIPS from ACS 5-year and return as DataFrame.
+    """
+    return fetch_raw(year, api_key=api_key, state_fips=state_fips, workers=1)
+
+
 def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     """
     From raw ACS columns, compute clean features and return tidy frame.
@@ -156,28 +195,43 @@ def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
+def fetch_counties(year: int = DEFAULT_YEAR, api_key: str = "", per_state: bool = False,
+                   workers: int = MAX_WORKERS) -> pd.DataFrame:
+    """
+    Nationwide county features for one ACS 5-year vintage, sorted by FIPS.
+    """
+    raw = None
+    if not per_state:
+        try:
+            raw = fetch_raw(year, api_key=api_key, workers=workers)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Nationwide ACS query failed ({e}); falling back to one request per state.")
+    if raw is None:
+        # Fetch all states (states in parallel, each state's chunks in turn) and concat
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            frames = list(pool.map(lambda st: fetch_state_counties(year, st, api_key=api_key), STATE_FIPS))
+        raw = pd.concat(frames, ignore_index=True)
+
+    features = compute_features(raw)
+
+    # Sort and keep nice dtypes
+    features = features.sort_values(["state_fips", "county_fips"]).reset_index(drop=True)
+    for col in ["median_hh_income", "share_ba_plus", "share_age_65plus", "share_internet_sub"]:
+        features[col] = pd.to_numeric(features[col], errors="coerce")
+    return features
+
+
 def main():
     ap = argparse.ArgumentParser(description="Fetch ACS 5-year county features for depositor sophistication proxies.")
     ap.add_argument("--year", type=int, default=DEFAULT_YEAR, help="ACS year (default: 2021, i.e., 2017–2021 5-year).")
     ap.add_argument("--out", type=str, default=os.path.join("data", "raw", "ACS.csv"), help="Output CSV path.")
+    ap.add_argument("--per-state", action="store_true", help="Query one state at a time instead of nationwide.")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent requests (default: 8).")
     args = ap.parse_args()
 
     api_key = os.environ.get("CENSUS_API_KEY", "").strip()
 
-    # Fetch all states and concat
-    frames = []
-    for st in STATE_FIPS:
-        df_state = fetch_state_counties(args.year, st, api_key=api_key)
-        frames.append(df_state)
-    raw = pd.concat(frames, ignore_index=True)
-
-    features = compute_features(raw)
-
-    # Sort and save
-    features = features.sort_values(["state_fips", "county_fips"]).reset_index(drop=True)
-    # Keep nice dtypes
-    for col in ["median_hh_income", "share_ba_plus", "share_age_65plus", "share_internet_sub"]:
-        features[col] = pd.to_numeric(features[col], errors="coerce")
+    features = fetch_counties(args.year, api_key=api_key, per_state=args.per_state, workers=args.workers)
 
     # Ensure output directory exists
     out_dir = os.path.dirname(os.path.abspath(args.out))
@@ -16,9 +16,13 @@ Filters:
   Exclude business_or_commercial_purpose = 1
   Keep Single Family (1–4 Units) via derived_dwelling_category
   Keep first-lien only (lien_status = 1)
+
+Usage:
+  python programs/fetch/hmda_county_fetch.py
+  python programs/fetch/hmda_county_fetch.py --years 2020 2021 --out data/raw/vintages/HMDA_2020_2021.csv
 """
 
-import io, time
+import argparse, io, os, time
 from typing import Iterable, List
 import pandas as pd, requests
 
@@ -141,9 +145,10 @@ def process_year(year: int) -> pd.DataFrame:
     yr = pd.concat(frames, ignore_index=True)
     return yr
 
-def run():
+def fetch_years(years: List[int] = YEARS) -> pd.DataFrame:
+    """County refi share pooled over `years` (fips5, orig_total, refi_total, refi_share)."""
     per_year = []
-    for y in YEARS:
+    for y in years:
         print(f"Processing HMDA via API for {y} ...")
         per_year.append(process_year(y))
     df = pd.concat(per_year, ignore_index=True)
@@ -170,9 +175,24 @@ def run():
     )
     w["refi_share"] = (w["refi_total"] / w["orig_total"]).where(w["orig_total"] > 0)
 
+    return w[["fips5", "orig_total", "refi_total", "refi_share"]]
+
+def run(years: List[int] = YEARS, out: str = OUTPUT_CSV):
+    w = fetch_years(years)
+    out_dir = os.path.dirname(out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
     # Save fips5 with aggregate totals and weighted refi_share
-    w[["fips5", "orig_total", "refi_total", "refi_share"]].to_csv(OUTPUT_CSV, index=False)
-    print(f"Saved: {OUTPUT_CSV} ({len(w):,} rows)")
+    w.to_csv(out, index=False)
+    print(f"Saved: {out} ({len(w):,} rows)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--years", type=int, nargs="+", default=YEARS,
+                    help="HMDA activity years to pool (default: 2020 2021)")
+    ap.add_argument("--out", default=OUTPUT_CSV)
+    args = ap.parse_args()
+    run(args.years, args.out)
 
 if __name__ == "__main__":
-    run()
+    main()
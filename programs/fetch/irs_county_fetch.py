@@ -5,6 +5,7 @@ Build county-level “market participation” proxies from IRS SOI:
   share_interest = N00300 / N1
 
 Default: COUNTY 2021 (no-AGI) direct. Optional: ZIP 2021 (no-AGI) + HUD ZIP→County crosswalk.
+Other tax years via --year (SOI file names carry the two-digit year).
 
 Usage:
   pip install pandas requests
@@ -16,8 +17,9 @@ Usage:
 import argparse, io, os, sys, warnings
 import pandas as pd, requests
 
-IRS_COUNTY_2021 = "https://www.irs.gov/pub/irs-soi/21incyallnoagi.csv"
-IRS_ZIP_2021    = "https://www.irs.gov/pub/irs-soi/21zpallnoagi.csv"
+DEFAULT_YEAR = 2021
+IRS_COUNTY_TMPL = "https://www.irs.gov/pub/irs-soi/{yy:02d}incyallnoagi.csv"
+IRS_ZIP_TMPL    = "https://www.irs.gov/pub/irs-soi/{yy:02d}zpallnoagi.csv"
 
 def _get(url):
     for _ in range(5):
@@ -41,8 +43,8 @@ def _need(df, cols, ctx):
     miss = [c for c in cols if _find(df,[c]) is None]
     if miss: raise ValueError(f"Missing {miss} in {ctx}. Got: {list(df.columns)[:15]} ...")
 
-def county_shares(df):
-    _need(df, ["N1","N00300","N00600"], "IRS COUNTY 2021")
+def county_shares(df, year=DEFAULT_YEAR):
+    _need(df, ["N1","N00300","N00600"], f"IRS COUNTY {year}")
     N1  = pd.to_numeric(df[_find(df,["N1"])], errors="coerce")
     N3  = pd.to_numeric(df[_find(df,["N00300"])], errors="coerce")
     N6  = pd.to_numeric(df[_find(df,["N00600"])], errors="coerce")
@@ -82,8 +84,14 @@ def zip_to_county(df_zip, xwalk, ratio="TOT_RATIO"):
     g["share_interest"]=(g["interest"]/g["returns_total"]).where(g["returns_total"]>0)
     return g[["fips","state_fips","county_fips","returns_total","share_dividend","share_interest"]]
 
+def fetch_county(year=DEFAULT_YEAR):
+    """County shares for one SOI tax year (no-AGI county file)."""
+    raw = pd.read_csv(io.BytesIO(_get(IRS_COUNTY_TMPL.format(yy=year % 100))), encoding="latin1")
+    return county_shares(raw, year)
+
 def main():
     ap = argparse.ArgumentParser()
+    ap.add_argument("--year", type=int, default=DEFAULT_YEAR, help="SOI tax year (default: 2021)")
     ap.add_argument("--mode", choices=["county","zip"], default="county")
     ap.add_argument("--crosswalk", default="", help="HUD ZIP→County CSV (needed if --mode zip)")
     ap.add_argument("--ratio-column", default="TOT_RATIO", help="TOT_RATIO or RES_RATIO")
@@ -96,11 +104,10 @@ def main():
         os.makedirs(out_dir, exist_ok=True)
 
     if args.mode=="county":
-        raw = pd.read_csv(io.BytesIO(_get(IRS_COUNTY_2021)), encoding="latin1")
-        out = county_shares(raw)
+        out = fetch_county(args.year)
     else:
         if not args.crosswalk: sys.exit("ERROR: --crosswalk required for --mode zip")
-        raw = pd.read_csv(io.BytesIO(_get(IRS_ZIP_2021)), encoding="latin1")
+        raw = pd.read_csv(io.BytesIO(_get(IRS_ZIP_TMPL.format(yy=args.year % 100))), encoding="latin1")
         xw  = pd.read_csv(args.crosswalk, dtype=str)
         out = zip_to_county(raw, xw, ratio=args.ratio_column)
 
@@ -0,0 +1,180 @@
+"""
+thesis-bank: one entry point for the fetch, cleaning, build and plotting scripts.
+
+Subcommands (stage and script modules are imported only once their subcommand runs, so --help
+and --dry-run do not load pandas, matplotlib or requests; the stage names and pipeline options
+come from pipeline.py, which imports none of them):
+  fetch acs|hmda|irs [ARGS]   run programs/fetch/<source>_county_fetch.py; ARGS go to that script
+  clean STAGE [STAGE ...]     run cleaning stages in pipeline order, in one process
+  build panel                 run the whole cleaning pipeline (pipeline.py) in one process
+  build sophistication-panel|call-bulk|incremental|market-dynamics [ARGS]
+                              run sophistication_panel.py / call_bulk.py / incremental.py /
+                              market_dynamics.py with ARGS
+  plot [ARGS]                 render the report figures that changed (figures.py)
+
+clean and build panel take --in-memory, --write, --call-source, --validate, --strict, --dtypes,
+--memory-report, --variant, --set and --dry-run as in pipeline.py.
+--profile (before the subcommand) profiles any subcommand: spans per pipeline stage and per
+function of the stage and fetch modules, pandas and HTTP op timers, and a stack sampler, written
+to --profile-dir as speedscope and folded flame-graph files with a top-N summary (profiling.py).
+Several stages given to one `clean` call share one interpreter and one pandas import, so the
+pipeline runner and Stata should batch them rather than call once per stage, e.g. from Stata:
+  shell python programs/thesis_bank.py clean instruments working_panel
+
+Usage (from the repository root):
+  python programs/thesis_bank.py --help
+  python programs/thesis_bank.py fetch acs --year 2022 --out data/raw/vintages/2022/ACS.csv
+  python programs/thesis_bank.py clean instruments working_panel --dry-run
+  python programs/thesis_bank.py build panel --in-memory --write all
+  python programs/thesis_bank.py plot -- --only 'loan_growth*' --jobs 4
+  python programs/thesis_bank.py --profile --profile-top 25 clean deposit_interest_rate instruments
+"""
+import argparse
+import importlib
+import os
+import sys
+from typing import List
+
+PROGRAMS_DIR = os.path.dirname(os.path.abspath(__file__))
+CLEAN_DIR = os.path.join(PROGRAMS_DIR, "clean")
+if CLEAN_DIR not in sys.path:
+    sys.path.insert(0, CLEAN_DIR)
+
+import pipeline  # noqa: E402
+import profiling  # noqa: E402
+
+# name -> (directory under programs/, module, entry function)
+FETCHERS = {
+    "acs": ("fetch", "acs_county_fetch", "main"),
+    "hmda": ("fetch", "hmda_county_fetch", "main"),
+    "irs": ("fetch", "irs_county_fetch", "main"),
+}
+BUILD_SCRIPTS = {
+    "sophistication-panel": ("clean", "sophistication_panel", "main"),
+    "call-bulk": ("clean", "call_bulk", "main"),
+    "incremental": ("clean", "incremental", "main"),
+    "market-dynamics": ("clean", "market_dynamics", "main"),
+}
+PLOT_SCRIPT = ("analysis", "figures", "main")
+
+
+def _import(directory: str, module: str):
+    path = os.path.join(PROGRAMS_DIR, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    mod = importlib.import_module(module)
+    profiling.instrument(mod)
+    return mod
+
+
+def _run_script(directory: str, module: str, func: str, argv: List[str]) -> None:
+    """Call a script's entry function with argv as its command line."""
+    mod = _import(directory, module)
+    argv = list(argv)
+    if argv[:1] == ["--"]:  # `plot -- --only ...`: options before any positional need the separator
+        argv = argv[1:]
+    saved = sys.argv
+    sys.argv = [mod.__file__] + argv
+    try:
+        getattr(mod, func)()
+    finally:
+        sys.argv = saved
+
+
+def _run_pipeline(stage_names: List[str], args: argparse.Namespace) -> None:
+    if args.set and not args.variant:
+        raise SystemExit("--set requires --variant")
+    pipeline.configure(args.dtypes, args.memory_report)
+    stages = pipeline.select_stages(stage_names)
+    if args.dry_run:
+        pipeline.print_plan(stages)
+    elif args.variant:
+        runs = _import("clean", "runs")
+        runs.run_variant(stages, args.variant, runs.parse_params(args.set), args.call_source,
+                         args.validate, args.strict)
+    elif args.in_memory:
+        pipeline.run_in_memory(stages, args.write, args.call_source, args.validate, args.strict)
+    else:
+        pipeline.run_files(stages, args.call_source, args.validate, args.strict)
+
+
+def _pipeline_options(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--in-memory", action="store_true",
+                   help="Pass DataFrames between stages instead of CSV round-trips.")
+    p.add_argument("--write", nargs="+", default=None,
+                   help="Outputs to write in --in-memory mode ('all' for every output).")
+    p.add_argument("--call-source", choices=pipeline.CALL_SOURCES, default="csv",
+                   help="Raw Call Report inputs: WRDS CSVs in data/raw, or the call_bulk.py dataset.")
+    p.add_argument("--validate", choices=pipeline.VALIDATE_MODES, default="full",
+                   help="Schema and invariant checks: every row, a sample of banks in large files, or none.")
+    p.add_argument("--strict", action="store_true", help="Treat validation warnings as errors.")
+    p.add_argument("--dtypes", choices=pipeline.DTYPE_MODES, default=pipeline.DTYPES,
+                   help="Hold frames under the compact dtype plan (dtypes.py) or as read_csv types them.")
+    p.add_argument("--memory-report", action="store_true",
+                   help="Print each stage's input and output memory before and after the dtype plan.")
+    p.add_argument("--variant", default=None,
+                   help="Build into the run directory data/runs/VARIANT/<key> (see runs.py).")
+    p.add_argument("--set", nargs="+", default=None, metavar="MODULE.NAME=VALUE",
+                   help="Override module constants for a --variant build.")
+    p.add_argument("--dry-run", action="store_true",
+                   help="Show the stages, their inputs (upstream, on disk, missing) and outputs, then exit.")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="thesis-bank", description="Fetch, clean, build and plot the thesis data.")
+    ap.add_argument("--profile", action="store_true", help="Profile the subcommand (profiling.py).")
+    ap.add_argument("--profile-dir", default=None, metavar="DIR",
+                    help="Profile output directory (default: data/profiles/<time>-<command>).")
+    ap.add_argument("--profile-top", type=int, default=15, help="Ops and spans in the profile summary.")
+    ap.add_argument("--profile-interval", type=float, default=5.0, help="Stack sampling interval in ms.")
+    ap.add_argument("--profile-cprofile", action="store_true", help="Also record cProfile stats (profile.prof).")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fetch", help="Download a county source (arguments after the source go to its script).")
+    p.add_argument("source", choices=list(FETCHERS))
+    p.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("clean", help="Run cleaning stages in pipeline order.")
+    p.add_argument("stages", nargs="+", choices=pipeline.STAGE_NAMES, metavar="STAGE",
+                   help=f"One or more of: {', '.join(pipeline.STAGE_NAMES)}.")
+    _pipeline_options(p)
+
+    p = sub.add_parser("build", help="Build the working panel or another derived dataset.")
+    targets = p.add_subparsers(dest="target", required=True)
+    _pipeline_options(targets.add_parser("panel", help="Run the whole cleaning pipeline."))
+    for target, (_, module, _) in BUILD_SCRIPTS.items():
+        t = targets.add_parser(target, help=f"Run {module}.py (remaining arguments go to the script).")
+        t.add_argument("args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("plot", help="Render the report figures from the cached aggregates.")
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    return ap
+
+
+def main(argv: List[str] = None) -> None:
+    args = build_parser().parse_args(argv)
+    if not args.profile:
+        _dispatch(args)
+        return
+    label = "-".join(str(x) for x in (args.command, getattr(args, "source", None) or getattr(args, "target", None)) if x)
+    with profiling.profiled(label, args.profile_dir, interval=args.profile_interval / 1000,
+                            top=args.profile_top, cprofile=args.profile_cprofile):
+        _dispatch(args)
+
+
+def _dispatch(args: argparse.Namespace) -> None:
+    if args.command == "fetch":
+        _run_script(*FETCHERS[args.source], args.args)
+    elif args.command == "clean":
+        _run_pipeline(args.stages, args)
+    elif args.command == "build":
+        if args.target == "panel":
+            _run_pipeline(pipeline.STAGE_NAMES, args)
+        else:
+            _run_script(*BUILD_SCRIPTS[args.target], args.args)
+    elif args.command == "plot":
+        _run_script(*PLOT_SCRIPT, args.args)
+
+
+if __name__ == "__main__":
+    main()
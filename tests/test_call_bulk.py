@@ -0,0 +1,83 @@
+"""Bulk Call Report ingestion (programs/clean/call_bulk.py) on a small synthetic FFIEC archive."""
+import io
+import os
+import sys
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "programs", "clean"))
+
+import call_bulk  # noqa: E402
+
+STAMP = "03312023"
+POR = (
+    '"IDRSSD"\t"FDIC Certificate Number"\t"Financial Institution Filing Type"\t'
+    '"Last Date/Time Submission Updated On"\n'
+    "101\t5001\t41\t2023-04-28T10:15:00\n"
+    "202\t5002\t51\t2023-05-01T09:00:00\n"
+    "303\t\t31\t2023-05-02T12:30:00\n"
+)
+# Schedule files: MDRM codes, then item descriptions, then one row per filer
+SCHEDULE_RC = (
+    '"IDRSSD"\t"RCON2200"\t"RCON2170"\n'
+    '"Reporting bank"\t"TOTAL DEPOSITS"\t"TOTAL ASSETS"\n'
+    "101\t1500\t2000\n"
+    "202\tCONF\t4000\n"
+    "303\t\t6000\n"
+)
+SCHEDULE_RI = (
+    '"IDRSSD"\t"RIAD4508"\n'
+    '"Reporting bank"\t"INTEREST ON TRANSACTION ACCOUNTS"\n'
+    "202\t12\n"
+    "101\t7\n"
+)
+CODES = ["RCON2200", "RCON2170", "RIAD4508", "RCON6636"]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr(f"FFIEC CDR Call Bulk POR {STAMP}.txt", POR)
+        zf.writestr(f"FFIEC CDR Call Schedule RC {STAMP}.txt", SCHEDULE_RC)
+        zf.writestr(f"FFIEC CDR Call Schedule RI {STAMP}.txt", SCHEDULE_RI)
+    path = tmp_path / f"FFIEC CDR Call Bulk All Schedules {STAMP}.zip"
+    path.write_bytes(buf.getvalue())
+    return str(path)
+
+
+def test_read_quarter_joins_por_and_schedules(archive):
+    df, missing = call_bulk.read_quarter(archive, CODES)
+
+    assert missing == ["RCON6636"]
+    assert list(df["rssd9001"]) == [101, 202, 303]
+    assert (df["rssd9999"] == pd.Timestamp("2023-03-31")).all()
+    assert list(df["rssd9050"]) == [5001, 5002, pd.NA]
+    # Schedules join on rssd9001 whatever their row order
+    np.testing.assert_array_equal(df["riad4508"], [7, 12, np.nan])
+    np.testing.assert_array_equal(df["rcon2170"], [2000, 4000, 6000])
+    # CONF and blank values are missing
+    np.testing.assert_array_equal(df["rcon2200"], [1500, np.nan, np.nan])
+    assert df["rcon6636"].isna().all()
+
+
+def test_ingest_csv_and_load_extract(archive, tmp_path):
+    out = str(tmp_path / "call_bulk")
+    results = call_bulk.ingest([archive], out, CODES, fmt="csv", workers=1)
+
+    assert [r["quarter"] for r in results] == ["2023Q1"]
+    assert os.path.exists(os.path.join(out, "quarter=2023Q1", "part.csv"))
+    assert call_bulk.partitions(out) == [os.path.join(out, "quarter=2023Q1", "part.csv")]
+
+    extract = call_bulk.load_extract("rcon_deposit", out)
+    keys, codes = call_bulk.EXTRACTS["rcon_deposit"]
+    assert list(extract.columns) == keys + [c.lower() for c in codes]
+    expected = {**call_bulk.KEY_DTYPES, "rcon2200": "float64", "rcon6636": "float64"}
+    assert {c: str(t) for c, t in extract.dtypes.items()} == {c: expected[c] for c in extract.columns}
+    assert list(extract["rssd9001"]) == [101, 202, 303]
+    assert list(extract["rssd9050"]) == [5001, 5002, pd.NA]
+    assert extract["rssdsubmissiondate"].iloc[0] == pd.Timestamp("2023-04-28 10:15:00")
+    np.testing.assert_array_equal(extract["rcon2200"], [1500, np.nan, np.nan])